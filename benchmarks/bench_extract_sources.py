@@ -0,0 +1,84 @@
+"""
+Benchmark extracting the four independent sources of main.py one after another vs concurrently, as nodes of a pipeline
+with one worker and with several workers, against a local S3 stand-in with injected latency (no AWS or network access
+needed).
+
+    python -m benchmarks.bench_extract_sources --latency 0.5 --wind-latency 1.0
+"""
+import argparse
+import gzip
+import json
+import tempfile
+import time
+from time import perf_counter
+from benchmarks.local_s3 import LocalS3Client
+from src.utils.constants import BUCKET_NAME, H3_POLYGONS_LVL_8, H3_POLYGONS_LVL_8_9_10, SERVICE_REQUEST_DATA
+from src.utils.extract_data import get_city_geojson, get_sr_data
+from src.utils.pipeline import Pipeline
+
+
+# The timeout and retries of the extracts in main.py
+EXTRACT_RETRY_POLICY = {'timeout': 600, 'retries': 2}
+
+
+def write_sources(s3_client):
+
+    features = [{'type': 'Feature', 'properties': {'index': f'88ad36{i:09x}', 'resolution': 8},
+                 'geometry': {'type': 'Point', 'coordinates': [18.5, -33.9]}} for i in range(1000)]
+    geojson = json.dumps({'type': 'FeatureCollection', 'features': features}).encode('utf-8')
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=H3_POLYGONS_LVL_8_9_10, Body=geojson)
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=H3_POLYGONS_LVL_8, Body=geojson)
+
+    rows = ''.join(f'{i},{9e9 + i},-33.9,18.5\n' for i in range(10000))
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=SERVICE_REQUEST_DATA,
+                         Body=gzip.compress(f',reference_number,latitude,longitude\n{rows}'.encode('utf-8')))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--latency', type=float, default=0.5,
+                        help='seconds added to every S3 request')
+    parser.add_argument('--wind-latency', type=float, default=1.0,
+                        help='seconds taken by the (simulated) wind data download')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    def get_wind_data_stand_in():
+        time.sleep(args.wind_latency)
+        return 'wind data'
+
+    with tempfile.TemporaryDirectory() as root_dir:
+        s3_client = LocalS3Client(root_dir, latency=args.latency)
+        write_sources(s3_client)
+
+        query = "SELECT * FROM S3Object[*]['features'][*] as obj"
+
+        def run_extracts(max_workers):
+            # A new pipeline store, so every extract runs
+            pipeline = Pipeline(tempfile.mkdtemp(dir=root_dir), max_workers=max_workers)
+            pipeline.add('city_polygons', get_city_geojson,
+                         params=dict(bucket_name=BUCKET_NAME, object_key=H3_POLYGONS_LVL_8_9_10,
+                                     query_expression=f'{query} WHERE obj.properties.resolution = 8'),
+                         resources={'s3_client': s3_client}, **EXTRACT_RETRY_POLICY)
+            pipeline.add('validation_polygons', get_city_geojson,
+                         params=dict(bucket_name=BUCKET_NAME, object_key=H3_POLYGONS_LVL_8, query_expression=query),
+                         resources={'s3_client': s3_client}, **EXTRACT_RETRY_POLICY)
+            pipeline.add('sr_data', get_sr_data,
+                         params=dict(bucket_name=BUCKET_NAME, object_key=SERVICE_REQUEST_DATA),
+                         resources={'s3_client': s3_client}, **EXTRACT_RETRY_POLICY)
+            pipeline.add('wind_data', get_wind_data_stand_in, **EXTRACT_RETRY_POLICY)
+
+            start_time = perf_counter()
+            pipeline.run()
+            return perf_counter() - start_time
+
+        serial_time = run_extracts(max_workers=1)
+        concurrent_time = run_extracts(max_workers=args.workers)
+
+    print(f'    serial : {serial_time:.2f} seconds')
+    print(f'concurrent : {concurrent_time:.2f} seconds')
+
+
+if __name__ == '__main__':
+    main()
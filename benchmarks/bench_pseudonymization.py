@@ -0,0 +1,65 @@
+"""
+Benchmark the throughput of the pseudonymization of the reference numbers: the per row uuid4 it replaces, the keyed
+SipHash pseudonyms of float64 reference numbers, the keyed BLAKE2b pseudonyms of text identifiers and the persistent
+mapping table (first run issuing the pseudonyms, second run looking them up).
+
+    python -m benchmarks.bench_pseudonymization --sizes 1M,10M
+"""
+import argparse
+import tempfile
+import uuid
+from pathlib import Path
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from benchmarks.bench_suite import parse_size
+from src.utils.pseudonymization import Pseudonymizer
+
+
+def timed(func, values):
+
+    start_time = perf_counter()
+    func(values)
+    seconds = perf_counter() - start_time
+
+    return seconds, len(values) / seconds
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1M,5M', help='comma separated numbers of rows, e.g. 1M,10M')
+    parser.add_argument('--uuid-rows', default='1M', help='rows of the (slow) uuid4 baseline')
+    args = parser.parse_args()
+
+    pseudonymizer = Pseudonymizer(key=b'benchmark key')
+    rng = np.random.default_rng(0)
+    print(f'{"rows":>10} {"method":<24} {"seconds":>9} {"rows/s":>12}')
+
+    uuid_rows = parse_size(args.uuid_rows)
+    reference_numbers = pd.Series(9_100_000_000 + rng.permutation(uuid_rows).astype(np.float64))
+    seconds, rate = timed(lambda values: values.apply(lambda _: uuid.uuid4().hex), reference_numbers)
+    print(f'{uuid_rows:>10} {"uuid4 per row":<24} {seconds:9.3f} {rate:12,.0f}')
+
+    for size in args.sizes.split(','):
+        n_rows = parse_size(size)
+        reference_numbers = pd.Series(9_100_000_000 + rng.permutation(n_rows).astype(np.float64))
+        text_ids = reference_numbers.astype(np.int64).astype(str)
+
+        cases = [('keyed siphash (float)', pseudonymizer.pseudonymize, reference_numbers),
+                 ('keyed blake2b (text)', pseudonymizer.pseudonymize, text_ids)]
+        for name, func, values in cases:
+            seconds, rate = timed(func, values)
+            print(f'{n_rows:>10} {name:<24} {seconds:9.3f} {rate:12,.0f}')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mapping_path = Path(tmp_dir) / 'pseudonyms.parquet'
+            for name in ['mapping table (issue)', 'mapping table (lookup)']:
+                mapped = Pseudonymizer(key=b'benchmark key', mapping_path=mapping_path)
+                seconds, rate = timed(mapped.pseudonymize, reference_numbers)
+                mapped.save()
+                print(f'{n_rows:>10} {name:<24} {seconds:9.3f} {rate:12,.0f}')
+
+
+if __name__ == '__main__':
+    main()
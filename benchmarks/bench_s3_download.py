@@ -0,0 +1,45 @@
+"""
+Benchmark serial vs concurrent range GET downloads of a large object from a local S3 stand-in.
+
+    python -m benchmarks.bench_s3_download --size-mb 64 --latency 0.05 --bandwidth-mb 20
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+from benchmarks.local_s3 import LocalS3Client
+from src.utils.extract_data import download_s3_object
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds added to every request')
+    parser.add_argument('--bandwidth-mb', type=float, default=20,
+                        help='MB/s of a single request')
+    parser.add_argument('--part-size-mb', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root_dir:
+        s3_client = LocalS3Client(root_dir, latency=args.latency,
+                                  bandwidth=args.bandwidth_mb * 1024 ** 2)
+        data = os.urandom(args.size_mb * 1024 ** 2)
+        s3_client.put_object(Bucket='bench', Key='object.bin', Body=data)
+
+        runs = {
+            'serial': dict(part_size=len(data), max_workers=1),
+            'range_get': dict(part_size=args.part_size_mb * 1024 ** 2, max_workers=args.workers),
+        }
+        for name, kwargs in runs.items():
+            start_time = perf_counter()
+            buffer = download_s3_object('bench', 'object.bin', s3_client, **kwargs)
+            run_time = perf_counter() - start_time
+            assert buffer.read() == data
+            print(f'{name:>10} : {run_time:.2f} seconds ({args.size_mb / run_time:.1f} MB/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Benchmark the transformations on synthetic Cape Town scale data (no S3 or network access needed) and compare the
+results with a stored baseline. The wall time (best of --repeat runs) and the peak traced Python memory of every
+function are written to a JSON file, and any function slower or bigger than the baseline by more than the tolerance
+is flagged as a regression (exit code 1).
+
+    python -m benchmarks.bench_suite --sizes 10k,100k,1M --save-baseline
+    python -m benchmarks.bench_suite --sizes 10k,100k,1M,10M
+
+The peak memory is measured with tracemalloc in a separate run, it covers numpy and pandas allocations but not the
+memory allocated inside GEOS.
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+from shapely.geometry import Point
+from benchmarks.synthetic_data import generate_hexagons, generate_raw_wind_data, generate_sr_data
+from src.utils.constants import WIND_STATIONS
+from src.utils.transformations import (anonymize_sr_data, clean_wind_data, filter_sr_data_by_distance,
+                                       join_sr_to_gpd_data_extract, merge_wind_data)
+from src.utils.validation import validate_data_extract
+
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+SIZE_SUFFIXES = {'k': 1_000, 'M': 1_000_000}
+
+
+def parse_size(size):
+    """
+    This function converts a size label such as 10k or 1M to a number of rows.
+    """
+
+    if size[-1] in SIZE_SUFFIXES:
+        return int(float(size[:-1]) * SIZE_SUFFIXES[size[-1]])
+
+    return int(size)
+
+
+def measure(func, make_kwargs, repeat=3, trace_memory=True):
+    """
+    This function times a function on fresh inputs, as the best of repeat runs, and measures its peak traced memory
+    in one more run. The inputs are built by make_kwargs outside of the measurements.
+
+    Input Parameters
+    ----------------
+    func : callable
+    make_kwargs : callable (returns the keyword arguments of func)
+    repeat : int
+    trace_memory : bool
+
+    Output
+    ------
+    result : the return value of the first run
+    metrics : dict (time_s and peak_mb)
+    """
+
+    result, times = None, []
+    for run in range(repeat):
+        kwargs = make_kwargs()
+        gc.collect()
+        start_time = perf_counter()
+        value = func(**kwargs)
+        times.append(perf_counter() - start_time)
+        if run == 0:
+            result = value
+        del kwargs, value
+
+    peak_mb = None
+    if trace_memory:
+        kwargs = make_kwargs()
+        gc.collect()
+        tracemalloc.start()
+        func(**kwargs)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+        del kwargs
+
+    return result, {'time_s': min(times), 'peak_mb': peak_mb}
+
+
+def run_fixed_size_cases(hexagons, repeat, trace_memory):
+    # The wind data and the hexagons do not depend on the number of service requests
+    raw_wind_df = generate_raw_wind_data()
+    extract = hexagons.assign(resolution=8)
+    cases = {
+        'clean_wind_data': (clean_wind_data, lambda: {'df': raw_wind_df.copy()}),
+        'validate_data_extract[hash]': (validate_data_extract, lambda: {
+            'filtered_extract': extract, 'validation_extract': hexagons, 'method': 'hash'}),
+        'validate_data_extract[equals]': (validate_data_extract, lambda: {
+            'filtered_extract': extract, 'validation_extract': hexagons, 'method': 'equals'}),
+    }
+
+    results = {}
+    for name, (func, make_kwargs) in cases.items():
+        _, results[name] = measure(func, make_kwargs, repeat, trace_memory)
+        print(f'{"fixed":>6} {name:<40} {results[name]["time_s"]:9.4f} s')
+
+    return results
+
+
+def run_sr_cases(n_rows, hexagons, wind_df, wind_long_df, repeat, trace_memory):
+    """
+    This function benchmarks the stages that scale with the number of service requests, chained like the pipeline.
+    The wind merge and anonymization run on every located request, not only on the subsample of a suburb.
+    """
+
+    sr_data = generate_sr_data(n_rows)
+    location_centroid = Point(WIND_STATIONS['bellville_south_aqm_site'][::-1])
+
+    results = {}
+
+    def record(name, func, make_kwargs):
+        result, results[name] = measure(func, make_kwargs, repeat, trace_memory)
+        print(f'{n_rows:>6} {name:<40} {results[name]["time_s"]:9.4f} s')
+        return result
+
+    record('join_sr_to_gpd_data_extract[sjoin]', join_sr_to_gpd_data_extract,
+           lambda: {'sr_data': sr_data.copy(), 'gpd_extract': hexagons, 'engine': 'sjoin'})
+    joined = record('join_sr_to_gpd_data_extract[h3]', join_sr_to_gpd_data_extract,
+                    lambda: {'sr_data': sr_data.copy(), 'gpd_extract': hexagons, 'engine': 'h3',
+                             'cross_check_sample': 0})
+    del sr_data
+    record('filter_sr_data_by_distance', filter_sr_data_by_distance,
+           lambda: {'sr_data': joined, 'location_cetroid': location_centroid})
+
+    located = joined[joined['latitude'].notna()].drop(columns=joined.geometry.name)
+    del joined
+    record('merge_wind_data[suburb]', merge_wind_data,
+           lambda: {'sr_df': located.copy(), 'wind_df': wind_df, 'suburb': 'bellville'})
+    merged = record('merge_wind_data[nearest]', merge_wind_data,
+                    lambda: {'sr_df': located.copy(), 'wind_df': wind_long_df})
+    del located
+    record('anonymize_sr_data', anonymize_sr_data,
+           lambda: {'df': merged.copy(), 'lat_col': 'latitude', 'lon_col': 'longitude', 'rng': 0})
+
+    return results
+
+
+def compare_to_baseline(results, baseline, time_tolerance=0.25, memory_tolerance=0.25, min_time=0.01):
+    """
+    This function compares benchmark results with a baseline and returns the regressions. Timings shorter than
+    min_time in the baseline are too noisy to compare and are skipped.
+
+    Input Parameters
+    ----------------
+    results : dict (the output of this script)
+    baseline : dict (an earlier output of this script)
+    time_tolerance : float (the relative slowdown above which a time is a regression)
+    memory_tolerance : float (the relative growth above which a peak memory is a regression)
+    min_time : float (seconds)
+
+    Output
+    ------
+    regressions : list[str]
+    """
+
+    regressions = []
+    print(f'\n{"size":>6} {"function":<40} {"baseline":>9} {"now":>9} {"ratio":>6}')
+    for size, cases in results['results'].items():
+        for name, metrics in cases.items():
+            reference = baseline.get('results', {}).get(size, {}).get(name)
+            if reference is None:
+                continue
+
+            time_ratio = metrics['time_s'] / reference['time_s'] if reference['time_s'] else None
+            flag = ''
+            if reference['time_s'] >= min_time and time_ratio > 1 + time_tolerance:
+                flag = 'SLOWER'
+                regressions.append(f'{size} {name} : {time_ratio:.2f}x the baseline time')
+            if metrics['peak_mb'] and reference['peak_mb'] and \
+                    metrics['peak_mb'] > reference['peak_mb'] * (1 + memory_tolerance) + 1:
+                flag = f'{flag} MORE MEMORY'.strip()
+                regressions.append(
+                    f'{size} {name} : {metrics["peak_mb"]:.1f} MB peak memory vs {reference["peak_mb"]:.1f} MB')
+            print(f'{size:>6} {name:<40} {reference["time_s"]:9.4f} {metrics["time_s"]:9.4f} '
+                  f'{time_ratio or 0:6.2f} {flag}')
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10k,100k,1M',
+                        help='comma separated numbers of service requests, e.g. 10k,100k,1M,10M')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory runs')
+    parser.add_argument('--output', type=Path, default=RESULTS_DIR / 'latest.json')
+    parser.add_argument('--baseline', type=Path, default=RESULTS_DIR / 'baseline.json')
+    parser.add_argument('--save-baseline', action='store_true', help='also store the results as the baseline')
+    parser.add_argument('--time-tolerance', type=float, default=0.25)
+    parser.add_argument('--memory-tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    trace_memory = not args.no_memory
+    hexagons = generate_hexagons()
+    wind_df = clean_wind_data(generate_raw_wind_data())
+    wind_long_df = clean_wind_data(generate_raw_wind_data(), long_format=True)
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'results': {'fixed': run_fixed_size_cases(hexagons, args.repeat, trace_memory)},
+    }
+    for size in args.sizes.split(','):
+        results['results'][size] = run_sr_cases(
+            parse_size(size), hexagons, wind_df, wind_long_df, args.repeat, trace_memory)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nResults written to {args.output}')
+
+    regressions = []
+    if args.baseline.exists() and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.time_tolerance, args.memory_tolerance)
+    elif args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Baseline written to {args.baseline}')
+    else:
+        print(f'No baseline at {args.baseline}, run with --save-baseline to create one')
+
+    if regressions:
+        print('\nRegressions :\n  ' + '\n  '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+from pathlib import Path
+import botocore.exceptions
+
+
+class LocalS3Client:
+    """
+    This class is a filesystem backed stand-in for the parts of the boto3 S3 client used by extract_data
+    (head_object, get_object with byte ranges and select_object_content), with a configurable per-request latency
+    and bandwidth so downloads can be benchmarked without AWS.
+
+    Objects are read from root_dir / bucket_name / object_key.
+
+    Input Parameters
+    ----------------
+    root_dir : str or pathlib.Path
+    latency : float (seconds added to every request)
+    bandwidth : float (bytes per second of each request, None for unlimited)
+    """
+
+    def __init__(self, root_dir, latency=0.0, bandwidth=None):
+
+        self.root_dir = Path(root_dir)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.request_count = 0
+        self._lock = threading.Lock()
+
+    def _path(self, bucket_name, object_key):
+        return self.root_dir / bucket_name / object_key
+
+    def _wait(self, n_bytes=0):
+        with self._lock:
+            self.request_count += 1
+        delay = self.latency
+        if self.bandwidth:
+            delay += n_bytes / self.bandwidth
+        if delay:
+            time.sleep(delay)
+
+    def put_object(self, Bucket, Key, Body):
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(Body)
+
+    def head_object(self, Bucket, Key):
+        self._wait()
+        data = self._path(Bucket, Key).read_bytes()
+        return {'ContentLength': len(data), 'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        data = self._path(Bucket, Key).read_bytes()
+        if IfMatch is not None and IfMatch.strip('"') != hashlib.md5(data).hexdigest():
+            # The error S3 returns when the object no longer has the ETag of the request
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'PreconditionFailed', 'Message': 'At least one of the pre-conditions you '
+                                                                    'specified did not hold'}}, 'GetObject')
+        if Range is not None:
+            start, end = re.fullmatch(r'bytes=(\d+)-(\d+)', Range).groups()
+            data = data[int(start):int(end) + 1]
+        self._wait(len(data))
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def select_object_content(self, Bucket, Key, Expression, ExpressionType, InputSerialization,
+                              OutputSerialization):
+        """
+        This function emulates S3 Select over a GeoJSON document for the queries used by main.py, i.e.
+        SELECT * FROM S3Object[*]['features'][*] as obj [WHERE obj.properties.<name> = <value>]
+        """
+
+        features = json.loads(self._path(Bucket, Key).read_text())['features']
+        condition = re.search(r'WHERE\s+obj\.properties\.(\w+)\s*=\s*([\w.\'"]+)', Expression)
+        if condition:
+            name, value = condition.groups()
+            value = json.loads(value.replace("'", '"'))
+            features = [f for f in features if f['properties'].get(name) == value]
+
+        payload = ''.join(json.dumps(f) + '\n' for f in features).encode('utf-8')
+        self._wait(len(payload))
+
+        # S3 Select streams the result as several record events
+        events = [{'Records': {'Payload': payload[i:i + 65536]}}
+                  for i in range(0, len(payload), 65536)]
+
+        return {'Payload': events + [{'End': {}}]}
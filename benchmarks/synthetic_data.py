@@ -0,0 +1,148 @@
+"""
+Generators of synthetic Cape Town scale service request, hexagon and wind data with the same columns and types as the
+extracts, so the transformations can be benchmarked without S3 or network access.
+"""
+import geopandas as gpd
+import h3
+import numpy as np
+import pandas as pd
+from shapely.geometry import Polygon
+from src.utils.constants import WIND_STATIONS
+
+
+# (min_lat, max_lat, min_lon, max_lon) of the City of Cape Town
+CAPE_TOWN_BOUNDS = (-34.36, -33.47, 18.30, 18.98)
+
+# Share of the service requests without a location, close to the share in sr_hex.csv.gz
+MISSING_LOCATION_SHARE = 0.22
+
+DEPARTMENTS = {
+    'Water and Sanitation': ['Sewer: Blocked/Overflow', 'Water Leak', 'No Water Supply', 'Water Meter Faulty'],
+    'Electricity Generation and Distribution': ['Street Lights', 'No Power', 'Cable Theft'],
+    'Roads Infrastructure Management': ['Pothole&Defect Road Foot Bic Way/Kerbs', 'Stormwater Drain Blocked'],
+    'Solid Waste Management': ['Refuse Bin Not Collected', 'Illegal Dumping', 'Dead Animal'],
+    'Recreation and Parks': ['Grass Cutting', 'Tree Felling'],
+}
+SUBURBS = ['BELLVILLE SOUTH', 'KHAYELITSHA', 'GOODWOOD', 'ATLANTIS', 'BOTHASIG', 'SOMERSET WEST', 'TABLE VIEW',
+           'WALLACEDENE', 'PLATTEKLOOF', 'MOLTENO', 'ATHLONE', 'MITCHELLS PLAIN']
+
+
+def generate_hexagons(resolution=8, bounds=CAPE_TOWN_BOUNDS):
+    """
+    This function generates the H3 hexagons covering a bounding box, with the columns of the city polygons extract.
+
+    Input Parameters
+    ----------------
+    resolution : int
+    bounds : tuple ((min_lat, max_lat, min_lon, max_lon))
+
+    Output
+    ------
+    gdf : geopandas.GeoDataFrame (index, centroid_lat, centroid_lon, geometry)
+    """
+
+    min_lat, max_lat, min_lon, max_lon = bounds
+    area = {'type': 'Polygon', 'coordinates': [[(min_lat, min_lon), (min_lat, max_lon), (max_lat, max_lon),
+                                                (max_lat, min_lon), (min_lat, min_lon)]]}
+    cells = sorted(h3.polyfill(area, resolution))
+    centroids = np.array([h3.h3_to_geo(cell) for cell in cells])
+    polygons = [Polygon(h3.h3_to_geo_boundary(cell, geo_json=True)) for cell in cells]
+
+    return gpd.GeoDataFrame({'index': cells, 'centroid_lat': centroids[:, 0], 'centroid_lon': centroids[:, 1]},
+                            geometry=polygons, crs='EPSG:4326')
+
+
+def generate_sr_data(n_rows, bounds=CAPE_TOWN_BOUNDS, year=2020, seed=0):
+    """
+    This function generates service requests typed like the chunks of extract_data.get_sr_data_chunks: categorical
+    organisation columns, float32 coordinates (MISSING_LOCATION_SHARE of them missing) and UTC timestamps within a
+    year, with completion 1 hour to 30 days after creation.
+
+    Input Parameters
+    ----------------
+    n_rows : int
+    bounds : tuple ((min_lat, max_lat, min_lon, max_lon))
+    year : int
+    seed : int
+
+    Output
+    ------
+    sr_data : Pandas.DataFrame
+    """
+
+    rng = np.random.default_rng(seed)
+    min_lat, max_lat, min_lon, max_lon = bounds
+
+    latitude = rng.uniform(min_lat, max_lat, n_rows).astype(np.float32)
+    longitude = rng.uniform(min_lon, max_lon, n_rows).astype(np.float32)
+    missing = rng.random(n_rows) < MISSING_LOCATION_SHARE
+    latitude[missing] = np.nan
+    longitude[missing] = np.nan
+
+    start = pd.Timestamp(f'{year}-01-01', tz='UTC')
+    seconds_in_year = int((pd.Timestamp(f'{year + 1}-01-01', tz='UTC') - start).total_seconds())
+    creation = start + pd.to_timedelta(rng.integers(0, seconds_in_year, n_rows), unit='s')
+    completion = creation + pd.to_timedelta(rng.integers(3600, 30 * 86400, n_rows), unit='s')
+
+    departments = list(DEPARTMENTS)
+    department_codes = rng.integers(0, len(departments), n_rows)
+    codes = [code for department in departments for code in DEPARTMENTS[department]]
+    first_code = np.cumsum([0] + [len(DEPARTMENTS[department]) for department in departments])
+    code_codes = first_code[department_codes] + (rng.random(n_rows) * np.diff(first_code)[department_codes]).astype(int)
+
+    def categorical(codes_array, categories):
+        return pd.Categorical.from_codes(codes_array, categories)
+
+    return pd.DataFrame({
+        'reference_number': 9_100_000_000 + rng.permutation(n_rows).astype(np.float64),
+        'creation_timestamp': creation,
+        'completion_timestamp': completion,
+        'directorate': categorical(department_codes, [f'{department} Directorate' for department in departments]),
+        'department': categorical(department_codes, departments),
+        'branch': categorical(department_codes, [f'{department} Branch' for department in departments]),
+        'section': categorical(department_codes, [f'{department} Section' for department in departments]),
+        'code_group': categorical(np.zeros(n_rows, dtype=int), ['TD Customer complaint groups']),
+        'code': categorical(code_codes, codes),
+        'cause_code_group': categorical(department_codes, [f'{department} Causes' for department in departments]),
+        'cause_code': categorical(code_codes, [f'{code} Cause' for code in codes]),
+        'official_suburb': categorical(rng.integers(0, len(SUBURBS), n_rows), SUBURBS),
+        'latitude': latitude,
+        'longitude': longitude,
+    })
+
+
+def generate_raw_wind_data(year=2020, stations=WIND_STATIONS, missing_share=0.05, seed=0):
+    """
+    This function generates hourly wind readings of the AQM sites in the shape extract_data.get_wind_data returns:
+    the three header rows of the spreadsheet as a column MultiIndex, the date as text, float32 readings with NaN for
+    missing readings and 8 footer rows.
+
+    Input Parameters
+    ----------------
+    year : int
+    stations : dict (the column prefixes of the sites, see constants.WIND_STATIONS)
+    missing_share : float
+    seed : int
+
+    Output
+    ------
+    raw_wind_df : Pandas.DataFrame
+    """
+
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(f'{year}-01-01', f'{year}-12-31 23:00', freq='h')
+    n_hours = len(timestamps)
+
+    # The spreadsheet ends with 8 footer rows, which clean_wind_data drops
+    dates = np.full(n_hours + 8, None, dtype=object)
+    dates[:n_hours] = timestamps.strftime('%d/%m/%Y %H:%M')
+    columns = {('Date & Time', 'Unnamed: 0_level_1', 'Unnamed: 0_level_2'): dates}
+    for station in stations:
+        site = station.replace('_', ' ').title()
+        for measure, unit, high in [('Wind Dir V', 'Deg', 360), ('Wind Speed V', 'm/s', 15)]:
+            readings = np.full(n_hours + 8, np.nan, dtype=np.float32)
+            readings[:n_hours] = rng.uniform(0, high, n_hours).round(1)
+            readings[:n_hours][rng.random(n_hours) < missing_share] = np.nan
+            columns[(site, measure, unit)] = readings
+
+    return pd.DataFrame(columns)
@@ -1,17 +1,14 @@
-import boto3
-import logging
+import argparse
 import configparser
+import logging
 import os
-import geopandas as gpd
-import pandas as pd
+import sys
 from pathlib import Path
 from src.utils.constants import BUCKET_NAME, H3_POLYGONS_LVL_8_9_10, H3_POLYGONS_LVL_8, SERVICE_REQUEST_DATA, WIND_DATA
-from src.utils.extract_data import get_city_geojson, get_sr_data, get_wind_data
-from src.utils.validation import validate_data_extract
-from src.utils.helper_functions import get_location_centroid
-from src.utils.transformations import join_sr_to_gpd_data_extract, filter_sr_data_by_distance, clean_wind_data, merge_wind_data, anonymize_sr_data
 from src.utils.helper_functions import benchmark
-from IPython.display import display
+from src.utils.lazy_imports import LazyFunction, import_time_report
+from src.utils.metrics import export_metrics
+from src.utils.pipeline import Pipeline
 
 
 # Set paths
@@ -20,137 +17,408 @@ DATA_DIR = HOME_DIR / 'data'
 LOGS_DIR = HOME_DIR / 'logs'
 CONFIG_DIR = HOME_DIR / 'src' / 'config'
 
-# Setup logging
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s %(levelname)s %(message)s',
-                    datefmt='%Y-%m-%d %H:%M:%S',
-                    filename=LOGS_DIR / 'cpt_ds_challenge.log'
-                    )
+
+# The stages are only imported when they run, so a run that only needs a few stages (or loads their outputs from
+# data/pipeline) does not import boto3, geopandas, geopy or pyproj
+create_s3_client = LazyFunction('src.utils.extract_data', 'create_s3_client')
+get_object_etag = LazyFunction('src.utils.extract_data', 'get_object_etag')
+get_city_polygons = LazyFunction('src.utils.extract_data', 'get_city_polygons')
+get_city_hex_store = LazyFunction('src.utils.hex_store', 'get_city_hex_store')
+get_sr_data = LazyFunction('src.utils.extract_data', 'get_sr_data')
+get_wind_data = LazyFunction('src.utils.extract_data', 'get_wind_data')
+get_url_version = LazyFunction('src.utils.extract_data', 'get_url_version')
+ExtractCache = LazyFunction('src.utils.cache', 'ExtractCache')
+validate_data_extract = LazyFunction('src.utils.validation', 'validate_data_extract')
+get_location_centroid = LazyFunction('src.utils.helper_functions', 'get_location_centroid')
+join_sr_to_gpd_data_extract = LazyFunction('src.utils.transformations', 'join_sr_to_gpd_data_extract')
+filter_sr_data_by_distance = LazyFunction('src.utils.transformations', 'filter_sr_data_by_distance')
+clean_wind_data = LazyFunction('src.utils.transformations', 'clean_wind_data')
+merge_wind_data = LazyFunction('src.utils.transformations', 'merge_wind_data')
+anonymize_sr_data = LazyFunction('src.utils.transformations', 'anonymize_sr_data')
+load_pseudonymization_key = LazyFunction('src.utils.pseudonymization', 'load_pseudonymization_key')
+SRSpatialIndex = LazyFunction('src.utils.spatial_index', 'SRSpatialIndex')
+aggregate_sr_by_hex = LazyFunction('src.utils.hex_aggregation', 'aggregate_sr_by_hex')
+ingest_sr_increment = LazyFunction('src.utils.incremental', 'ingest_sr_increment')
+run_suburb_batch = LazyFunction('src.utils.batch', 'run_suburb_batch')
+write_partitioned_output = LazyFunction('src.utils.output_sink', 'write_partitioned_output')
+
+
+def setup_logging(headless=False):
+    """
+    This function sets up logging to logs/cpt_ds_challenge.log, and also to stderr in headless mode.
+
+    Input Parameters
+    ----------------
+    headless : bool
+    """
+
+    handlers = [logging.FileHandler(LOGS_DIR / 'cpt_ds_challenge.log')]
+    if headless:
+        handlers.append(logging.StreamHandler())
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        handlers=handlers
+                        )
+
+
+def load_aws_credentials():
+    """
+    This function sets the AWS keys of src/config/dl.cfg as environment variables, unless they are already set. It is
+    only called before an S3 client is created, so runs that do not touch S3 do not need the file.
+    """
+
+    if os.environ.get('AWS_ACCESS_KEY_ID') and os.environ.get('AWS_SECRET_ACCESS_KEY'):
+        return
+
+    config = configparser.ConfigParser()
+    with open(CONFIG_DIR / 'dl.cfg') as f:
+        config.read_file(f)
+
+    os.environ['AWS_ACCESS_KEY_ID'] = config.get('AWS', 'AWS_ACCESS_KEY_ID')
+    os.environ['AWS_SECRET_ACCESS_KEY'] = config.get(
+        'AWS', 'AWS_SECRET_ACCESS_KEY')
+
+
+def show(title, value, headless=False):
+    """
+    This function shows a result of the program: in a notebook with IPython.display, otherwise printed. In headless
+    mode it is only logged.
+
+    Input Parameters
+    ----------------
+    title : str
+    value : any (e.g. a DataFrame)
+    headless : bool
+    """
+
+    if headless:
+        logging.info(f'{title} :\n{value}')
+        return
+
+    # Show the full text of the anonymized columns
+    if 'pandas' in sys.modules:
+        sys.modules['pandas'].set_option('display.max_colwidth', None)
+
+    print(f'{title} :')
+    try:
+        from IPython.display import display
+    except ImportError:
+        print(value)
+    else:
+        display(value)
+    print("\n\n")
+
+
+# S3 Select queries for the city polygons
+CITY_POLYGONS_EXTRACT = """
+    SELECT *
+    FROM S3Object[*]['features'][*] as obj WHERE obj.properties.resolution = 8
+"""
+CITY_POLYGONS_VALIDATION_EXTRACT = """
+    SELECT *
+    FROM S3Object[*]['features'][*] as obj
+"""
+
+# The pipeline results persisted to data/output
+OUTPUT_RESULTS = ('joined_sr_data', 'sr_with_wind_data', 'anonymized_sr_data')
+
+# The extracts are independent network reads, they run concurrently and are retried on failure
+EXTRACT_RETRY_POLICY = {'timeout': 600, 'retries': 2}
+
+
+def build_gazetteer(sr_data):
+    """
+    This function computes the centroids of the suburbs of the SR data and merges them into the local gazetteer, which
+    is saved for the batch and incremental runs. The pipeline reads the centroids from the output of this node and not
+    from the file, so runs that save the gazetteer do not invalidate it.
+
+    Input Parameters
+    ----------------
+    sr_data : pandas.DataFrame
+
+
+    Output
+    ------
+    gazetteer : src.utils.gazetteer.SuburbGazetteer
+    """
+
+    from src.utils.gazetteer import SuburbGazetteer
+
+    gazetteer = SuburbGazetteer(DATA_DIR / 'gazetteer.json')
+    gazetteer.update_from_sr_data(sr_data)
+    gazetteer.save()
+
+    return gazetteer
+
+
+def build_pipeline(s3_client, extract_cache, location='BELLVILLE SOUTH', wind_suburb='bellville',
+                   location_accuracy=500, temporal_accuracy=6, seed=None):
+    """
+    This function declares the stages of the program as a pipeline of nodes.
+    The S3 extracts are versioned by their ETag and the wind data by the headers of its url, so they only run again
+    when the sources change. The extracts do not depend on each other and run concurrently, with a timeout and
+    retries per extract.
+
+    Input Parameters
+    ----------------
+    s3_client : botocore.client.S3
+    extract_cache : src.utils.cache.ExtractCache
+    location : str (the suburb to create the subsample for)
+    wind_suburb : str (the wind data site of the suburb)
+    location_accuracy : int (meters)
+    temporal_accuracy : int (hours)
+    seed : int (optional seed of the location anonymization)
 
 
-# Set up display
-pd.set_option('display.max_colwidth', None)
+    Output
+    ------
+    pipeline : src.utils.pipeline.Pipeline
+    """
+
+    def etag(object_key):
+        return lambda: get_object_etag(BUCKET_NAME, object_key, s3_client)
+
+    s3_resources = {'s3_client': s3_client, 'cache': extract_cache}
 
+    pipeline = Pipeline(DATA_DIR / 'pipeline')
+    pipeline.add('city_polygons', get_city_polygons,
+                 params={'bucket_name': BUCKET_NAME, 'object_key': H3_POLYGONS_LVL_8_9_10,
+                         'query_expression': CITY_POLYGONS_EXTRACT},
+                 resources=s3_resources, version=etag(H3_POLYGONS_LVL_8_9_10), **EXTRACT_RETRY_POLICY)
+    pipeline.add('validation_polygons', get_city_polygons,
+                 params={'bucket_name': BUCKET_NAME, 'object_key': H3_POLYGONS_LVL_8,
+                         'query_expression': CITY_POLYGONS_VALIDATION_EXTRACT},
+                 resources=s3_resources, version=etag(H3_POLYGONS_LVL_8), **EXTRACT_RETRY_POLICY)
+    pipeline.add('validation_result', validate_data_extract,
+                 inputs={'filtered_extract': 'city_polygons', 'validation_extract': 'validation_polygons'})
+    pipeline.add('sr_data', get_sr_data,
+                 params={'bucket_name': BUCKET_NAME, 'object_key': SERVICE_REQUEST_DATA},
+                 resources=s3_resources, version=etag(SERVICE_REQUEST_DATA), **EXTRACT_RETRY_POLICY)
+    # The SR data is joined to the hexagons by H3 cell, against the hexagon store so only the polygons of the
+    # cross-checked rows are built
+    pipeline.add('validation_hex_store', get_city_hex_store,
+                 params={'bucket_name': BUCKET_NAME, 'object_key': H3_POLYGONS_LVL_8,
+                         'query_expression': CITY_POLYGONS_VALIDATION_EXTRACT, 'store_root': str(DATA_DIR / 'hex_store')},
+                 resources={'s3_client': s3_client}, version=etag(H3_POLYGONS_LVL_8), **EXTRACT_RETRY_POLICY)
+    pipeline.add('joined_sr_data', join_sr_to_gpd_data_extract,
+                 inputs={'sr_data': 'sr_data', 'gpd_extract': 'validation_hex_store'}, params={'engine': 'h3'})
+    pipeline.add('hex_aggregates', aggregate_sr_by_hex,
+                 inputs={'sr_data': 'sr_data'}, params={'resolutions': (8, 9, 10), 'time_bucket': 'M'})
+    pipeline.add('sr_spatial_index', SRSpatialIndex,
+                 inputs={'sr_data': 'joined_sr_data'})
+    pipeline.add('gazetteer', build_gazetteer,
+                 inputs={'sr_data': 'sr_data'})
+    pipeline.add('location_centroid', get_location_centroid,
+                 inputs={'gazetteer': 'gazetteer'}, params={'location': location})
+    pipeline.add('filtred_sr_data', filter_sr_data_by_distance,
+                 inputs={'sr_data': 'joined_sr_data', 'location_cetroid': 'location_centroid',
+                         'spatial_index': 'sr_spatial_index'})
+    # The wind data only runs again when its source changes, and then refreshes the cached copy
+    pipeline.add('wind_df_raw', get_wind_data,
+                 params={'url': WIND_DATA, 'refresh': True}, resources={'cache': extract_cache},
+                 version=lambda: get_url_version(WIND_DATA), **EXTRACT_RETRY_POLICY)
+    pipeline.add('wind_df_clean', clean_wind_data,
+                 inputs={'df': 'wind_df_raw'})
+    pipeline.add('sr_with_wind_data', merge_wind_data,
+                 inputs={'sr_df': 'filtred_sr_data', 'wind_df': 'wind_df_clean'},
+                 params={'suburb': wind_suburb})
+    pipeline.add('anonymized_sr_data', anonymize_sr_data,
+                 inputs={'df': 'sr_with_wind_data'},
+                 params={'lat_col': 'latitude', 'lon_col': 'longitude', 'location_accuracy': location_accuracy,
+                         'temporal_accuracy': temporal_accuracy, 'rng': seed})
 
-# Get AWS keys
-config = configparser.ConfigParser()
-config.read_file(open(CONFIG_DIR / 'dl.cfg'))
+    # The results are written as Parquet datasets partitioned by hexagon and creation month, they are only rewritten
+    # when the result changes or the dataset is missing
+    for result in OUTPUT_RESULTS:
+        output_dir = DATA_DIR / 'output' / result
+        pipeline.add(f'{result}_output', write_partitioned_output,
+                     inputs={'df': result}, params={'output_dir': str(output_dir)}, exists=output_dir.exists)
 
-os.environ['AWS_ACCESS_KEY_ID'] = config.get('AWS', 'AWS_ACCESS_KEY_ID')
-os.environ['AWS_SECRET_ACCESS_KEY'] = config.get(
-    'AWS', 'AWS_SECRET_ACCESS_KEY')
+    return pipeline
+
+
+# The nodes computed by a default run
+DEFAULT_TARGETS = ('validation_result', 'anonymized_sr_data', 'hex_aggregates', 'joined_sr_data_output',
+                   'sr_with_wind_data_output', 'anonymized_sr_data_output')
 
 
 @benchmark
-def main():
+def main(force=(), targets=DEFAULT_TARGETS, headless=False, **pipeline_params):
     """
     This is the main function that runs the entire program
+
+    Only the stages whose code, parameters or source data changed since the last run are executed, the outputs of the
+    other stages are loaded from data/pipeline. Only the modules of the stages that run are imported.
+
+    Input Parameters
+    ----------------
+    force : iterable of str (names of pipeline nodes to re-run even if they are up to date)
+    targets : iterable of str (the pipeline nodes to compute, e.g. ['validation_result'] to only validate)
+    headless : bool (log the results instead of displaying them)
+    pipeline_params : keyword arguments of build_pipeline (e.g. location_accuracy=250)
     """
 
-    # Set up S3 client
-    s3_client = boto3.client('s3', region_name='af-south-1')
+    # Set up S3 client and the local cache of parsed extracts
+    load_aws_credentials()
+    s3_client = create_s3_client(region_name='af-south-1')
+    extract_cache = ExtractCache(DATA_DIR / 'cache')
+
+    pipeline = build_pipeline(s3_client, extract_cache, **pipeline_params)
+    results = pipeline.run(targets=list(targets), force=force)
+
+    # Precomputed per hexagon aggregates for the dashboards
+    if 'hex_aggregates' in results:
+        results['hex_aggregates'].save(DATA_DIR / 'hex_aggregates.npz')
+
+    if 'validation_result' in results:
+        show('Validating H3 resolution 8 data', results['validation_result'], headless)
+    if 'anonymized_sr_data' in results:
+        show('Anonymized SR data', results['anonymized_sr_data'].head(), headless)
+
+    return results
 
-    # Fetch H3 resolution 8 data from S3
-    city_polygons_extract = f"""
-        SELECT *
-        FROM S3Object[*]['features'][*] as obj WHERE obj.properties.resolution = 8
+
+@benchmark
+def main_incremental(location='BELLVILLE SOUTH', wind_suburb='bellville', seed=None, headless=False):
     """
-    logging.info(
-        f"Extract H3 resolution 8 data from s3 bucket : {BUCKET_NAME} and filename : {H3_POLYGONS_LVL_8_9_10}")
-    print(
-        f"Extract H3 resolution 8 data from s3 bucket : {BUCKET_NAME} and filename : {H3_POLYGONS_LVL_8_9_10}")
-    filtred_records = gpd.read_file(get_city_geojson(
-        bucket_name=BUCKET_NAME, object_key=H3_POLYGONS_LVL_8_9_10, query_expression=city_polygons_extract, s3_client=s3_client), lines=True)
-    display(filtred_records.head())
-    print("\n\n")
+    This function ingests only the service requests that are new or updated since the last run, and appends their
+    anonymized subsample to data/incremental/output, partitioned by hexagon and creation month.
 
-    # Fetch H3 resolution 8 data from S3 for data validation
-    city_polygons_validation_extract = f"""
-        SELECT *
-        FROM S3Object[*]['features'][*] as obj
-    """
-    logging.info(
-        f"Extract H3 Validation data from S3 : {BUCKET_NAME} and filename : {H3_POLYGONS_LVL_8}")
-    print(
-        f"Extract H3 Validation data from S3: {BUCKET_NAME} and filename : {H3_POLYGONS_LVL_8}")
-    validation_records = gpd.read_file(get_city_geojson(
-        bucket_name=BUCKET_NAME, object_key=H3_POLYGONS_LVL_8, query_expression=city_polygons_validation_extract, s3_client=s3_client), lines=True)
-    print("Complete : Extract H3 Validation data from S3\n\n")
-    display(validation_records.head())
-    print("\n\n")
+    Input Parameters
+    ----------------
+    location : str (the suburb to create the subsample for)
+    wind_suburb : str (the wind data site of the suburb)
+    seed : int (optional seed of the location anonymization)
+    headless : bool (log the results instead of displaying them)
+    """
 
-    # Validate H3 Resolution data
-    logging.info(
-        f"Validating H3 resolution 8 data...")
-    print(
-        f"Validating H3 resolution 8 data...")
-    validate_data_extract(filtered_extract=filtred_records,
-                          validation_extract=validation_records)
-    print("Complete : Validating H3 resolution 8 data complete\n\n")
-
-    # Fetch Service Request Data & Join to City Polygons data
-    logging.info(
-        f"Fetch Service Request Data & Join to City Polygons data..")
-    print(
-        f"Fetch Service Request Data & Join to City Polygons data...")
-    sr_data = get_sr_data(bucket_name=BUCKET_NAME,
-                          object_key=SERVICE_REQUEST_DATA, s3_client=s3_client)
-    joined_sr_data = join_sr_to_gpd_data_extract(
-        sr_data=sr_data, gpd_extract=validation_records)
-    logging.info(
-        f'Complete : Joined SR data with city polygons')
-    print(
-        f"Complete : Joined SR data with city polygons..")
-    display(joined_sr_data.head())
-    print("\n\n")
+    from src.utils.gazetteer import SuburbGazetteer
 
-    # Create a subsample of service requests that are within 1 minute of Bellville South
-    logging.info(
-        f"Creating a subsample of service requests that are within 1 minute of Bellville South..")
-    print(
-        f"Creating a subsample of service requests that are within 1 minute of Bellville South...")
-    location_centroid = get_location_centroid('BELLVILLE SOUTH')
-    filtred_sr_data = filter_sr_data_by_distance(
-        joined_sr_data, location_cetroid=location_centroid)
-    logging.info(
-        f'Complete : Create a subsample of service requests that are within 1 minute of Bellville South')
-    print(
-        f"Complete : Create a subsample of service requests that are within 1 minute of Bellville South..")
-    display(filtred_sr_data.head())
-    print("\n\n")
+    # The increments are joined on their pseudonyms, so they must all be made with the configured key
+    load_pseudonymization_key(required=True)
+    load_aws_credentials()
+    s3_client = create_s3_client(region_name='af-south-1')
+    extract_cache = ExtractCache(DATA_DIR / 'cache')
 
-    # Add Wind data to subsample
-    logging.info(
-        f" Adding Wind data to subsample..")
-    print(
-        f" Adding Wind data to subsample...")
-    wind_df_raw = get_wind_data(WIND_DATA)
-    wind_df_clean = clean_wind_data(wind_df_raw)
-    sr_with_wind_data = merge_wind_data(sr_df=filtred_sr_data,
-                                        wind_df=wind_df_clean, suburb='bellville')
-    logging.info(
-        f'Complete : Add Wind data to subsample')
-    print(
-        f"Complete : Add Wind data to subsample")
-    display(sr_with_wind_data.head())
-    print("\n\n")
+    # The hexagons and the wind data come from the pipeline, so they are only extracted when they change
+    pipeline = build_pipeline(s3_client, extract_cache, location=location, wind_suburb=wind_suburb)
+    results = pipeline.run(targets=['validation_polygons', 'wind_df_clean'])
+    location_centroid = get_location_centroid(
+        location, gazetteer=SuburbGazetteer(DATA_DIR / 'gazetteer.json'))
 
-    # Anonymize SR data
-    logging.info(
-        f"Anonymizing SR data...")
-    print(
-        f"Anonymizing SR data...")
-    anonymized_sr_data = anonymize_sr_data(
-        df=sr_with_wind_data, lat_col='latitude', lon_col='longitude')
-    logging.info(
-        f'Complete : Anonymize SR data')
-    print(
-        f"Complete : Anonymize SR data")
-    display(anonymized_sr_data.head())
-    print("\n\n")
+    anonymized_delta = ingest_sr_increment(
+        BUCKET_NAME, SERVICE_REQUEST_DATA, s3_client, gpd_extract=results['validation_polygons'],
+        location_centroid=location_centroid, wind_df=results['wind_df_clean'], suburb=wind_suburb,
+        state_dir=DATA_DIR / 'incremental' / 'state', output_dir=DATA_DIR / 'incremental' / 'output', rng=seed)
+
+    show('New or updated anonymized SR records', len(anonymized_delta), headless)
+
+    return anonymized_delta
+
+
+@benchmark
+def main_batch(suburbs, wind_sites=None, location_accuracy=500, temporal_accuracy=6, seed=None, max_workers=None,
+               headless=False):
+    """
+    This function creates the anonymized subsample of several suburbs, and writes them to data/batch. The service
+    request data is loaded and joined once (or loaded from data/pipeline), and only the distance filter, wind merge
+    and anonymization run per suburb, on a pool of processes.
+
+    Input Parameters
+    ----------------
+    suburbs : iterable of str (the suburbs to create the subsamples for, all the suburbs of the SR data if empty)
+    wind_sites : dict (optional suburb : wind data site, the other suburbs get the wind data of their nearest site)
+    location_accuracy : int (meters)
+    temporal_accuracy : int (hours)
+    seed : int (optional seed of the location anonymization)
+    max_workers : int (optional number of processes)
+    headless : bool (log the results instead of displaying them)
+    """
+
+    from src.utils.gazetteer import SuburbGazetteer
+
+    # The releases of the suburbs are joined on their pseudonyms, so they must all be made with the configured key
+    load_pseudonymization_key(required=True)
+    load_aws_credentials()
+    s3_client = create_s3_client(region_name='af-south-1')
+    extract_cache = ExtractCache(DATA_DIR / 'cache')
+
+    pipeline = build_pipeline(s3_client, extract_cache)
+    results = pipeline.run(targets=['joined_sr_data', 'sr_spatial_index', 'wind_df_clean'])
+
+    joined_sr_data = results['joined_sr_data']
+    suburbs = list(suburbs) or sorted(joined_sr_data['official_suburb'].dropna().astype(str).unique())
+    outputs = run_suburb_batch(
+        joined_sr_data, results['wind_df_clean'], suburbs, DATA_DIR / 'batch',
+        gazetteer=SuburbGazetteer(DATA_DIR / 'gazetteer.json'), spatial_index=results['sr_spatial_index'],
+        wind_sites=wind_sites, location_accuracy=location_accuracy, temporal_accuracy=temporal_accuracy, seed=seed,
+        max_workers=max_workers)
+
+    show('Anonymized SR records per suburb', '\n'.join(
+        f'{suburb} : {rows} ({path})' for suburb, (path, rows) in sorted(outputs.items())), headless)
+
+    return outputs
+
+
+def parse_args(argv=None):
+    """
+    This function parses the command line arguments of the program.
+
+    Input Parameters
+    ----------------
+    argv : list[str] (optional, defaults to sys.argv[1:])
+
+    Output
+    ------
+    args : argparse.Namespace
+    """
+
+    parser = argparse.ArgumentParser(description='Extract, validate, join and anonymize the City of Cape Town '
+                                                 'service request data.')
+    parser.add_argument('--targets', default=','.join(DEFAULT_TARGETS),
+                        help='comma separated pipeline nodes to compute, e.g. validation_result')
+    parser.add_argument('--force', default='', help='comma separated pipeline nodes to re-run even if up to date')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only ingest the service requests that are new or updated since the last run')
+    parser.add_argument('--suburbs', default=None,
+                        help='comma separated suburbs to create subsamples for in one batch, "all" for every suburb')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes of the suburb batch')
+    parser.add_argument('--headless', action='store_true',
+                        help='log the results instead of displaying them, for batch jobs')
+    parser.add_argument('--import-times', action='store_true', help='print the import time of every stage module')
+    parser.add_argument('--location', default='BELLVILLE SOUTH')
+    parser.add_argument('--wind-suburb', default='bellville')
+    parser.add_argument('--location-accuracy', type=int, default=500, help='meters')
+    parser.add_argument('--temporal-accuracy', type=int, default=6, help='hours')
+    parser.add_argument('--seed', type=int, default=None)
+
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
 
-    # Run program
-    main()
+    args = parse_args()
+    setup_logging(args.headless)
+
+    # Run program and export the stage metrics of the run
+    try:
+        if args.incremental:
+            main_incremental(location=args.location, wind_suburb=args.wind_suburb, seed=args.seed,
+                             headless=args.headless)
+        elif args.suburbs is not None:
+            # "all" anywhere in the list selects every suburb
+            suburbs = [name.strip() for name in args.suburbs.split(',') if name.strip()]
+            main_batch([] if any(name.lower() == 'all' for name in suburbs) else suburbs,
+                       wind_sites={args.location: args.wind_suburb}, location_accuracy=args.location_accuracy,
+                       temporal_accuracy=args.temporal_accuracy, seed=args.seed, max_workers=args.workers,
+                       headless=args.headless)
+        else:
+            main(force=[name for name in args.force.split(',') if name],
+                 targets=[name for name in args.targets.split(',') if name], headless=args.headless,
+                 location=args.location, wind_suburb=args.wind_suburb, location_accuracy=args.location_accuracy,
+                 temporal_accuracy=args.temporal_accuracy, seed=args.seed)
+    finally:
+        export_metrics(LOGS_DIR / 'metrics')
+        if args.import_times:
+            print(import_time_report(), file=sys.stderr)
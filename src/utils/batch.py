@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from src.utils.gazetteer import normalize_location_name
+from src.utils.helper_functions import benchmark, get_location_centroid
+from src.utils.output_sink import write_partitioned_output
+from src.utils.pseudonymization import Pseudonymizer
+from src.utils.spatial_index import SRSpatialIndex
+from src.utils.transformations import (anonymize_sr_data, filter_sr_data_by_distance, merge_wind_data,
+                                       wind_data_to_long_format)
+
+
+# The data shared by the workers of a batch, set in the parent before the pool is created so that forked workers
+# inherit it instead of receiving a pickled copy
+_BATCH = {}
+
+
+def suburb_output_path(output_dir, suburb):
+    """
+    This function gets the output dataset of a suburb, e.g. data/batch/bellville_south.
+
+    Input Parameters
+    ----------------
+    output_dir : str or pathlib.Path
+    suburb : str
+
+    Output
+    ------
+    path : pathlib.Path
+    """
+
+    return Path(output_dir) / re.sub(r'[^0-9a-z]+', '_', suburb.lower()).strip('_')
+
+
+def suburb_seed(seed, suburb):
+    """
+    This function derives the random stream of a suburb from the seed of a batch and a stable hash of the suburb name,
+    so a suburb gets the same anonymization with the same seed whichever other suburbs are in the batch.
+
+    Input Parameters
+    ----------------
+    seed : int (None for an unseeded stream)
+    suburb : str
+
+    Output
+    ------
+    seed : list[int] (a numpy SeedSequence entropy, None if seed is None)
+    """
+
+    if seed is None:
+        return None
+    digest = hashlib.sha256(normalize_location_name(suburb).encode('utf-8')).digest()
+
+    return [seed, int.from_bytes(digest[:8], 'little')]
+
+
+def _init_worker(batch):
+    global _BATCH
+    _BATCH = batch
+
+
+def _process_suburb(suburb, location_centroid, wind_site, seed):
+    """
+    This function creates, anonymizes and writes the subsample of one suburb from the shared batch data.
+
+    Output
+    ------
+    suburb : str
+    path : pathlib.Path
+    rows : int
+    """
+
+    filtred_sr_data = filter_sr_data_by_distance(
+        _BATCH['sr_data'], location_centroid, spatial_index=_BATCH['spatial_index'])
+
+    # A suburb with a known AQM site gets the wind data of that site, the others the wind data of the nearest site
+    if wind_site is not None:
+        sr_with_wind_data = merge_wind_data(filtred_sr_data, _BATCH['wind_df'], suburb=wind_site)
+    else:
+        sr_with_wind_data = merge_wind_data(filtred_sr_data, _BATCH['wind_long_df'])
+
+    anonymized_sr_data = anonymize_sr_data(
+        sr_with_wind_data, lat_col='latitude', lon_col='longitude',
+        location_accuracy=_BATCH['location_accuracy'], temporal_accuracy=_BATCH['temporal_accuracy'], rng=seed,
+        pseudonymizer=_BATCH['pseudonymizer'])
+
+    path = suburb_output_path(_BATCH['output_dir'], suburb)
+    write_partitioned_output(anonymized_sr_data, path)
+
+    return suburb, path, len(anonymized_sr_data)
+
+
+@benchmark
+def run_suburb_batch(sr_data, wind_df, suburbs, output_dir, gazetteer, spatial_index=None, wind_sites=None,
+                     location_accuracy=500, temporal_accuracy=6, seed=None, max_workers=None):
+    """
+    This function creates the anonymized subsample of every suburb in a list from service request data that has been
+    loaded and joined once. The distance filter, wind merge and anonymization of the suburbs run on a pool of forked
+    processes which inherit the joined data, so it is never pickled, and every worker writes the subsample of its
+    suburb to output_dir as soon as it is ready, as a dataset partitioned by hexagon and month (see output_sink). Only
+    the suburb names, centroids and output paths are sent between the processes.
+
+    Input Parameters
+    ----------------
+    sr_data : Pandas.DataFrame (the service request data joined to the hexagons)
+    wind_df : Pandas.DataFrame (the cleaned wind data, see transformations.clean_wind_data)
+    suburbs : iterable of str
+    output_dir : str or pathlib.Path
+    gazetteer : src.utils.gazetteer.SuburbGazetteer (the centroids of the suburbs)
+    spatial_index : src.utils.spatial_index.SRSpatialIndex (optional, built over sr_data if not given)
+    wind_sites : dict (optional suburb : wind data site, e.g. {'BELLVILLE SOUTH': 'bellville'}, the other suburbs
+                 get the wind data of their nearest AQM site)
+    location_accuracy : int (meters)
+    temporal_accuracy : int (hours)
+    seed : int (optional, makes the anonymization of every suburb reproducible)
+    max_workers : int (optional, defaults to the number of CPUs)
+
+    Output
+    ------
+    outputs : dict (suburb : (path, number of rows) of the suburbs that were written)
+    """
+
+    suburbs = list(dict.fromkeys(suburbs))
+    wind_sites = {normalize_location_name(suburb): site for suburb, site in (wind_sites or {}).items()}
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # The centroids are resolved in the parent, so the gazetteer is only updated and saved once
+    if any(suburb not in gazetteer for suburb in suburbs):
+        gazetteer.update_from_sr_data(sr_data)
+        gazetteer.save()
+    tasks = []
+    for suburb in suburbs:
+        try:
+            location_centroid = get_location_centroid(suburb, gazetteer=gazetteer, allow_network=False)
+        except LookupError:
+            logging.warning(f'{suburb} is not in the gazetteer, it is skipped')
+            continue
+        tasks.append((suburb, location_centroid, wind_sites.get(normalize_location_name(suburb)),
+                      suburb_seed(seed, suburb)))
+
+    batch = {
+        'sr_data': sr_data,
+        'spatial_index': spatial_index if spatial_index is not None else SRSpatialIndex(sr_data),
+        'wind_df': wind_df,
+        'wind_long_df': wind_data_to_long_format(wind_df) if any(task[2] is None for task in tasks) else None,
+        # The key is loaded once, so every suburb is pseudonymized with the same key
+        'pseudonymizer': Pseudonymizer(),
+        'output_dir': output_dir,
+        'location_accuracy': location_accuracy,
+        'temporal_accuracy': temporal_accuracy,
+    }
+
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(tasks), 1))
+    start_methods = multiprocessing.get_all_start_methods()
+    mp_context = multiprocessing.get_context('fork' if 'fork' in start_methods else None)
+    logging.info(f'Processing {len(tasks)} suburbs on {max_workers} processes')
+
+    outputs = {}
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context,
+                             initializer=_init_worker, initargs=(batch,)) as executor:
+        futures = {executor.submit(_process_suburb, *task): task[0] for task in tasks}
+        for future in as_completed(futures):
+            try:
+                suburb, path, rows = future.result()
+            except Exception:
+                logging.exception(f'The subsample of {futures[future]} failed')
+                continue
+            outputs[suburb] = (path, rows)
+            logging.info(f'Wrote the {rows} anonymized SR records of {suburb} to {path}')
+
+    failed = len(tasks) - len(outputs)
+    if failed:
+        logging.warning(f'{failed} of {len(tasks)} suburbs failed, see the log above')
+
+    return outputs
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+import pandas as pd
+from src.utils.metrics import add_bytes_read
+
+
+def _is_geodataframe(df):
+    # geopandas is slow to import and a GeoDataFrame can only exist once it has been imported
+    geopandas = sys.modules.get('geopandas')
+    return geopandas is not None and isinstance(df, geopandas.GeoDataFrame)
+
+
+class ExtractCache:
+    """
+    This class is a local, size bounded cache of parsed extracts stored as Parquet (GeoParquet for GeoDataFrames).
+
+    Entries are keyed by a hash of the parts that identify an extract (e.g. bucket, key, ETag and query expression),
+    so a changed source object gets a new key and the stale entry is never read again. Every entry has a JSON
+    metadata file (<key>.json) with its size and last access time, written atomically, so several caches on the same
+    directory (threads or processes) do not lose each other's entries. The least recently used entries are evicted
+    once the cache grows above max_bytes.
+
+    Input Parameters
+    ----------------
+    cache_dir : str or pathlib.Path (the directory to store the cache in, e.g. data/cache)
+    max_bytes : int (the maximum total size of the cached files)
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        This function builds a cache key from the parts that identify an extract.
+
+        Input Parameters
+        ----------------
+        parts : str (e.g. bucket name, object key, ETag, query expression)
+
+        Output
+        ------
+        key : str
+        """
+
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return self.cache_dir / f'{key}.json'
+
+    def _read_entry(self, key):
+        # The entry of a key, None if it is not cached (or is being removed by another process)
+        try:
+            with open(self._entry_path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return entry if 'file' in entry and (self.cache_dir / entry['file']).exists() else None
+
+    def _write_entry(self, key, entry):
+        # Every entry has its own metadata file, replaced atomically, so concurrent caches (threads or processes)
+        # never overwrite the entries of each other
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path.with_name(f'{key}.{os.getpid()}.{threading.get_ident()}.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, entry_path)
+
+    def _entries(self):
+        entries = {}
+        for entry_path in self.cache_dir.glob('*.json'):
+            entry = self._read_entry(entry_path.stem)
+            if entry is not None:
+                entries[entry_path.stem] = entry
+
+        return entries
+
+    def __contains__(self, key):
+        return self._read_entry(key) is not None
+
+    def size(self):
+        """
+        This function returns the total size in bytes of the cached files.
+        """
+
+        return sum(entry['bytes'] for entry in self._entries().values())
+
+    def get(self, key):
+        """
+        This function loads a cached extract.
+
+        Input Parameters
+        ----------------
+        key : str (a key created by make_key)
+
+        Output
+        ------
+        df : Pandas.DataFrame or GeoPandas.GeoDataFrame (None if the key is not cached)
+        """
+
+        entry = self._read_entry(key)
+        if entry is None:
+            logging.info(f'Cache miss for {key[:12]}')
+            return None
+        entry['last_access'] = time.time()
+        self._write_entry(key, entry)
+
+        path = self.cache_dir / entry['file']
+        if entry['kind'] == 'geo':
+            import geopandas as gpd
+            df = gpd.read_parquet(path)
+        else:
+            df = pd.read_parquet(path, memory_map=True)
+        add_bytes_read(entry['bytes'])
+        logging.info(f'Cache hit for {key[:12]} ({entry["description"]})')
+
+        return df
+
+    def metadata(self, key):
+        """
+        This function returns the metadata stored with an entry (see put), without loading the entry.
+
+        Input Parameters
+        ----------------
+        key : str
+
+        Output
+        ------
+        metadata : dict (None if the key is not cached)
+        """
+
+        entry = self._read_entry(key)
+
+        return None if entry is None else entry.get('metadata', {})
+
+    def put(self, key, df, description='', metadata=None):
+        """
+        This function stores an extract in the cache and evicts the least recently used entries if the cache is full.
+
+        Input Parameters
+        ----------------
+        key : str (a key created by make_key)
+        df : Pandas.DataFrame or GeoPandas.GeoDataFrame
+        description : str (a human readable description of the entry, stored with it)
+        metadata : dict (optional JSON serialisable values stored with the entry, e.g. a content hash)
+
+        Output
+        ------
+        df : the input frame
+        """
+
+        file_name = f'{key}.parquet'
+        path = self.cache_dir / file_name
+        tmp_path = self.cache_dir / f'{key}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+        # Write to a temporary file first so a crash never leaves a partial entry behind
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        self._write_entry(key, {
+            'file': file_name,
+            'kind': 'geo' if _is_geodataframe(df) else 'frame',
+            'bytes': path.stat().st_size,
+            'created': now,
+            'last_access': now,
+            'description': description,
+            'metadata': metadata or {},
+        })
+        with self._lock:
+            self._evict()
+
+        return df
+
+    def invalidate(self, key):
+        """
+        This function removes an entry from the cache.
+
+        Input Parameters
+        ----------------
+        key : str
+        """
+
+        entry = self._read_entry(key)
+        self._entry_path(key).unlink(missing_ok=True)
+        if entry is not None:
+            (self.cache_dir / entry['file']).unlink(missing_ok=True)
+
+    def clear(self):
+        """
+        This function removes every entry from the cache.
+        """
+
+        for key in self._entries():
+            self.invalidate(key)
+
+    def _evict(self):
+        entries = self._entries()
+        total_bytes = sum(entry['bytes'] for entry in entries.values())
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]['last_access']):
+            if total_bytes <= self.max_bytes:
+                break
+            self.invalidate(key)
+            total_bytes -= entry['bytes']
+            logging.info(
+                f'Evicted {entry["description"]} ({entry["bytes"]} bytes) from the extract cache')
@@ -4,3 +4,42 @@ H3_POLYGONS_LVL_8_9_10 = "city-hex-polygons-8-10.geojson"
 H3_POLYGONS_LVL_8 = "city-hex-polygons-8.geojson"
 SERVICE_REQUEST_DATA = "sr_hex.csv.gz"
 WIND_DATA = "https://www.capetown.gov.za/_layouts/OpenDataPortalHandler/DownloadHandler.ashx?DocumentName=Wind_direction_and_speed_2020.ods&DatasetDocument=https%3A%2F%2Fcityapps.capetown.gov.za%2Fsites%2Fopendatacatalog%2FDocuments%2FWind%2FWind_direction_and_speed_2020.ods"
+
+# WGS-84 ellipsoid (used by the vectorized geodesic functions)
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+EARTH_MEAN_RADIUS = 6371008.8
+
+# Service request data types (used when streaming the SR data in chunks)
+SR_TIMESTAMP_COLUMNS = ['creation_timestamp', 'completion_timestamp']
+SR_DTYPES = {
+    'reference_number': 'float64',
+    'directorate': 'category',
+    'department': 'category',
+    'branch': 'category',
+    'section': 'object',
+    'code_group': 'object',
+    'code': 'category',
+    'cause_code_group': 'object',
+    'cause_code': 'object',
+    'official_suburb': 'category',
+    'latitude': 'float32',
+    'longitude': 'float32',
+    'h3_level8_index': 'object',
+}
+
+# Approximate locations (latitude, longitude) of the City's Air Quality Measurement sites, keyed by the site prefix
+# of the cleaned wind data columns
+WIND_STATIONS = {
+    'atlantis_aqm_site': (-33.5676, 18.4878),
+    'bellville_south_aqm_site': (-33.9180, 18.6420),
+    'bothasig_aqm_site': (-33.8610, 18.5370),
+    'goodwood_aqm_site': (-33.9100, 18.5510),
+    'khayelitsha_aqm_site': (-34.0370, 18.6780),
+    'molteno_aqm_site': (-33.9380, 18.4130),
+    'plattekloof_aqm_site': (-33.8690, 18.5800),
+    'somerset_west_aqm_site': (-34.0800, 18.8480),
+    'table_view_aqm_site': (-33.8190, 18.4910),
+    'wallacedene_aqm_site': (-33.8610, 18.7310),
+}
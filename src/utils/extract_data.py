@@ -1,7 +1,175 @@
+import boto3
+import botocore.config
 import botocore.exceptions
+import collections
+import gzip
+import hashlib
+import io
 import logging
+import mmap
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import pandas as pd
-from src.utils.helper_functions import benchmark
+from src.utils.constants import SR_DTYPES, SR_TIMESTAMP_COLUMNS
+from src.utils.helper_functions import benchmark, log_memory_usage
+from src.utils.metrics import add_bytes_read
+
+
+def create_s3_client(region_name='af-south-1', max_pool_connections=16, connect_timeout=10, read_timeout=60):
+    """
+    This function creates an S3 client with a connection pool large enough for concurrent (range) requests.
+    boto3 clients are thread safe, so one client can be shared by every download thread. Every request fails once
+    connecting or reading stalls for longer than the timeouts, so a timed out extraction stops within a part instead
+    of hanging (see scheduler.call_with_retries).
+
+    Input Parameters
+    ----------------
+    region_name : str
+    max_pool_connections : int (the maximum number of pooled HTTP connections)
+    connect_timeout : float (seconds to wait for a connection)
+    read_timeout : float (seconds to wait for data on an open connection)
+
+    Output
+    ------
+    s3_client : botocore.client.S3
+    """
+
+    config = botocore.config.Config(max_pool_connections=max_pool_connections, connect_timeout=connect_timeout,
+                                    read_timeout=read_timeout, retries={'max_attempts': 5, 'mode': 'standard'})
+
+    return boto3.client('s3', region_name=region_name, config=config)
+
+
+@benchmark
+def download_s3_object(bucket_name, object_key, s3_client, part_size=8 * 1024 ** 2, max_workers=8, head=None):
+    """
+    This function downloads an S3 object into a preallocated in-memory buffer. Objects larger than part_size are
+    fetched with concurrent byte range GET requests, each part is written straight into its slice of the buffer.
+    Every request is pinned to the ETag of the HEAD request, so a download fails instead of mixing the parts of two
+    versions of an object that is replaced meanwhile. The whole object is held in memory, use S3RangeReader to stream
+    objects that may not fit.
+
+    Input Parameters
+    ----------------
+    bucket_name : str (This is the S3 bucket name)
+    object_key : str (This is the object name in the S3 bucket)
+    s3_client : botocore.client.S3 (The S3 client object, see create_s3_client for a pooled client)
+    part_size : int (the size in bytes of each range request)
+    max_workers : int (the number of concurrent range requests)
+    head : dict (optional, the response of a HEAD request of the object if it is already known)
+
+    Output
+    ------
+    buffer : mmap.mmap (a binary file-like object positioned at the start of the data, io.BytesIO for empty objects)
+    """
+
+    if head is None:
+        head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    size = head['ContentLength']
+    if size == 0:
+        return io.BytesIO()
+
+    # An anonymous memory map is a preallocated buffer that also behaves as a binary file
+    buffer = mmap.mmap(-1, size)
+
+    def fetch_part(start):
+        end = min(start + part_size, size) - 1
+        response = s3_client.get_object(
+            Bucket=bucket_name, Key=object_key, Range=f'bytes={start}-{end}', IfMatch=head['ETag'])
+        buffer[start:end + 1] = response['Body'].read()
+
+    part_starts = range(0, size, part_size)
+    if len(part_starts) == 1:
+        fetch_part(0)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # list() re-raises the first failed part
+            list(executor.map(fetch_part, part_starts))
+
+    buffer.seek(0)
+    add_bytes_read(size)
+    logging.info(
+        f'Downloaded {size} bytes from s3://{bucket_name}/{object_key} in {len(part_starts)} parts')
+
+    return buffer
+
+
+class S3RangeReader(io.RawIOBase):
+    """
+    This class is a read-only binary file that streams an S3 object from start to end with byte range GET requests.
+    The next read_ahead parts are fetched concurrently while the current part is read, so at most
+    (read_ahead + 1) * part_size bytes of the object are held in memory whatever its size. Every request is pinned
+    to the ETag of the HEAD request, so reading fails if the object is replaced while it is streamed.
+
+    Input Parameters
+    ----------------
+    bucket_name : str (This is the S3 bucket name)
+    object_key : str (This is the object name in the S3 bucket)
+    s3_client : botocore.client.S3 (The S3 client object, see create_s3_client for a pooled client)
+    part_size : int (the size in bytes of each range request)
+    read_ahead : int (the number of parts fetched ahead of the reader, at least 1)
+    head : dict (optional, the response of a HEAD request of the object if it is already known)
+    """
+
+    def __init__(self, bucket_name, object_key, s3_client, part_size=8 * 1024 ** 2, read_ahead=2, head=None):
+
+        super().__init__()
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.s3_client = s3_client
+        self.part_size = part_size
+        if head is None:
+            head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+        self.size = size = head['ContentLength']
+        self.etag = head['ETag']
+
+        self._part_starts = iter(range(0, size, part_size))
+        self._executor = ThreadPoolExecutor(max_workers=max(read_ahead, 1))
+        self._pending = collections.deque()
+        self._part = memoryview(b'')
+        self._offset = 0
+        for _ in range(max(read_ahead, 1)):
+            self._schedule_part()
+
+    def _fetch_part(self, start):
+        end = min(start + self.part_size, self.size) - 1
+        response = self.s3_client.get_object(
+            Bucket=self.bucket_name, Key=self.object_key, Range=f'bytes={start}-{end}', IfMatch=self.etag)
+        return response['Body'].read()
+
+    def _schedule_part(self):
+        start = next(self._part_starts, None)
+        if start is not None:
+            self._pending.append(self._executor.submit(self._fetch_part, start))
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._offset == len(self._part):
+            if not self._pending:
+                return 0
+            # Waits for the next part (re-raising its error) and starts fetching the part after the read ahead
+            self._part = memoryview(self._pending.popleft().result())
+            self._offset = 0
+            self._schedule_part()
+            add_bytes_read(len(self._part))
+
+        n_bytes = min(len(b), len(self._part) - self._offset)
+        b[:n_bytes] = self._part[self._offset:self._offset + n_bytes]
+        self._offset += n_bytes
+
+        return n_bytes
+
+    def close(self):
+        if not self.closed:
+            for future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            self._executor.shutdown(wait=True)
+            self._part = memoryview(b'')
+        super().close()
 
 
 @benchmark
@@ -17,13 +185,13 @@ def get_city_geojson(bucket_name, object_key, query_expression, s3_client):
 
     Output
     ------
-    list[dict] : A list of the json objects extracted
+    str : the newline delimited json objects extracted
 
     '''
 
     input_serialization = {'JSON': {'Type': 'DOCUMENT'}}
     output_serialization = {'JSON': {}}
-    records = ''
+    payloads = []
 
     # Use S3 Select to get filtered data from JSON file
     try:
@@ -37,34 +205,101 @@ def get_city_geojson(bucket_name, object_key, query_expression, s3_client):
             OutputSerialization=output_serialization
         )
 
-        # Iterate over the response and print each row of filtered data
+        # Collect the payload of every record event and decode them once at the end
         for event in response['Payload']:
             if 'Records' in event:
-                records += event['Records']['Payload'].decode('utf-8')
+                payloads.append(event['Records']['Payload'])
 
+    # The errors are raised after they are logged, so the extraction is retried (or fails) instead of returning no
+    # polygons
     except botocore.exceptions.ClientError as e:
         if e.response['Error']['Code'] == 'NoSuchKey':
             logging.error(f'The object does not exist.')
         else:
             logging.error(f'An error occurred: {e}')
+        raise
     except botocore.exceptions.ParamValidationError as e:
         logging.error(f'Invalid input parameters: {e}')
+        raise
     except Exception as e:
         logging.error(f'An error occurred: {e}')
+        raise
+
+    records = b''.join(payloads)
+    add_bytes_read(len(records))
+    records = records.decode('utf-8')
 
     return records
 
 
+def get_object_etag(bucket_name, object_key, s3_client):
+    """
+    This function gets the ETag of an S3 object without downloading it, the ETag changes whenever the object changes
+
+    Input Parameters
+    ----------------
+    bucket_name : str (This is the S3 bucket name)
+    object_key : str (This is the object name in the S3 bucket)
+    s3_client : botocore.client.S3 (The S3 client object)
+
+    Output
+    ------
+    etag : str
+    """
+
+    return s3_client.head_object(Bucket=bucket_name, Key=object_key)['ETag'].strip('"')
+
+
 @benchmark
-def get_sr_data(bucket_name, object_key, s3_client):
+def get_city_polygons(bucket_name, object_key, query_expression, s3_client, cache=None):
+    """
+    This function extracts city polygons from S3 with S3 Select and parses them into a GeoDataFrame.
+    When a cache is given the parsed polygons are stored as GeoParquet and reused until the S3 object changes.
+
+    Input Parameters
+    ----------------
+    bucket_name : string (this is the name of the AWS S3 bucket)
+    object_key : string (this is the json object file to read data from)
+    query_expression : string (the S3 Select query)
+    s3_client : botocore.client.S3 (The S3 client object)
+    cache : src.utils.cache.ExtractCache (optional)
+
+    Output
+    ------
+    gdf : geopandas.GeoDataFrame
+    """
+
+    if cache is not None:
+        etag = get_object_etag(bucket_name, object_key, s3_client)
+        cache_key = cache.make_key(bucket_name, object_key, etag, query_expression)
+        gdf = cache.get(cache_key)
+        if gdf is not None:
+            return gdf
+
+    records = get_city_geojson(bucket_name=bucket_name, object_key=object_key,
+                               query_expression=query_expression, s3_client=s3_client)
+    # geopandas is slow to import, it is only imported when polygons are parsed
+    import geopandas as gpd
+    gdf = gpd.read_file(records, lines=True)
+
+    if cache is not None and len(gdf):
+        cache.put(cache_key, gdf, description=f's3://{bucket_name}/{object_key} ({etag})')
+
+    return gdf
+
+
+@benchmark
+def get_sr_data(bucket_name, object_key, s3_client, cache=None):
     """
     This function extacts the service request data from S3
+    When a cache is given the parsed data is stored as Parquet and reused until the S3 object changes.
 
     Input Parameters
     ----------------
     bucket_name : str (This is the S3 bucket name)
     object_key : str (This is the csv object name in the S3 bucket to read from)
     s3_client : botocore.client.S3 (The S3 client object)
+    cache : src.utils.cache.ExtractCache (optional)
 
 
     Output
@@ -72,27 +307,168 @@ def get_sr_data(bucket_name, object_key, s3_client):
     df : pandas.DataFrame object 
     """
 
-    obj = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-    df = pd.read_csv(obj['Body'], compression='gzip',
-                     index_col=0).reset_index(drop=True)
+    # One HEAD request gives both the ETag of the cache key and the size of the download
+    head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    if cache is not None:
+        etag = head['ETag'].strip('"')
+        cache_key = cache.make_key(bucket_name, object_key, etag, 'sr_data')
+        df = cache.get(cache_key)
+        if df is not None:
+            return df
+
+    buffer = download_s3_object(bucket_name, object_key, s3_client, head=head)
+    with gzip.GzipFile(fileobj=buffer, mode='rb') as f:
+        df = pd.read_csv(f, index_col=0).reset_index(drop=True)
+    buffer.close()
+
+    if cache is not None:
+        cache.put(cache_key, df, description=f's3://{bucket_name}/{object_key} ({etag})')
+
+    return df
+
+
+def get_sr_data_chunks(bucket_name, object_key, s3_client, chunksize=100_000, part_size=8 * 1024 ** 2,
+                       read_ahead=2):
+    """
+    This function streams the service request data from S3 as typed chunks, so only one chunk and a few range
+    requests of the compressed object (see S3RangeReader) are held in memory at a time. The organisational columns
+    are categoricals, the coordinates are float32 and the timestamps are parsed to UTC. The chunks are numbered
+    with one continuous RangeIndex, the same index get_sr_data returns.
+
+    Input Parameters
+    ----------------
+    bucket_name : str (This is the S3 bucket name)
+    object_key : str (This is the csv object name in the S3 bucket to read from)
+    s3_client : botocore.client.S3 (The S3 client object)
+    chunksize : int (the number of rows per chunk)
+    part_size : int (the size in bytes of each range request)
+    read_ahead : int (the number of range requests fetched ahead of the parser)
+
+
+    Output
+    ------
+    generator of pandas.DataFrame
+    """
+
+    source = S3RangeReader(bucket_name, object_key, s3_client, part_size=part_size, read_ahead=read_ahead)
+    reader = pd.read_csv(gzip.GzipFile(fileobj=io.BufferedReader(source), mode='rb'), index_col=0,
+                         dtype=SR_DTYPES, chunksize=chunksize)
+
+    start = 0
+    with source, reader:
+        for chunk_number, chunk in enumerate(reader):
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            for column in SR_TIMESTAMP_COLUMNS:
+                chunk[column] = pd.to_datetime(
+                    chunk[column], format='%Y-%m-%d %H:%M:%S%z', utc=True)
+            log_memory_usage(f'SR data chunk {chunk_number}', chunk)
+            yield chunk
+
+
+def get_url_version(url, timeout=30):
+    """
+    This function identifies the version of the file at a url without downloading it, from the ETag, Last-Modified
+    and Content-Length headers of a HEAD request (the content hash for a local file), like get_object_etag does for
+    S3 objects.
+
+    Input Parameters
+    ----------------
+    url : str (the url or local path of the file)
+    timeout : float (seconds)
+
+    Output
+    ------
+    version : str (empty if the url can not be reached, e.g. offline)
+    """
+
+    if Path(url).is_file():
+        return hashlib.sha256(Path(url).read_bytes()).hexdigest()
+
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method='HEAD'), timeout=timeout) as response:
+            headers = response.headers
+    except OSError as e:
+        logging.warning(f'Could not get the version of {url} : {e}')
+        return ''
+
+    return ' '.join(headers.get(name, '') for name in ['ETag', 'Last-Modified', 'Content-Length'])
+
+
+def _compact_wind_data(df):
+    """
+    This function converts the wind readings of the raw wind data to float32, the 'NoData' markers become NaN. The
+    first (date) column is kept as text, so the result can be stored as Parquet and cleaned by clean_wind_data.
+    """
+
+    df = df.copy()
+    date_column = df.columns[0]
+    df[date_column] = df[date_column].where(df[date_column].isna(), df[date_column].astype(str))
+    for column in df.columns[1:]:
+        df[column] = pd.to_numeric(df[column], errors='coerce').astype('float32')
 
     return df
 
 
 @benchmark
-def get_wind_data(url):
+def get_wind_data(url, cache=None, offline=False, refresh=False):
     """
     This function downloads wind data from a url where the wind data is stored as an excel file
 
+    The readings are returned as float32 columns with NaN for missing readings. When a cache is given the parsed data
+    is stored as Parquet keyed by the url, and later runs load it without touching the network. With refresh=True the
+    file is downloaded again but only re-parsed if its content hash changed. url can also be the path of a local copy
+    of the file, and offline=True guarantees the network is never used (the url must then be cached or a local file).
+
     Input Parameters
     ----------------
-    url : str (the url that contains wind data in excel format)
+    url : str (the url or local path of the wind data in excel format)
+    cache : src.utils.cache.ExtractCache (optional)
+    offline : bool (never download, raise an error if the data is not available locally)
+    refresh : bool (check the source for a new version even if the data is cached)
 
     Output
     ------
     df : pandas.DataFrame object
     """
 
-    df = pd.read_excel(url, skiprows=2,  header=[0, 1, 2])
+    is_local_file = Path(url).is_file()
+    cache_key = cache.make_key('wind_data', url) if cache is not None else None
+
+    # Local files are cheap to hash, so only downloads are served from the cache without checking the content
+    if cache is not None and not is_local_file and (offline or not refresh):
+        df = cache.get(cache_key)
+        if df is not None:
+            return df
+
+    if is_local_file:
+        content = Path(url).read_bytes()
+    elif offline:
+        raise RuntimeError(
+            f'The wind data at {url} is not cached and offline mode does not allow downloading it')
+    else:
+        try:
+            with urllib.request.urlopen(url, timeout=120) as response:
+                content = response.read()
+        except OSError as e:
+            # A refresh falls back to the cached copy when the source can not be reached
+            df = cache.get(cache_key) if cache is not None else None
+            if df is None:
+                raise
+            logging.warning(f'Could not download the wind data from {url} ({e}), using the cached copy')
+            return df
+        logging.info(f'Downloaded {len(content)} bytes of wind data from {url}')
+
+    add_bytes_read(len(content))
+    content_hash = hashlib.sha256(content).hexdigest()
+    if cache is not None and (cache.metadata(cache_key) or {}).get('sha256') == content_hash:
+        logging.info('The wind data has not changed since it was cached')
+        return cache.get(cache_key)
+
+    df = _compact_wind_data(pd.read_excel(
+        io.BytesIO(content), engine='odf', skiprows=2, header=[0, 1, 2]))
+
+    if cache is not None:
+        cache.put(cache_key, df, description=f'wind data {url}', metadata={'sha256': content_hash})
 
     return df
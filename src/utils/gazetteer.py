@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from shapely.geometry import Point
+
+
+def normalize_location_name(name):
+    """
+    This function normalizes a location name for lookups, e.g. ' Bellville-South ' and 'BELLVILLE SOUTH' are the same.
+
+    Input Parameters
+    ----------------
+    name : str
+
+    Output
+    ------
+    normalized_name : str
+    """
+
+    return ' '.join(re.sub(r'[^0-9A-Z]+', ' ', str(name).upper()).split())
+
+
+class SuburbGazetteer:
+    """
+    This class is a local index of suburb name to centroid, persisted as JSON so centroids only need to be computed
+    (or geocoded) once.
+
+    Input Parameters
+    ----------------
+    path : str or pathlib.Path (optional JSON file to load from and save to, e.g. data/gazetteer.json)
+    """
+
+    def __init__(self, path=None):
+
+        self.path = Path(path) if path is not None else None
+        self.centroids = {}
+        if self.path is not None and self.path.exists():
+            with open(self.path) as f:
+                self.centroids = {name: tuple(location) for name, location in json.load(f).items()}
+            logging.info(f'Loaded {len(self.centroids)} suburb centroids from {self.path}')
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def __contains__(self, name):
+        return normalize_location_name(name) in self.centroids
+
+    def add(self, name, latitude, longitude):
+        """
+        This function adds or replaces the centroid of a suburb.
+
+        Input Parameters
+        ----------------
+        name : str
+        latitude : float
+        longitude : float
+        """
+
+        self.centroids[normalize_location_name(name)] = (float(latitude), float(longitude))
+
+    def lookup(self, name):
+        """
+        This function gets the centroid of a suburb.
+
+        Input Parameters
+        ----------------
+        name : str
+
+        Output
+        ------
+        shapely.geometry.point.Point (x = longitude, y = latitude), None if the suburb is unknown
+        """
+
+        location = self.centroids.get(normalize_location_name(name))
+        if location is None:
+            return None
+
+        return Point(location[1], location[0])
+
+    def update_from_sr_data(self, sr_data, suburb_col='official_suburb', lat_col='latitude', lon_col='longitude'):
+        """
+        This function computes a centroid for every suburb in the service request data, as the median location of the
+        requests in the suburb. Suburbs that are already in the gazetteer are overwritten.
+
+        Input Parameters
+        ----------------
+        sr_data : Pandas.DataFrame
+        suburb_col : str
+        lat_col : str
+        lon_col : str
+        """
+
+        located = sr_data[[suburb_col, lat_col, lon_col]].dropna()
+        names = located[suburb_col].astype(str).map(normalize_location_name)
+        medians = located[[lat_col, lon_col]].groupby(names.to_numpy()).median()
+        for name, (latitude, longitude) in zip(medians.index, medians.to_numpy()):
+            self.centroids[name] = (float(latitude), float(longitude))
+
+        logging.info(f'Computed the centroids of {len(medians)} suburbs from the service request data')
+
+    def save(self):
+        """
+        This function writes the gazetteer to its JSON file.
+        """
+
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.centroids, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,215 @@
+import numpy as np
+from src.utils.constants import WGS84_A, WGS84_B, WGS84_F, EARTH_MEAN_RADIUS
+
+
+def haversine_distance(lat1, lon1, lat2, lon2, radius=EARTH_MEAN_RADIUS):
+    """
+    This function calculates the great circle distance in meters between arrays of points on a sphere.
+    Any of the inputs can be scalars, they are broadcast against each other.
+
+    Input Parameters
+    ----------------
+    lat1 : float or numpy.ndarray (degrees)
+    lon1 : float or numpy.ndarray (degrees)
+    lat2 : float or numpy.ndarray (degrees)
+    lon2 : float or numpy.ndarray (degrees)
+    radius : float (the sphere radius in meters, defaults to the mean earth radius)
+
+    Output
+    ------
+    distance : numpy.ndarray (meters)
+    """
+
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64))
+                              for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * \
+        np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * radius * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def vincenty_distance(lat1, lon1, lat2, lon2, max_iter=200, tol=1e-12):
+    """
+    This function calculates the geodesic distance in meters between arrays of points on the WGS-84 ellipsoid
+    using a vectorized version of Vincenty's inverse formula.
+
+    For the distances used in this project (a few km inside Cape Town) the result agrees with
+    geopy.distance.distance (Karney's algorithm) to well under a millimeter. The few nearly antipodal pairs
+    for which the iteration does not converge fall back to the haversine distance.
+
+    Input Parameters
+    ----------------
+    lat1 : float or numpy.ndarray (degrees)
+    lon1 : float or numpy.ndarray (degrees)
+    lat2 : float or numpy.ndarray (degrees)
+    lon2 : float or numpy.ndarray (degrees)
+    max_iter : int (maximum number of iterations on lambda)
+    tol : float (convergence tolerance on lambda in radians)
+
+    Output
+    ------
+    distance : numpy.ndarray (meters)
+    """
+
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *(np.asarray(x, dtype=np.float64) for x in (lat1, lon1, lat2, lon2)))
+
+    U1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    L = np.radians(lon2 - lon1)
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    converged = np.zeros(lam.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt((cosU2 * sin_lam) ** 2 +
+                                (cosU1 * sinU2 - sinU1 * cosU2 * cos_lam) ** 2)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0,
+                                 cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Points on the equator have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0,
+                                    cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam - lam_prev) <= tol
+            if converged.all():
+                break
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+            B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        distance = WGS84_B * A * (sigma - delta_sigma)
+
+    distance = np.where(sin_sigma == 0, 0.0, distance)
+    if not converged.all():
+        distance = np.where(converged, distance,
+                            haversine_distance(lat1, lon1, lat2, lon2))
+
+    return distance
+
+
+DISTANCE_METHODS = {
+    'haversine': haversine_distance,
+    'vincenty': vincenty_distance,
+}
+
+
+def geodesic_distance(lat1, lon1, lat2, lon2, method='vincenty'):
+    """
+    This function dispatches to one of the vectorized distance functions by name.
+
+    Input Parameters
+    ----------------
+    lat1, lon1, lat2, lon2 : float or numpy.ndarray (degrees)
+    method : str ('haversine' for a spherical earth or 'vincenty' for the WGS-84 ellipsoid)
+
+    Output
+    ------
+    distance : numpy.ndarray (meters)
+    """
+
+    try:
+        distance_func = DISTANCE_METHODS[method]
+    except KeyError:
+        raise ValueError(
+            f"Unknown distance method '{method}', expected one of {sorted(DISTANCE_METHODS)}")
+
+    return distance_func(lat1, lon1, lat2, lon2)
+
+
+def bounding_box(lat, lon, radius):
+    """
+    This function computes a latitude/longitude box that is guaranteed to contain every point within radius meters
+    of (lat, lon) on both the sphere and the WGS-84 ellipsoid. It is used to cheaply discard rows before computing
+    exact distances.
+
+    Input Parameters
+    ----------------
+    lat : float (degrees)
+    lon : float (degrees)
+    radius : float (meters)
+
+    Output
+    ------
+    tuple : (min_lat, max_lat, min_lon, max_lon)
+    """
+
+    # The smallest radius of curvature on the ellipsoid is the meridional radius at the equator,
+    # using it over-estimates the angular size of the box so no point is ever wrongly discarded
+    min_radius = WGS84_A * (1 - WGS84_F) ** 2
+    dlat = np.degrees(radius / min_radius)
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+
+    max_abs_lat = max(abs(min_lat), abs(max_lat))
+    if max_abs_lat >= 90.0:
+        return min_lat, max_lat, -180.0, 180.0
+
+    dlon = dlat / np.cos(np.radians(max_abs_lat))
+
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+
+def bounding_box_mask(lat, lon, box):
+    """
+    This function returns a boolean mask of the points that fall inside a box created by bounding_box.
+    Points with missing coordinates are never inside the box.
+
+    Input Parameters
+    ----------------
+    lat : numpy.ndarray (degrees)
+    lon : numpy.ndarray (degrees)
+    box : tuple (min_lat, max_lat, min_lon, max_lon)
+
+    Output
+    ------
+    mask : numpy.ndarray (bool)
+    """
+
+    min_lat, max_lat, min_lon, max_lon = box
+
+    return (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+
+
+def offset_coordinates(lat, lon, distance, bearing):
+    """
+    This function moves arrays of points by a distance in meters along a bearing on the WGS-84 ellipsoid.
+
+    Meters are converted to degrees with the meridional and prime vertical radii of curvature at each point's latitude,
+    for displacements of a few hundred meters the result is within millimeters of the exact geodesic.
+
+    Input Parameters
+    ----------------
+    lat : numpy.ndarray (degrees)
+    lon : numpy.ndarray (degrees)
+    distance : numpy.ndarray (meters)
+    bearing : numpy.ndarray (radians, clockwise from north)
+
+    Output
+    ------
+    tuple : (new_lat, new_lon) numpy.ndarray (degrees)
+    """
+
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    e2 = WGS84_F * (2 - WGS84_F)
+    sin_lat = np.sin(np.radians(lat))
+    w = np.sqrt(1 - e2 * sin_lat ** 2)
+    meridional_radius = WGS84_A * (1 - e2) / w ** 3
+    prime_vertical_radius = WGS84_A / w
+
+    new_lat = lat + np.degrees(distance * np.cos(bearing) / meridional_radius)
+    new_lon = lon + np.degrees(distance * np.sin(bearing) /
+                               (prime_vertical_radius * np.cos(np.radians(lat))))
+
+    return new_lat, new_lon
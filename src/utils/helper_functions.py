@@ -1,15 +1,29 @@
+import functools
 import logging
-import uuid
-from time import perf_counter
-from geopy.geocoders import Nominatim
-from shapely.geometry import Point
+import os
+import resource
 from math import radians, sin, cos, sqrt, atan2
+from src.utils.metrics import span
+
+
+def _count_rows(value):
+    """
+    This function returns the number of rows of a DataFrame/Series like value, None for anything else.
+    """
+
+    if hasattr(value, 'shape') and hasattr(value, '__len__'):
+        return len(value)
+
+    return None
 
 
 def benchmark(func: callable(...)):
     """
     This function is used to calculate benchmarks for other functions
 
+    Every call is recorded as a span by src.utils.metrics (wall and CPU time, peak RSS growth, rows in and out and
+    bytes read), nested calls become child spans. The number of input rows is taken from the first DataFrame argument.
+
     Input Parameters
     ----------------
     func : any valid python function
@@ -20,59 +34,111 @@ def benchmark(func: callable(...)):
     wrapper : python function
     """
 
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         """
         This is the wrapper function that computes the runtime for a given function
 
         """
-        start_time = perf_counter()
-        value = func(*args, **kwargs)
-        end_time = perf_counter()
-        run_time = end_time - start_time
+        rows_in = next((rows for rows in map(_count_rows, list(args) + list(kwargs.values()))
+                        if rows is not None), None)
+        with span(func.__qualname__, rows_in=rows_in) as record:
+            value = func(*args, **kwargs)
+            record['rows_out'] = _count_rows(value)
         logging.info(
-            f"Execution of {func.__name__} took {run_time:.2f} seconds.")
+            f"Execution of {func.__name__} took {record['wall_time_s']:.4f} seconds "
+            f"({record['cpu_time_s']:.4f} s CPU, rows in {rows_in}, rows out {record['rows_out']}).")
         return value
 
     return wrapper
 
 
-@benchmark
-def get_location_centroid(location):
+def get_memory_usage():
     """
-    This function gets the centroid for a given location.
-
-    Input Parameters
-    ----------------
-    location : str (This is the location name)
+    This function gets the current and peak resident set size (RSS) of the running process.
 
     Output
     ------
-    tuple : (latitude , longitude)
+    tuple : (current_rss_mb, peak_rss_mb), current_rss_mb is None where /proc is not available
     """
 
-    geolocator = Nominatim(user_agent="my_application")
-    location_geocode = geolocator.geocode(location)
-    location_centroid = Point(
-        location_geocode.longitude, location_geocode.latitude)
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    current_rss_mb = None
+    try:
+        with open('/proc/self/statm') as f:
+            current_rss_mb = int(f.read().split()[1]) * \
+                os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        pass
 
-    return location_centroid
+    return current_rss_mb, peak_rss_mb
 
 
-def generate_uuid(val):
+def log_memory_usage(label, df=None):
     """
-    This function generates a random uuid for a given value.
+    This function logs the memory used by the process and optionally by a dataframe.
 
     Input Parameters
     ----------------
-    val
+    label : str (a description of the current step, e.g. the chunk number)
+    df : Pandas.DataFrame (optional)
+    """
+
+    current_rss_mb, peak_rss_mb = get_memory_usage()
+    message = f'Memory usage at {label} : peak RSS {peak_rss_mb:.1f} MB'
+    if current_rss_mb is not None:
+        message += f', current RSS {current_rss_mb:.1f} MB'
+    if df is not None:
+        message += f', {len(df)} rows using {df.memory_usage(deep=True).sum() / 1024 ** 2:.1f} MB'
+    logging.info(message)
 
 
+@benchmark
+def get_location_centroid(location, gazetteer=None, allow_network=True):
+    """
+    This function gets the centroid for a given location.
+
+    The location is looked up in the local gazetteer first. Only unknown locations are geocoded with Nominatim, and
+    the result is added to the gazetteer (and saved) so the next lookup is local.
+
+    Input Parameters
+    ----------------
+    location : str (This is the location name)
+    gazetteer : src.utils.gazetteer.SuburbGazetteer (optional local index of suburb centroids)
+    allow_network : bool (fall back to Nominatim for locations that are not in the gazetteer)
+
     Output
     ------
-    uuid : str 
+    shapely.geometry.point.Point : (longitude , latitude)
     """
 
-    return uuid.uuid4().hex
+    if gazetteer is not None:
+        location_centroid = gazetteer.lookup(location)
+        if location_centroid is not None:
+            return location_centroid
+
+    if not allow_network:
+        raise LookupError(
+            f'{location} is not in the gazetteer and network geocoding is disabled')
+
+    # geopy and shapely are imported when they are needed, so the modules that only need the benchmark decorator and
+    # the locations found in the gazetteer start fast
+    from geopy.geocoders import Nominatim
+    from shapely.geometry import Point
+
+    geolocator = Nominatim(user_agent="my_application")
+    location_geocode = geolocator.geocode(location)
+    if location_geocode is None:
+        raise LookupError(f'Could not geocode {location}')
+    location_centroid = Point(
+        location_geocode.longitude, location_geocode.latitude)
+
+    if gazetteer is not None:
+        gazetteer.add(location, location_geocode.latitude, location_geocode.longitude)
+        gazetteer.save()
+
+    return location_centroid
 
 
 def calculate_distance(lat1, lon1, lat2, lon2):
@@ -0,0 +1,244 @@
+import logging
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from src.utils.helper_functions import benchmark
+from src.utils.hexagons import H3_NULL, h3_int_to_string, h3_parent, h3_string_to_int, latlon_to_h3
+
+
+# Columns of a HexAggregateTable, the duration statistics are in hours and can be summed across cells so finer
+# levels roll up into coarser ones
+AGGREGATE_KEYS = ['resolution', 'cell', 'time_bucket', 'department', 'code']
+AGGREGATE_STATS = ['count', 'duration_count', 'duration_sum', 'duration_sq_sum', 'duration_min', 'duration_max']
+ROLLUP_FUNCTIONS = {'count': 'sum', 'duration_count': 'sum', 'duration_sum': 'sum', 'duration_sq_sum': 'sum',
+                    'duration_min': 'min', 'duration_max': 'max'}
+
+
+def _to_utc(timestamps):
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        return timestamps.dt.tz_convert('UTC') if timestamps.dt.tz is not None else timestamps.dt.tz_localize('UTC')
+
+    return pd.to_datetime(timestamps, format='%Y-%m-%d %H:%M:%S%z', utc=True)
+
+
+class HexAggregateTable:
+    """
+    This class is a table of precomputed service request aggregates per hexagon, time bucket, department and code,
+    stored as one numpy array per column. The rows are sorted by resolution, cell and time bucket, so the rows of a
+    hexagon are found with a binary search instead of a scan. Departments and codes are stored as integer codes
+    into the departments and codes arrays (-1 when missing).
+
+    Input Parameters
+    ----------------
+    columns : dict (column name : numpy.ndarray, see AGGREGATE_KEYS and AGGREGATE_STATS)
+    departments : numpy.ndarray (the department names)
+    codes : numpy.ndarray (the code names)
+    time_bucket : str (the pandas period frequency of the time buckets, e.g. 'M')
+    """
+
+    def __init__(self, columns, departments, codes, time_bucket):
+
+        order = np.lexsort((columns['time_bucket'], columns['cell'], columns['resolution']))
+        self.columns = {name: np.asarray(columns[name])[order] for name in AGGREGATE_KEYS + AGGREGATE_STATS}
+        self.departments = np.asarray(departments, dtype=object)
+        self.codes = np.asarray(codes, dtype=object)
+        self.time_bucket = time_bucket
+
+    def __len__(self):
+        return len(self.columns['cell'])
+
+    @property
+    def resolutions(self):
+        return np.unique(self.columns['resolution']).tolist()
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.columns.values())
+
+    def _rows(self, resolution, cells=None):
+        # Positions of the rows of a resolution (and cells), found by binary search on the sorted columns
+        resolution_column = self.columns['resolution']
+        start, stop = np.searchsorted(resolution_column, [resolution, resolution + 1])
+        if cells is None:
+            return np.arange(start, stop)
+
+        cells = np.unique(cells)
+        if not len(cells):
+            return np.empty(0, dtype=np.int64)
+        cell_column = self.columns['cell'][start:stop]
+        starts = np.searchsorted(cell_column, cells, side='left')
+        stops = np.searchsorted(cell_column, cells, side='right')
+
+        return start + np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)])
+
+    def query(self, resolution, cells=None, start=None, end=None, department=None, code=None, by_group=True):
+        """
+        This function reads the aggregates of hexagons at a resolution, optionally filtered on cells, time and group.
+
+        Input Parameters
+        ----------------
+        resolution : int
+        cells : iterable of str or numpy.ndarray (uint64) (optional H3 cells, defaults to every cell)
+        start : str or pandas.Timestamp (optional UTC start of the time buckets to include)
+        end : str or pandas.Timestamp (optional UTC end (exclusive) of the time buckets to include)
+        department : str (optional)
+        code : str (optional)
+        by_group : bool (False to add up the departments and codes of every hexagon and time bucket)
+
+        Output
+        ------
+        aggregates : Pandas.DataFrame (count and duration mean, std, min and max in hours per row)
+        """
+
+        if cells is not None:
+            cells = np.asarray(cells)
+            cells = cells.astype(np.uint64) if cells.dtype.kind in 'iu' else h3_string_to_int(cells)
+        rows = self._rows(resolution, cells)
+
+        mask = np.ones(len(rows), dtype=bool)
+        time_bucket = self.columns['time_bucket'][rows]
+        if start is not None:
+            mask &= time_bucket >= pd.Timestamp(start).tz_localize(None).to_datetime64()
+        if end is not None:
+            mask &= time_bucket < pd.Timestamp(end).tz_localize(None).to_datetime64()
+        for column, names, value in [('department', self.departments, department), ('code', self.codes, code)]:
+            if value is not None:
+                value_codes = np.flatnonzero(names == value)
+                mask &= self.columns[column][rows] == (value_codes[0] if len(value_codes) else -2)
+        rows = rows[mask]
+
+        aggregates = pd.DataFrame({name: self.columns[name][rows] for name in AGGREGATE_KEYS + AGGREGATE_STATS})
+        if not by_group:
+            aggregates = aggregates.groupby(['resolution', 'cell', 'time_bucket'], as_index=False, sort=False).agg(
+                ROLLUP_FUNCTIONS)
+        else:
+            aggregates['department'] = pd.Categorical.from_codes(aggregates['department'], self.departments)
+            aggregates['code'] = pd.Categorical.from_codes(aggregates['code'], self.codes)
+
+        duration_count = aggregates.pop('duration_count').where(lambda count: count > 0)
+        duration_sum = aggregates.pop('duration_sum')
+        aggregates['duration_mean'] = duration_sum / duration_count
+        variance = aggregates.pop('duration_sq_sum') / duration_count - aggregates['duration_mean'] ** 2
+        aggregates['duration_std'] = np.sqrt(variance.clip(lower=0))
+        aggregates['cell'] = h3_int_to_string(aggregates['cell'])
+        aggregates['time_bucket'] = aggregates['time_bucket'].dt.tz_localize('UTC')
+
+        return aggregates
+
+    def save(self, path):
+        """
+        This function writes the table to a compressed .npz file.
+
+        Input Parameters
+        ----------------
+        path : str or pathlib.Path
+        """
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.stem}.tmp.npz')
+        np.savez_compressed(tmp_path, departments=self.departments.astype(str), codes=self.codes.astype(str),
+                            time_bucket_freq=np.array(self.time_bucket), **self.columns)
+        os.replace(tmp_path, path)
+        logging.info(f'Saved {len(self)} hexagon aggregates to {path}')
+
+    @classmethod
+    def load(cls, path):
+        """
+        This function reads a table written by save.
+
+        Input Parameters
+        ----------------
+        path : str or pathlib.Path
+
+        Output
+        ------
+        table : HexAggregateTable
+        """
+
+        with np.load(path) as arrays:
+            columns = {name: arrays[name] for name in AGGREGATE_KEYS + AGGREGATE_STATS}
+            return cls(columns, arrays['departments'].astype(object), arrays['codes'].astype(object),
+                       str(arrays['time_bucket_freq']))
+
+
+def rollup_aggregates(aggregates, resolution):
+    """
+    This function rolls the aggregates of finer hexagons up to their parents at a coarser resolution, by adding up
+    the counts and sums and taking the min and max of the children, instead of recomputing them from the requests.
+
+    Input Parameters
+    ----------------
+    aggregates : Pandas.DataFrame (the AGGREGATE_KEYS and AGGREGATE_STATS columns of a single resolution)
+    resolution : int
+
+    Output
+    ------
+    aggregates : Pandas.DataFrame
+    """
+
+    parents = aggregates.assign(cell=h3_parent(aggregates['cell'].to_numpy(), resolution), resolution=resolution)
+
+    return parents.groupby(AGGREGATE_KEYS, as_index=False, sort=False).agg(ROLLUP_FUNCTIONS)
+
+
+@benchmark
+def aggregate_sr_by_hex(sr_data, resolutions=(8, 9, 10), time_bucket='M', lat_col='latitude', lon_col='longitude'):
+    """
+    This function precomputes the number of service requests and their duration statistics (completion minus creation
+    time, in hours) per hexagon, time bucket, department and code, at several H3 resolutions.
+
+    Every request is assigned to its cell at the finest resolution only, the coarser levels are rolled up from the
+    finer aggregates with parent cells computed by bit arithmetic. H3 cells are not exactly nested, so a small share of
+    the requests near hexagon edges are counted in a different coarse hexagon than a direct assignment at the coarse
+    resolution would give. Requests without a location or creation timestamp are left out.
+
+    Input Parameters
+    ----------------
+    sr_data : Pandas.DataFrame
+    resolutions : iterable of int
+    time_bucket : str (pandas period frequency of the time buckets, e.g. 'D', 'W' or 'M')
+    lat_col : str
+    lon_col : str
+
+    Output
+    ------
+    table : HexAggregateTable
+    """
+
+    resolutions = sorted(set(resolutions), reverse=True)
+    creation = _to_utc(sr_data['creation_timestamp'])
+    duration = (_to_utc(sr_data['completion_timestamp']) - creation).dt.total_seconds().to_numpy() / 3600
+    department_codes, departments = pd.factorize(sr_data['department'])
+    code_codes, codes = pd.factorize(sr_data['code'])
+
+    requests = pd.DataFrame({
+        'resolution': resolutions[0],
+        'cell': latlon_to_h3(sr_data[lat_col].to_numpy(), sr_data[lon_col].to_numpy(), resolutions[0]),
+        'time_bucket': creation.dt.tz_localize(None).dt.to_period(time_bucket).dt.start_time.to_numpy(),
+        'department': department_codes.astype(np.int32),
+        'code': code_codes.astype(np.int32),
+        'duration': duration,
+        'duration_sq': duration ** 2,
+    })
+    located = (requests['cell'] != H3_NULL) & requests['time_bucket'].notna()
+    logging.info(
+        f'Aggregating {located.sum()} service requests per hexagon, {(~located).sum()} without a location or creation timestamp are left out')
+
+    level = requests[located].groupby(AGGREGATE_KEYS, as_index=False, sort=False).agg(
+        count=('duration', 'size'), duration_count=('duration', 'count'), duration_sum=('duration', 'sum'),
+        duration_sq_sum=('duration_sq', 'sum'), duration_min=('duration', 'min'), duration_max=('duration', 'max'))
+    levels = [level]
+    for resolution in resolutions[1:]:
+        level = rollup_aggregates(level, resolution)
+        levels.append(level)
+
+    aggregates = pd.concat(levels, ignore_index=True)
+    columns = {name: aggregates[name].to_numpy() for name in AGGREGATE_KEYS + AGGREGATE_STATS}
+    columns['resolution'] = columns['resolution'].astype(np.int8)
+    columns['count'] = columns['count'].astype(np.int64)
+    columns['duration_count'] = columns['duration_count'].astype(np.int64)
+
+    return HexAggregateTable(columns, np.asarray(departments, dtype=object), np.asarray(codes, dtype=object),
+                             time_bucket)
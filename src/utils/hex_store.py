@@ -0,0 +1,336 @@
+import io
+import json
+import logging
+from pathlib import Path
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json
+import shapely
+from src.utils.cache import ExtractCache
+from src.utils.extract_data import get_city_geojson, get_object_etag
+from src.utils.helper_functions import benchmark
+from src.utils.hexagons import h3_int_to_string, h3_string_to_int
+from src.utils.versioned_dir import publish_directory, remove_directory, staging_dir
+
+
+# The geometry types of the GeoJSON features, read before the coordinates whose nesting depends on the type
+GEOJSON_TYPE_SCHEMA = pa.schema([pa.field('geometry', pa.struct([pa.field('type', pa.string())]))])
+
+# The geometry of the GeoJSON features of a hexagon extract, the properties are inferred
+GEOJSON_POLYGON_SCHEMA = pa.schema([pa.field('geometry', pa.struct([
+    pa.field('type', pa.string()),
+    pa.field('coordinates', pa.list_(pa.list_(pa.list_(pa.float64())))),
+]))])
+
+
+class HexGeometryStore:
+    """
+    This class is a compact store of hexagon polygons: the vertices of all the polygons in one contiguous float64
+    (lon, lat) array, an offsets array with the first vertex of every polygon, the H3 cells as uint64 and the
+    properties as one array per column. Text properties are dictionary encoded: an int32 array of codes (-1 for
+    missing values) and the array of their distinct values. Saved as .npy files it is loaded memory mapped, without
+    parsing or copying, and shapely geometries are only built for the rows that are asked for.
+
+    Input Parameters
+    ----------------
+    vertices : numpy.ndarray (float64, shape (n_vertices, 2), the exterior rings of the polygons one after another)
+    offsets : numpy.ndarray (int64, shape (n_polygons + 1,), polygon i is vertices[offsets[i]:offsets[i + 1]])
+    cells : numpy.ndarray (uint64, the H3 cell of every polygon)
+    properties : dict (column name : numpy.ndarray, e.g. centroid_lat, the codes of the dictionary encoded columns)
+    crs : str (optional)
+    cell_order : numpy.ndarray (optional, the rows sorted by cell, computed if not given)
+    categories : dict (optional column name : numpy.ndarray of str, the values of the dictionary encoded columns)
+    """
+
+    def __init__(self, vertices, offsets, cells, properties=None, crs='EPSG:4326', cell_order=None, categories=None):
+
+        self.vertices = vertices
+        self.offsets = offsets
+        self.cells = cells
+        self.properties = properties or {}
+        self.categories = categories or {}
+        self.crs = crs
+        # Rows sorted by cell, to map a cell to its row with a binary search
+        self.cell_order = np.argsort(cells, kind='stable') if cell_order is None else cell_order
+
+    def __len__(self):
+        return len(self.cells)
+
+    @property
+    def nbytes(self):
+        arrays = [self.vertices, self.offsets, self.cells, self.cell_order]
+        arrays += list(self.properties.values()) + list(self.categories.values())
+        return sum(values.nbytes for values in arrays)
+
+    @classmethod
+    def from_geojson_records(cls, records):
+        """
+        This function builds a store from the newline delimited GeoJSON features of an S3 Select query (see
+        extract_data.get_city_geojson), without going through Fiona and shapely. The features are parsed by the
+        Arrow JSON reader and the vertices are the flattened coordinate lists, so no Python object is created per
+        feature or vertex.
+
+        Input Parameters
+        ----------------
+        records : str
+
+        Output
+        ------
+        store : HexGeometryStore
+        """
+
+        if not records.strip():
+            return cls._from_parts(np.empty((0, 2)), np.empty(0, dtype=np.int64), pd.DataFrame({'index': []}))
+
+        data = records.encode('utf-8')
+        # The types are checked first, the coordinates of other geometries can not be parsed as polygons
+        geometry = pyarrow.json.read_json(io.BytesIO(data), parse_options=pyarrow.json.ParseOptions(
+            explicit_schema=GEOJSON_TYPE_SCHEMA, unexpected_field_behavior='ignore'))
+        geometry = geometry.column('geometry').combine_chunks()
+        geometry_types = geometry.field('type')
+        if geometry.null_count or geometry_types.null_count or not pc.all(
+                pc.equal(geometry_types, 'Polygon')).as_py():
+            other_types = {str(geometry_type) for geometry_type in geometry_types.to_pylist()} - {'Polygon'}
+            raise ValueError(f'The hexagon store only holds polygons without holes, got {sorted(other_types)}')
+
+        table = pyarrow.json.read_json(io.BytesIO(data), parse_options=pyarrow.json.ParseOptions(
+            explicit_schema=GEOJSON_POLYGON_SCHEMA, unexpected_field_behavior='infer'))
+        polygons = table.column('geometry').combine_chunks().field('coordinates')
+        if not pc.all(pc.equal(pc.list_value_length(polygons), 1)).as_py():
+            raise ValueError('The hexagon store only holds polygons without holes, got polygons with holes')
+
+        rings = polygons.flatten()
+        points = rings.flatten()
+        if not pc.all(pc.equal(pc.list_value_length(points), 2)).as_py():
+            raise ValueError('The hexagon store only holds 2D (lon, lat) coordinates')
+        lengths = pc.list_value_length(rings).to_numpy().astype(np.int64)
+        vertices = points.flatten().to_numpy().reshape(-1, 2)
+
+        properties = table.column('properties').combine_chunks()
+        properties = pa.Table.from_arrays(properties.flatten(), names=[field.name for field in properties.type])
+
+        return cls._from_parts(vertices, lengths, properties.to_pandas())
+
+    @classmethod
+    def from_geodataframe(cls, gdf):
+        """
+        This function builds a store from a GeoDataFrame of hexagons with an index column.
+
+        Input Parameters
+        ----------------
+        gdf : geopandas.GeoDataFrame
+
+        Output
+        ------
+        store : HexGeometryStore
+        """
+
+        geometries = gdf.geometry.values
+        if (shapely.get_type_id(geometries) != 3).any() or (shapely.get_num_interior_rings(geometries) > 0).any():
+            raise ValueError('The hexagon store only holds polygons without holes')
+
+        vertices, polygon_ids = shapely.get_coordinates(shapely.get_exterior_ring(geometries), return_index=True)
+        lengths = np.bincount(polygon_ids, minlength=len(gdf)).astype(np.int64)
+        crs = gdf.crs.to_string() if gdf.crs is not None else None
+
+        return cls._from_parts(vertices, lengths, pd.DataFrame(gdf.drop(columns=gdf.geometry.name)), crs)
+
+    @classmethod
+    def _from_parts(cls, vertices, lengths, properties, crs='EPSG:4326'):
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        cells = h3_string_to_int(properties.pop('index'))
+        columns, categories = {}, {}
+        for column in properties.columns:
+            if pd.api.types.is_numeric_dtype(properties[column]):
+                columns[column] = properties[column].to_numpy()
+            else:
+                # Text (and any other) values are dictionary encoded, so they can be stored as .npy files
+                codes, uniques = pd.factorize(properties[column])
+                columns[column] = codes.astype(np.int32)
+                categories[column] = np.asarray(uniques, dtype=object).astype(str)
+
+        return cls(vertices, offsets, cells, columns, crs, categories=categories)
+
+    def rows(self, cells):
+        """
+        This function maps H3 cells to the rows of the store.
+
+        Input Parameters
+        ----------------
+        cells : iterable of str or numpy.ndarray (uint64)
+
+        Output
+        ------
+        rows : numpy.ndarray (int64, -1 for cells that are not in the store)
+        """
+
+        cells = np.asarray(cells)
+        cells = cells.astype(np.uint64) if cells.dtype.kind in 'iu' else h3_string_to_int(cells)
+        if not len(self):
+            return np.full(len(cells), -1, dtype=np.int64)
+
+        sorted_cells = self.cells[self.cell_order]
+        positions = np.searchsorted(sorted_cells, cells).clip(max=len(self) - 1)
+        found = sorted_cells[positions] == cells
+
+        return np.where(found, self.cell_order[positions], -1).astype(np.int64)
+
+    def geometries(self, rows=None):
+        """
+        This function builds the shapely polygons of some rows of the store.
+
+        Input Parameters
+        ----------------
+        rows : numpy.ndarray (optional, defaults to every row)
+
+        Output
+        ------
+        polygons : numpy.ndarray (shapely.Polygon)
+        """
+
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+
+        # The positions of the vertices of every row, one after another
+        first_positions = np.cumsum(lengths) - lengths
+        vertex_positions = np.repeat(starts - first_positions, lengths) + np.arange(lengths.sum())
+        rings = shapely.linearrings(self.vertices[vertex_positions],
+                                    indices=np.repeat(np.arange(len(rows)), lengths))
+
+        return shapely.polygons(rings)
+
+    def to_dataframe(self, rows=None):
+        """
+        This function builds a DataFrame of the index and properties of some rows of the store, without geometries.
+
+        Input Parameters
+        ----------------
+        rows : numpy.ndarray (optional, defaults to every row)
+
+        Output
+        ------
+        df : pandas.DataFrame
+        """
+
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        columns = {'index': h3_int_to_string(self.cells[rows])}
+        for column, values in self.properties.items():
+            values = np.asarray(values[rows])
+            if column in self.categories:
+                codes = values
+                values = np.asarray(self.categories[column], dtype=object)[codes.clip(min=0)]
+                values[codes < 0] = None
+            columns[column] = values
+
+        return pd.DataFrame(columns)
+
+    def to_geodataframe(self, rows=None):
+        """
+        This function builds a GeoDataFrame of some rows of the store, with the same columns as the extract.
+
+        Input Parameters
+        ----------------
+        rows : numpy.ndarray (optional, defaults to every row)
+
+        Output
+        ------
+        gdf : geopandas.GeoDataFrame
+        """
+
+        return gpd.GeoDataFrame(self.to_dataframe(rows), geometry=self.geometries(rows), crs=self.crs)
+
+    def save(self, directory):
+        """
+        This function writes the store to a directory of .npy files. A new version is written next to the directory
+        and published with a single rename (see versioned_dir.publish_directory), so a crash or a concurrent reader
+        never sees a mix of two versions.
+
+        Input Parameters
+        ----------------
+        directory : str or pathlib.Path
+        """
+
+        directory = Path(directory)
+        new_dir = staging_dir(directory)
+
+        arrays = {'vertices': self.vertices, 'offsets': self.offsets, 'cells': self.cells,
+                  'cell_order': self.cell_order}
+        arrays.update({f'property_{column}': values for column, values in self.properties.items()})
+        arrays.update({f'categories_{column}': values for column, values in self.categories.items()})
+        for name, values in arrays.items():
+            np.save(new_dir / f'{name}.npy', np.ascontiguousarray(values))
+        with open(new_dir / 'meta.json', 'w') as f:
+            json.dump({'crs': self.crs, 'properties': list(self.properties), 'categories': list(self.categories)}, f)
+
+        publish_directory(new_dir, directory)
+        logging.info(f'Saved {len(self)} hexagons ({self.nbytes / 1024 ** 2:.2f} MB) to {directory}')
+
+    @classmethod
+    def load(cls, directory):
+        """
+        This function loads a store written by save, memory mapped so the arrays are only read from disk when they
+        are used.
+
+        Input Parameters
+        ----------------
+        directory : str or pathlib.Path
+
+        Output
+        ------
+        store : HexGeometryStore
+        """
+
+        directory = Path(directory)
+        with open(directory / 'meta.json') as f:
+            meta = json.load(f)
+
+        def load_array(name):
+            return np.load(directory / f'{name}.npy', mmap_mode='r')
+
+        properties = {column: load_array(f'property_{column}') for column in meta['properties']}
+        categories = {column: load_array(f'categories_{column}') for column in meta.get('categories', [])}
+
+        return cls(load_array('vertices'), load_array('offsets'), load_array('cells'), properties, meta['crs'],
+                   cell_order=load_array('cell_order'), categories=categories)
+
+
+@benchmark
+def get_city_hex_store(bucket_name, object_key, query_expression, s3_client, store_root):
+    """
+    This function gets the hexagons of an S3 Select query as a HexGeometryStore. The store is built once per version
+    (ETag) of the S3 object and query, and later calls only memory map it.
+
+    Input Parameters
+    ----------------
+    bucket_name : string (this is the name of the AWS S3 bucket)
+    object_key : string (this is the json object file to read data from)
+    query_expression : string (the S3 Select query)
+    s3_client : botocore.client.S3 (The S3 client object)
+    store_root : str or pathlib.Path (the directory of the stores, e.g. data/hex_store)
+
+    Output
+    ------
+    store : HexGeometryStore
+    """
+
+    etag = get_object_etag(bucket_name, object_key, s3_client)
+    query_dir = Path(store_root) / ExtractCache.make_key(bucket_name, object_key, query_expression)
+    store_dir = query_dir / etag
+    if (store_dir / 'meta.json').exists():
+        return HexGeometryStore.load(store_dir)
+
+    records = get_city_geojson(bucket_name=bucket_name, object_key=object_key,
+                               query_expression=query_expression, s3_client=s3_client)
+    HexGeometryStore.from_geojson_records(records).save(store_dir)
+
+    # Only the store of the latest version of the object is kept
+    for old_dir in query_dir.iterdir():
+        if not old_dir.name.startswith('.') and old_dir != store_dir:
+            remove_directory(old_dir)
+
+    return HexGeometryStore.load(store_dir)
@@ -0,0 +1,106 @@
+import warnings
+import numpy as np
+
+# The vectorized h3 functions live in h3.unstable, which warns on import
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', UserWarning)
+    from h3.unstable import vect as h3_vect
+
+
+# h3 returns 0 for coordinates it can not index (e.g. NaN)
+H3_NULL = np.uint64(0)
+
+
+def h3_string_to_int(values):
+    """
+    This function converts H3 cell ids from their hex string form (e.g. '88ad361801fffff') to uint64 integers.
+
+    Input Parameters
+    ----------------
+    values : iterable of str
+
+    Output
+    ------
+    cells : numpy.ndarray (uint64)
+    """
+
+    return np.fromiter((int(v, 16) for v in values), dtype=np.uint64)
+
+
+def h3_resolution(cells):
+    """
+    This function returns the resolution of each H3 cell id.
+
+    Input Parameters
+    ----------------
+    cells : numpy.ndarray (uint64)
+
+    Output
+    ------
+    resolution : numpy.ndarray (int)
+    """
+
+    return ((np.asarray(cells, dtype=np.uint64) >> np.uint64(52)) & np.uint64(0xF)).astype(np.int64)
+
+
+def latlon_to_h3(lat, lon, resolution):
+    """
+    This function assigns every (lat, lon) pair to its H3 cell at a given resolution in a single vectorized pass.
+
+    Input Parameters
+    ----------------
+    lat : numpy.ndarray (degrees)
+    lon : numpy.ndarray (degrees)
+    resolution : int
+
+    Output
+    ------
+    cells : numpy.ndarray (uint64, H3_NULL where the coordinates are missing)
+    """
+
+    lat = np.ascontiguousarray(lat, dtype=np.float64)
+    lon = np.ascontiguousarray(lon, dtype=np.float64)
+
+    return h3_vect.geo_to_h3(lat, lon, resolution)
+
+
+def h3_int_to_string(cells):
+    """
+    This function converts uint64 H3 cell ids to their hex string form (e.g. '88ad361801fffff').
+
+    Input Parameters
+    ----------------
+    cells : numpy.ndarray (uint64)
+
+    Output
+    ------
+    values : numpy.ndarray (str)
+    """
+
+    return np.array([format(int(cell), 'x') for cell in np.asarray(cells, dtype=np.uint64)], dtype=object)
+
+
+def h3_parent(cells, resolution):
+    """
+    This function returns the parent of each H3 cell id at a coarser resolution with bit arithmetic: the resolution
+    field is set to the parent resolution and the digits of the finer resolutions are set to 7 (unused).
+
+    Input Parameters
+    ----------------
+    cells : numpy.ndarray (uint64, cells of a resolution >= resolution)
+    resolution : int
+
+    Output
+    ------
+    parents : numpy.ndarray (uint64, H3_NULL stays H3_NULL)
+    """
+
+    cells = np.asarray(cells, dtype=np.uint64)
+    if (h3_resolution(cells[cells != H3_NULL]) < resolution).any():
+        raise ValueError(f'Cells can only have parents at a resolution coarser than their own, got {resolution}')
+
+    resolution_mask = np.uint64(0xF) << np.uint64(52)
+    unused_digits = np.uint64((1 << (3 * (15 - resolution))) - 1)
+    parents = (cells & ~resolution_mask) | (np.uint64(resolution) << np.uint64(52)) | unused_digits
+
+    return np.where(cells == H3_NULL, H3_NULL, parents)
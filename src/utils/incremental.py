@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from src.utils.extract_data import get_object_etag, get_sr_data_chunks
+from src.utils.helper_functions import benchmark
+from src.utils.output_sink import PartitionedParquetWriter
+from src.utils.transformations import process_sr_data_chunks
+
+
+def sr_row_hashes(sr_data):
+    """
+    This function hashes the reference number and the full content of every service request in one vectorized pass.
+    A request whose content hash has not been seen before is new or has been updated since it was last ingested.
+
+    Input Parameters
+    ----------------
+    sr_data : Pandas.DataFrame
+
+    Output
+    ------
+    key_hashes : numpy.ndarray (uint64 hash of the reference number, of the content if it is missing)
+    row_hashes : numpy.ndarray (uint64 hash of the content)
+    """
+
+    row_hashes = pd.util.hash_pandas_object(sr_data, index=False).to_numpy()
+    reference_numbers = sr_data['reference_number']
+    key_hashes = pd.util.hash_pandas_object(reference_numbers, index=False).to_numpy()
+    key_hashes = np.where(reference_numbers.isna().to_numpy(), row_hashes, key_hashes)
+
+    return key_hashes, row_hashes
+
+
+def _isin_sorted(values, sorted_values):
+    # Membership test against a sorted array with a binary search
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_values, values).clip(max=len(sorted_values) - 1)
+
+    return sorted_values[positions] == values
+
+
+class IngestionState:
+    """
+    This class is the local state of the incremental ingestion of the service request data: the ETag of the last
+    ingested source object, the creation time watermark and the sorted hashes of the reference numbers and rows that
+    have been processed, stored in state_dir as state.json and hashes.npz.
+
+    The hashes of a run are only added to the state by commit, once its output has been written.
+
+    Input Parameters
+    ----------------
+    state_dir : str or pathlib.Path (e.g. data/incremental/state)
+    """
+
+    def __init__(self, state_dir):
+
+        self.state_dir = Path(state_dir)
+        self.etag = None
+        self.watermark = None
+        self.key_hashes = np.empty(0, dtype=np.uint64)
+        self.row_hashes = np.empty(0, dtype=np.uint64)
+        self._pending = []
+
+        state_path = self.state_dir / 'state.json'
+        if state_path.exists():
+            with open(state_path) as f:
+                state = json.load(f)
+            self.etag = state['etag']
+            self.watermark = pd.Timestamp(state['watermark']) if state['watermark'] else None
+            with np.load(self.state_dir / 'hashes.npz') as hashes:
+                self.key_hashes = hashes['key_hashes']
+                self.row_hashes = hashes['row_hashes']
+            logging.info(
+                f'Loaded the ingestion state : {len(self.row_hashes)} processed rows, watermark {self.watermark}')
+
+    def delta(self, sr_chunk):
+        """
+        This function selects the rows of a chunk that are new or updated since the last commit, and keeps their
+        hashes to be committed.
+
+        Input Parameters
+        ----------------
+        sr_chunk : Pandas.DataFrame (with parsed creation timestamps, see extract_data.get_sr_data_chunks)
+
+        Output
+        ------
+        delta_chunk : Pandas.DataFrame
+        """
+
+        key_hashes, row_hashes = sr_row_hashes(sr_chunk)
+
+        # Requests created after the watermark are new without a lookup, older ones are new or updated if their
+        # content has not been processed yet
+        if self.watermark is not None:
+            after_watermark = (sr_chunk['creation_timestamp'] > self.watermark).to_numpy()
+        else:
+            after_watermark = np.ones(len(sr_chunk), dtype=bool)
+        unseen = after_watermark.copy()
+        unseen[~after_watermark] = ~_isin_sorted(row_hashes[~after_watermark], self.row_hashes)
+
+        updated = unseen & _isin_sorted(key_hashes, self.key_hashes)
+        logging.info(
+            f'SR chunk delta : {unseen.sum() - updated.sum()} new and {updated.sum()} updated of {len(sr_chunk)} rows')
+
+        self._pending.append((key_hashes[unseen], row_hashes[unseen], sr_chunk['creation_timestamp'].max()))
+
+        return sr_chunk[unseen]
+
+    def commit(self, etag):
+        """
+        This function adds the hashes of the rows selected since the last commit to the state and saves it.
+
+        Input Parameters
+        ----------------
+        etag : str (the ETag of the ingested source object)
+        """
+
+        for key_hashes, row_hashes, max_creation in self._pending:
+            self.key_hashes = np.union1d(self.key_hashes, key_hashes)
+            self.row_hashes = np.union1d(self.row_hashes, row_hashes)
+            if pd.notna(max_creation) and (self.watermark is None or max_creation > self.watermark):
+                self.watermark = max_creation
+        self._pending = []
+        self.etag = etag
+
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_dir / 'hashes.tmp.npz'
+        np.savez(tmp_path, key_hashes=self.key_hashes, row_hashes=self.row_hashes)
+        os.replace(tmp_path, self.state_dir / 'hashes.npz')
+
+        state_path = self.state_dir / 'state.json'
+        with open(state_path.with_suffix('.tmp'), 'w') as f:
+            json.dump({'etag': etag, 'watermark': self.watermark.isoformat() if self.watermark is not None else None,
+                       'rows': int(len(self.row_hashes))}, f, indent=2)
+        os.replace(state_path.with_suffix('.tmp'), state_path)
+
+
+@benchmark
+def ingest_sr_increment(bucket_name, object_key, s3_client, gpd_extract, location_centroid, wind_df, suburb,
+                        state_dir, output_dir, chunksize=100_000, join_engine='sjoin', rng=None):
+    """
+    This function ingests only the service requests that are new or updated since the last run. The source is
+    streamed in chunks and only the delta of every chunk (see IngestionState.delta) goes through the join, distance
+    filter, wind merge and anonymization. The anonymized delta is appended to a dataset partitioned by hexagon and
+    creation month (see output_sink.PartitionedParquetWriter), and the state is committed once the output is written.
+    Nothing is downloaded when the ETag of the source object has not changed since the last run.
+
+    An updated request is appended again as a new record in the partition of its hexagon and creation month.
+
+    Input Parameters
+    ----------------
+    bucket_name : str
+    object_key : str
+    s3_client : botocore.client.S3
+    gpd_extract : GeoPandas.DataFrame
+    location_centroid : shapely.geometry.point.Point
+    wind_df : Pandas.DataFrame (the cleaned wind data)
+    suburb : str (the suburb of the wind data to merge)
+    state_dir : str or pathlib.Path (the directory of the ingestion state)
+    output_dir : str or pathlib.Path (the directory of the partitioned output dataset)
+    chunksize : int
+    join_engine : str ('sjoin', 'h3' or 'partitioned')
+    rng : numpy.random.Generator or int (optional, makes the anonymization reproducible)
+
+    Output
+    ------
+    anonymized_delta : Pandas.DataFrame
+    """
+
+    state = IngestionState(state_dir)
+    etag = get_object_etag(bucket_name, object_key, s3_client)
+    if etag == state.etag:
+        logging.info(f's3://{bucket_name}/{object_key} has not changed since the last run ({etag}), nothing to ingest')
+        return pd.DataFrame()
+
+    sr_chunks = get_sr_data_chunks(bucket_name, object_key, s3_client, chunksize=chunksize)
+    delta_chunks = (delta_chunk for delta_chunk in map(state.delta, sr_chunks) if len(delta_chunk))
+    anonymized_delta = process_sr_data_chunks(
+        delta_chunks, gpd_extract, location_centroid, wind_df, suburb, join_engine=join_engine, rng=rng)
+
+    if len(anonymized_delta):
+        part_name = hashlib.sha256(f'{bucket_name}/{object_key}/{etag}'.encode('utf-8')).hexdigest()[:16]
+        with PartitionedParquetWriter(output_dir, part_name=part_name, mode='append') as writer:
+            writer.write(anonymized_delta)
+    state.commit(etag)
+
+    return anonymized_delta
@@ -0,0 +1,203 @@
+import ast
+import hashlib
+import importlib
+import importlib.util
+import logging
+import os
+import sys
+import threading
+from time import perf_counter
+from src.utils.metrics import span
+
+
+# Seconds spent importing every module imported through import_module_timed, in import order
+IMPORT_TIMES = {}
+
+_import_lock = threading.Lock()
+
+
+def import_module_timed(module_name):
+    """
+    This function imports a module and records how long the import took in IMPORT_TIMES (and as a metrics span),
+    together with the third party packages it loaded.
+
+    Input Parameters
+    ----------------
+    module_name : str
+
+    Output
+    ------
+    module : the imported module
+    """
+
+    with _import_lock:
+        if module_name in sys.modules:
+            return sys.modules[module_name]
+
+        packages_before = {name.partition('.')[0] for name in sys.modules}
+        start_time = perf_counter()
+        with span(f'import:{module_name}'):
+            module = importlib.import_module(module_name)
+        IMPORT_TIMES[module_name] = perf_counter() - start_time
+
+        new_packages = sorted({name.partition('.')[0] for name in sys.modules} - packages_before - {'src'})
+        logging.info(
+            f'Imported {module_name} in {IMPORT_TIMES[module_name]:.3f} seconds, loading {", ".join(new_packages) or "no new packages"}')
+
+    return module
+
+
+def import_time_report():
+    """
+    This function formats the recorded import times, slowest first.
+
+    Output
+    ------
+    report : str
+    """
+
+    lines = [f'{seconds:8.3f} s  {module_name}'
+             for module_name, seconds in sorted(IMPORT_TIMES.items(), key=lambda item: -item[1])]
+
+    return '\n'.join(['Import times :'] + (lines or ['    (no modules imported lazily)']))
+
+
+def _module_spec(module_name):
+    # The spec of a module without importing it (only its parent packages), None if it can not be found
+    try:
+        return importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        return None
+
+
+def _package_imports(source, package):
+    # The modules of the package imported anywhere in a module (imports inside functions included)
+    module_names = []
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            module_names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            module_names.append(node.module)
+            # from src.utils import gazetteer imports a module, from src.utils.gazetteer import X a name
+            spec = _module_spec(node.module) if node.module.partition('.')[0] == package else None
+            if spec is not None and spec.submodule_search_locations is not None:
+                module_names += [f'{node.module}.{alias.name}' for alias in node.names]
+
+    return [name for name in module_names if name.partition('.')[0] == package]
+
+
+# (path, package) : (file stat, source digest, files of the imported package modules), so a file is only parsed again
+# once it has changed
+_MODULE_FILE_SCANS = {}
+
+
+def _scan_module_file(path, package):
+    stat = os.stat(path)
+    file_stat = (stat.st_mtime_ns, stat.st_size)
+    scan = _MODULE_FILE_SCANS.get((path, package))
+    if scan is not None and scan[0] == file_stat:
+        return scan[1:]
+
+    with open(path, 'rb') as f:
+        source = f.read()
+    module_files = []
+    for module_name in _package_imports(source, package):
+        spec = _module_spec(module_name)
+        if spec is not None and spec.has_location and spec.origin:
+            module_files.append(spec.origin)
+    _MODULE_FILE_SCANS[(path, package)] = (file_stat, hashlib.sha256(source).digest(), module_files)
+
+    return _MODULE_FILE_SCANS[(path, package)][1:]
+
+
+def source_tree_hash(path, package='src'):
+    """
+    This function hashes the source of a module file together with the source of every module of the package that it
+    imports, directly or through other modules of the package, without importing any of them. A function can then be
+    fingerprinted with the code of the helpers it calls.
+
+    Input Parameters
+    ----------------
+    path : str (the file of the module)
+    package : str (the top level package whose modules are followed)
+
+    Output
+    ------
+    hash : str
+    """
+
+    digest = hashlib.sha256()
+    pending, seen = [str(path)], set()
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+
+        source_digest, module_files = _scan_module_file(path, package)
+        digest.update(source_digest)
+        pending += module_files
+
+    return digest.hexdigest()
+
+
+class LazyFunction:
+    """
+    This class stands in for a function (or class) of a module that is only imported when it is first called, e.g. a
+    pipeline stage whose module imports geopandas. Its source code is read from the module file without importing the
+    module, so a pipeline can fingerprint its nodes without paying for the imports of the stages it skips.
+
+    Input Parameters
+    ----------------
+    module_name : str (e.g. src.utils.transformations)
+    name : str (the name of the function or class in the module)
+    """
+
+    def __init__(self, module_name, name):
+
+        self.module_name = module_name
+        self.name = name
+        self.__name__ = name
+        self.__qualname__ = f'{module_name}.{name}'
+
+    def __repr__(self):
+        return f'LazyFunction({self.module_name}.{self.name})'
+
+    def resolve(self):
+        """
+        This function imports the module and returns the function.
+        """
+
+        return getattr(import_module_timed(self.module_name), self.name)
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def source_file(self):
+        """
+        This function returns the path of the module file, without importing the module.
+
+        Output
+        ------
+        path : str
+        """
+
+        return importlib.util.find_spec(self.module_name).origin
+
+    def source(self):
+        """
+        This function returns the source code of the function, read from the module file.
+
+        Output
+        ------
+        source : str
+        """
+
+        with open(self.source_file()) as f:
+            module_source = f.read()
+
+        for node in ast.parse(module_source).body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.name == self.name:
+                return ast.get_source_segment(module_source, node)
+
+        raise AttributeError(f'{self.module_name} has no function or class {self.name}')
@@ -0,0 +1,187 @@
+import cProfile
+import contextvars
+import csv
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# Set CPT_PROFILE=1 to capture a cProfile and tracemalloc report for every top level span
+PROFILE_ENV_FLAG = 'CPT_PROFILE'
+
+METRIC_FIELDS = ['run_id', 'span_id', 'parent_id', 'depth', 'name', 'start_time', 'wall_time_s', 'cpu_time_s',
+                 'peak_rss_delta_mb', 'peak_rss_mb', 'python_peak_mb', 'rows_in', 'rows_out', 'bytes_read', 'error']
+
+
+def _peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MetricsRecorder:
+    """
+    This class records a tree of timed spans for one run of the pipeline: wall and CPU time, growth of the peak resident
+    set size, rows in and out and bytes read. The open spans are held in a context variable, so a span opened inside
+    another span becomes its child, also in a thread running a contextvars.copy_context() of the parent, and bytes read
+    are added to every open span of the context.
+
+    With the CPT_PROFILE environment flag set, every top level span is also run under cProfile, the profiles are
+    written next to the exported metrics and each span records its peak traced Python memory. tracemalloc is started
+    by the first top level span and stopped when the last open span ends. The traced peak is shared by the process,
+    so it is only reset for a span when no other spans run beside it, otherwise the span records an upper bound.
+    """
+
+    def __init__(self):
+
+        self.run_id = time.strftime('%Y%m%dT%H%M%S') + f'_{os.getpid()}'
+        self.spans = []
+        self.profiles = {}
+        self._lock = threading.Lock()
+        self._open_spans = contextvars.ContextVar(f'metrics_open_spans_{id(self)}', default=())
+        self._n_open = 0
+        self._tracing = False
+        self._next_id = 0
+
+    @property
+    def profiling_enabled(self):
+        return os.environ.get(PROFILE_ENV_FLAG, '') not in ('', '0', 'false', 'False')
+
+    @contextmanager
+    def span(self, name, rows_in=None):
+        """
+        This function times a block of code as a span. The yielded dict can be updated inside the block, e.g. with
+        span['rows_out'] = len(df).
+
+        Input Parameters
+        ----------------
+        name : str
+        rows_in : int (optional number of input rows)
+
+        Output
+        ------
+        span : dict
+        """
+
+        stack = self._open_spans.get()
+        parent = stack[-1] if stack else None
+
+        with self._lock:
+            span_id = self._next_id
+            self._next_id += 1
+            if parent is None and self.profiling_enabled and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracing = True
+            tracing = tracemalloc.is_tracing()
+            # The peak is only reset when every other open span is an ancestor of this one
+            if tracing and self._n_open == len(stack):
+                tracemalloc.reset_peak()
+            self._n_open += 1
+
+        record = {field: None for field in METRIC_FIELDS}
+        record.update(run_id=self.run_id, span_id=span_id, parent_id=parent['span_id'] if parent else None,
+                      depth=len(stack), name=name, start_time=time.time(), rows_in=rows_in, bytes_read=0)
+        if tracing:
+            record['_child_python_peak'] = 0
+
+        profiler = None
+        if parent is None and self.profiling_enabled:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Only one profiler can be active at a time, e.g. when top level spans run in parallel threads
+                profiler = None
+
+        peak_rss_before = _peak_rss_mb()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        token = self._open_spans.set(stack + (record,))
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = repr(e)
+            raise
+        finally:
+            self._open_spans.reset(token)
+            record['wall_time_s'] = time.perf_counter() - wall_start
+            record['cpu_time_s'] = time.process_time() - cpu_start
+            record['peak_rss_mb'] = _peak_rss_mb()
+            record['peak_rss_delta_mb'] = record['peak_rss_mb'] - peak_rss_before
+
+            if tracing:
+                # A child span resets the peak, so the span's peak is the max of its own and its children's peaks
+                python_peak = max(tracemalloc.get_traced_memory()[1], record.pop('_child_python_peak'))
+                record['python_peak_mb'] = python_peak / 1024 ** 2
+                if parent is not None and '_child_python_peak' in parent:
+                    parent['_child_python_peak'] = max(parent['_child_python_peak'], python_peak)
+
+            if profiler is not None:
+                profiler.disable()
+                self.profiles[f'{span_id}_{name}'] = profiler
+
+            with self._lock:
+                self.spans.append(record)
+                self._n_open -= 1
+                if self._tracing and self._n_open == 0:
+                    tracemalloc.stop()
+                    self._tracing = False
+
+    def add_bytes_read(self, n_bytes):
+        """
+        This function adds a number of bytes read to every open span of the current context.
+
+        Input Parameters
+        ----------------
+        n_bytes : int
+        """
+
+        for record in self._open_spans.get():
+            record['bytes_read'] += n_bytes
+
+    def export(self, directory):
+        """
+        This function writes the spans of the run to <run_id>.json and <run_id>.csv, and the cProfile reports (if any)
+        to <run_id>_<span>.prof in a directory.
+
+        Input Parameters
+        ----------------
+        directory : str or pathlib.Path
+
+        Output
+        ------
+        json_path : pathlib.Path
+        """
+
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            spans = sorted(self.spans, key=lambda record: record['span_id'])
+
+        json_path = directory / f'{self.run_id}.json'
+        with open(json_path, 'w') as f:
+            json.dump({'run_id': self.run_id, 'spans': spans}, f, indent=2)
+
+        with open(directory / f'{self.run_id}.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=METRIC_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(spans)
+
+        for profile_name, profiler in self.profiles.items():
+            profiler.dump_stats(directory / f'{self.run_id}_{profile_name}.prof')
+
+        logging.info(f'Exported {len(spans)} metric spans to {json_path}')
+
+        return json_path
+
+
+# One recorder per process, shared by the benchmark decorator and the stages in main.py
+recorder = MetricsRecorder()
+span = recorder.span
+add_bytes_read = recorder.add_bytes_read
+export_metrics = recorder.export
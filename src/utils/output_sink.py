@@ -0,0 +1,355 @@
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from src.utils.helper_functions import benchmark
+from src.utils.hexagons import H3_NULL, h3_int_to_string, h3_parent, h3_string_to_int
+from src.utils.versioned_dir import publish_directory, staging_dir
+
+
+# The value of a partition column for rows without a hexagon or a timestamp
+MISSING_PARTITION = 'none'
+
+SINK_METADATA_FILE = '_sink.json'
+
+
+def partition_keys(df, hex_col='index', time_col='creation_timestamp', hex_resolution=5):
+    """
+    This function computes the partition of every row: the parent hexagon of its H3 cell at hex_resolution and the
+    month of its timestamp. The cells are converted once per unique value, so it is fast on millions of rows.
+
+    Input Parameters
+    ----------------
+    df : Pandas.DataFrame
+    hex_col : str (H3 cells as hex strings, '0' or missing for rows that were not joined)
+    time_col : str
+    hex_resolution : int (a coarser resolution than the cells gives fewer, bigger files)
+
+    Output
+    ------
+    hex_keys : numpy.ndarray (object, the parent cells)
+    month_keys : numpy.ndarray (object, YYYY-MM)
+    """
+
+    codes, cells = pd.factorize(df[hex_col].fillna('0').astype(str))
+    parents = h3_parent(h3_string_to_int(cells), hex_resolution)
+    unique_keys = np.where(parents == H3_NULL, MISSING_PARTITION, h3_int_to_string(parents))
+    hex_keys = unique_keys[codes] if len(codes) else np.empty(0, dtype=object)
+
+    # Only the unique months are formatted as text
+    months = pd.to_datetime(df[time_col], utc=True).dt.tz_localize(None).to_numpy().astype('datetime64[M]')
+    codes, unique_months = pd.factorize(months, use_na_sentinel=False)
+    unique_keys = np.datetime_as_string(np.asarray(unique_months, dtype='datetime64[M]'), unit='M').astype(object)
+    unique_keys[unique_keys == 'NaT'] = MISSING_PARTITION
+    month_keys = unique_keys[codes] if len(codes) else np.empty(0, dtype=object)
+
+    return hex_keys, month_keys
+
+
+def _geo_metadata(gdf):
+    """
+    This function computes the GeoParquet metadata of a GeoDataFrame: the crs, geometry types and bounding box of its
+    geometries.
+    """
+
+    geometry_col = gdf.geometry.name
+
+    return {
+        'version': '0.4.0',
+        'primary_column': geometry_col,
+        'columns': {geometry_col: {
+            'encoding': 'WKB',
+            'crs': gdf.crs.to_json_dict() if gdf.crs is not None else None,
+            'geometry_type': sorted(gdf.geometry.geom_type.dropna().unique()),
+            'bbox': list(gdf.total_bounds) if gdf.geometry.notna().any() else None}}}
+
+
+def _merge_geo_metadata(geo_metadata, other):
+    # The geometry types and bounding boxes of two parts of the same file
+    merged = json.loads(json.dumps(geo_metadata))
+    column = merged['columns'][merged['primary_column']]
+    other_column = other['columns'][other['primary_column']]
+    column['geometry_type'] = sorted(set(column['geometry_type']) | set(other_column['geometry_type']))
+    bboxes = [bbox for bbox in (column['bbox'], other_column['bbox']) if bbox is not None]
+    column['bbox'] = [*np.min(bboxes, axis=0)[:2], *np.max(bboxes, axis=0)[2:]] if bboxes else None
+
+    return merged
+
+
+def _with_geo_metadata(table, geo_metadata):
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'geo'] = json.dumps(geo_metadata).encode('utf-8')
+
+    return table.replace_schema_metadata(metadata)
+
+
+def _to_arrow(df, schema=None):
+    """
+    This function converts a (Geo)DataFrame to an Arrow table, with the field types of schema if it is given.
+    Geometries are stored as WKB with the GeoParquet metadata of df, so geopandas.read_parquet and
+    read_partitioned_output read them back as geometries.
+    """
+
+    geo_metadata = None
+    if isinstance(df, gpd.GeoDataFrame):
+        geo_metadata = _geo_metadata(df)
+        df = pd.DataFrame(df).assign(**{df.geometry.name: df.geometry.to_wkb()})
+
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    if geo_metadata is not None:
+        table = _with_geo_metadata(table, geo_metadata)
+
+    return table
+
+
+class PartitionedParquetWriter:
+    """
+    This class writes a stream of (Geo)DataFrame chunks to a Parquet dataset partitioned by hexagon and month, e.g.
+    output_dir/hex5=85ad3683fffffff/month=2020-03/part-0.parquet. Every partition is one file with zstd compressed row
+    groups of up to row_group_size rows, sorted by hexagon and timestamp, so the min/max statistics of the row groups
+    let readers skip the row groups that do not match their filters.
+
+    The files are written to a staging directory that close publishes as the new version of output_dir with a single
+    rename (see versioned_dir.publish_directory), so readers see either the previous or the new dataset and never a
+    partial or missing one. In overwrite mode the new version only has the new files. In append mode it also has hard
+    links to the files of the current version, except the parts with the same name in the partitions written (so a
+    repeated run does not duplicate rows). Appends to the same dataset must not run concurrently. Leaving a with
+    block on an exception discards the staging directory.
+
+    Input Parameters
+    ----------------
+    output_dir : str or pathlib.Path
+    part_name : str (the name of the files of this writer in every partition)
+    mode : str ('overwrite' or 'append')
+    hex_col : str
+    time_col : str
+    hex_resolution : int
+    row_group_size : int
+    compression : str
+    """
+
+    def __init__(self, output_dir, part_name='0', mode='overwrite', hex_col='index', time_col='creation_timestamp',
+                 hex_resolution=5, row_group_size=65_536, compression='zstd'):
+
+        if mode not in ('overwrite', 'append'):
+            raise ValueError(f"Unknown write mode {mode}, use 'overwrite' or 'append'")
+
+        self.output_dir = Path(output_dir)
+        self.part_name = part_name
+        self.mode = mode
+        self.hex_col = hex_col
+        self.time_col = time_col
+        self.hex_resolution = hex_resolution
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.hex_partition = f'hex{hex_resolution}'
+
+        self.staging_dir = staging_dir(self.output_dir)
+        self.schema = None
+        self.rows = 0
+        self._writers = {}
+        self._buffers = {}
+        self._geo_metadata = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _partition_path(self, hex_key, month_key):
+        return Path(f'{self.hex_partition}={hex_key}') / f'month={month_key}' / f'part-{self.part_name}.parquet'
+
+    def write(self, df):
+        """
+        This function adds a chunk to the dataset. The rows are buffered per partition and written as row groups.
+
+        Input Parameters
+        ----------------
+        df : Pandas.DataFrame or GeoPandas.GeoDataFrame
+        """
+
+        if not len(df):
+            return
+
+        hex_keys, month_keys = partition_keys(df, self.hex_col, self.time_col, self.hex_resolution)
+        groups = df.groupby([hex_keys, month_keys], sort=False, observed=True).indices
+        for (hex_key, month_key), positions in groups.items():
+            buffer = self._buffers.setdefault((hex_key, month_key), [])
+            buffer.append(df.iloc[positions])
+            if sum(len(part) for part in buffer) >= self.row_group_size:
+                self._flush(hex_key, month_key)
+        self.rows += len(df)
+
+    def _flush(self, hex_key, month_key):
+        buffer = self._buffers.pop((hex_key, month_key), [])
+        if not buffer:
+            return
+
+        partition = pd.concat(buffer) if len(buffer) > 1 else buffer[0]
+        partition = partition.sort_values([self.hex_col, self.time_col], kind='stable')
+        if isinstance(buffer[0], gpd.GeoDataFrame) and not isinstance(partition, gpd.GeoDataFrame):
+            partition = gpd.GeoDataFrame(partition, geometry=buffer[0].geometry.name, crs=buffer[0].crs)
+
+        # Every file of the dataset has the field types of the first chunk, so it can be read as one table. The
+        # GeoParquet metadata (bounding box and geometry types) is computed per file
+        table = _to_arrow(partition, self.schema)
+        if self.schema is None:
+            metadata = {key: value for key, value in (table.schema.metadata or {}).items() if key != b'geo'}
+            self.schema = table.schema.with_metadata(metadata)
+
+        key = (hex_key, month_key)
+        writer = self._writers.get(key)
+        if writer is None:
+            path = self.staging_dir / self._partition_path(hex_key, month_key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            writer = pq.ParquetWriter(path, table.schema, compression=self.compression)
+            self._writers[key] = writer
+        geo_metadata = (table.schema.metadata or {}).get(b'geo')
+        if geo_metadata is not None:
+            geo_metadata = json.loads(geo_metadata)
+            if key in self._geo_metadata:
+                geo_metadata = _merge_geo_metadata(self._geo_metadata[key], geo_metadata)
+            self._geo_metadata[key] = geo_metadata
+        writer.write_table(table, row_group_size=self.row_group_size)
+
+    def close(self):
+        """
+        This function writes the buffered rows and publishes the staging directory as the new version of output_dir.
+
+        Output
+        ------
+        summary : dict (output_dir, rows and files written)
+        """
+
+        for hex_key, month_key in list(self._buffers):
+            self._flush(hex_key, month_key)
+        for (hex_key, month_key), writer in self._writers.items():
+            writer.close()
+            # The metadata of a file is fixed when it is opened, so a file whose later row groups extend its bounding
+            # box or geometry types is written again with the metadata of all its rows (only large partitions)
+            geo_metadata = self._geo_metadata.get((hex_key, month_key))
+            if geo_metadata is not None and writer.schema.metadata[b'geo'] != json.dumps(geo_metadata).encode('utf-8'):
+                path = self.staging_dir / self._partition_path(hex_key, month_key)
+                table = _with_geo_metadata(pq.ParquetFile(path).read(), geo_metadata)
+                pq.write_table(table, path, row_group_size=self.row_group_size, compression=self.compression)
+
+        with open(self.staging_dir / SINK_METADATA_FILE, 'w') as f:
+            json.dump({'partitions': [self.hex_partition, 'month'], 'hex_col': self.hex_col,
+                       'hex_resolution': self.hex_resolution, 'time_col': self.time_col}, f)
+
+        if self.mode == 'append' and self.output_dir.exists():
+            # The files of the current version are linked, not copied, into the new version
+            for path in self.output_dir.rglob('*.parquet'):
+                new_path = self.staging_dir / path.relative_to(self.output_dir)
+                if new_path.exists():
+                    continue
+                new_path.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    os.link(path, new_path)
+                except OSError:
+                    shutil.copy2(path, new_path)
+        publish_directory(self.staging_dir, self.output_dir)
+
+        logging.info(f'Wrote {self.rows} rows to {len(self._writers)} partitions of {self.output_dir}')
+
+        return {'output_dir': str(self.output_dir), 'rows': self.rows, 'files': len(self._writers)}
+
+    def abort(self):
+        """
+        This function discards everything written since the writer was created.
+        """
+
+        for writer in self._writers.values():
+            writer.close()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+
+@benchmark
+def write_partitioned_output(df, output_dir, **writer_params):
+    """
+    This function writes a pipeline result to a Parquet (GeoParquet for GeoDataFrames) dataset partitioned by hexagon
+    and creation month, replacing the previous version of the dataset atomically. See PartitionedParquetWriter.
+
+    Input Parameters
+    ----------------
+    df : Pandas.DataFrame or GeoPandas.GeoDataFrame
+    output_dir : str or pathlib.Path (e.g. data/output/anonymized_sr_data)
+    writer_params : keyword arguments of PartitionedParquetWriter (e.g. hex_resolution=5)
+
+    Output
+    ------
+    summary : dict (output_dir, rows and files written)
+    """
+
+    writer = PartitionedParquetWriter(output_dir, **writer_params)
+    try:
+        writer.write(df)
+    except Exception:
+        writer.abort()
+        raise
+
+    return writer.close()
+
+
+@benchmark
+def read_partitioned_output(output_dir, filters=None, columns=None):
+    """
+    This function reads (part of) a dataset written by PartitionedParquetWriter. The filters are pushed down to the
+    scan: partitions that do not match are not opened and row groups whose statistics do not match are not read, e.g.
+    filters=[('month', '=', '2020-03'), ('official_suburb', '=', 'BELLVILLE SOUTH')]. A filter on the H3 cells, e.g.
+    ('index', 'in', cells), is also applied to the hexagon partitions.
+
+    Input Parameters
+    ----------------
+    output_dir : str or pathlib.Path
+    filters : list of (column, operator, value) tuples (optional, combined with and)
+    columns : list[str] (optional, defaults to every column)
+
+    Output
+    ------
+    df : Pandas.DataFrame or GeoPandas.GeoDataFrame (if the dataset has geometries)
+    """
+
+    output_dir = Path(output_dir)
+    with open(output_dir / SINK_METADATA_FILE) as f:
+        metadata = json.load(f)
+
+    partitioning = ds.partitioning(pa.schema([(name, pa.string()) for name in metadata['partitions']]),
+                                   flavor='hive')
+    dataset = ds.dataset(output_dir, format='parquet', partitioning=partitioning,
+                         exclude_invalid_files=False, ignore_prefixes=['.', '_'])
+    # A filter on the H3 cells also selects the partitions of their parents, so the other partitions are not opened
+    filters = list(filters or [])
+    for column, operator, value in list(filters):
+        if column == metadata['hex_col'] and operator in ('=', '==', 'in'):
+            cells = [value] if operator != 'in' else list(value)
+            parents = list(partition_keys(pd.DataFrame({column: cells, 'month': pd.NaT}), column, 'month',
+                                          metadata['hex_resolution'])[0])
+            filters.append((metadata['partitions'][0], 'in', parents))
+    expression = pq.filters_to_expression(filters) if filters else None
+    table = dataset.to_table(columns=columns, filter=expression)
+
+    geo_metadata = (dataset.schema.metadata or {}).get(b'geo')
+    df = table.to_pandas()
+    if geo_metadata is None:
+        return df
+
+    geo_metadata = json.loads(geo_metadata)
+    geometry_col = geo_metadata['primary_column']
+    if geometry_col not in df.columns:
+        return df
+    crs = geo_metadata['columns'][geometry_col].get('crs')
+
+    return gpd.GeoDataFrame(df.assign(**{geometry_col: gpd.GeoSeries.from_wkb(df[geometry_col])}),
+                            geometry=geometry_col, crs=crs)
@@ -0,0 +1,173 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import shapely
+
+
+# Side of the grid used to order the points along a Z-order curve, 2 ** ZORDER_BITS cells per axis
+ZORDER_BITS = 10
+
+# Polygons of the extract, set in every worker process by _init_worker
+_POLYGONS = None
+
+
+def _zorder_keys(lat, lon, bits=ZORDER_BITS):
+    """
+    This function computes the Z-order (Morton) key of every point on a grid over the bounding box of the points, so
+    points that are close in the key order are close in space. Points without coordinates get the largest key.
+    """
+
+    located = ~(np.isnan(lat) | np.isnan(lon))
+    keys = np.full(len(lat), np.iinfo(np.int64).max, dtype=np.int64)
+    if not located.any():
+        return keys
+
+    cells = []
+    for values in (lat[located], lon[located]):
+        low, high = values.min(), values.max()
+        scale = (2 ** bits - 1) / (high - low) if high > low else 0.0
+        cells.append(((values - low) * scale).astype(np.int64))
+
+    located_keys = np.zeros(located.sum(), dtype=np.int64)
+    for bit in range(bits):
+        located_keys |= ((cells[0] >> bit) & 1) << (2 * bit + 1)
+        located_keys |= ((cells[1] >> bit) & 1) << (2 * bit)
+    keys[located] = located_keys
+
+    return keys
+
+
+def spatial_partitions(lat, lon, n_partitions):
+    """
+    This function splits points into spatially coherent partitions of about the same size, by sorting them along a
+    Z-order curve and cutting the sorted order into contiguous ranges.
+
+    Input Parameters
+    ----------------
+    lat : numpy.ndarray
+    lon : numpy.ndarray
+    n_partitions : int
+
+    Output
+    ------
+    order : numpy.ndarray (the point positions sorted along the curve)
+    bounds : list[tuple] ((start, stop) of every partition in order)
+    """
+
+    order = np.argsort(_zorder_keys(lat, lon), kind='stable')
+    edges = np.linspace(0, len(order), min(n_partitions, max(len(order), 1)) + 1).astype(np.int64)
+    bounds = [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+    return order, bounds
+
+
+def _init_worker(polygons):
+    global _POLYGONS
+    _POLYGONS = polygons
+
+
+def _join_partition(shared_names, n_points, start, stop, polygon_positions):
+    """
+    This function joins one partition of the points (in shared memory) to the polygons that overlap it and writes the
+    position of the polygon containing every point (-1 if there is none) to the shared output array.
+    """
+
+    blocks = [shared_memory.SharedMemory(name=name) for name in shared_names]
+    try:
+        lat, lon = (np.ndarray(n_points, dtype=np.float64, buffer=block.buf) for block in blocks[:2])
+        output = np.ndarray(n_points, dtype=np.int64, buffer=blocks[2].buf)
+
+        points = shapely.points(lon[start:stop], lat[start:stop])
+        tree = shapely.STRtree(_POLYGONS[polygon_positions])
+        point_idx, polygon_idx = tree.query(points, predicate='within')
+
+        # A point inside several (overlapping) polygons keeps the first one
+        first = np.unique(point_idx, return_index=True)[1]
+        partition_output = np.full(stop - start, -1, dtype=np.int64)
+        partition_output[point_idx[first]] = polygon_positions[polygon_idx[first]]
+        output[start:stop] = partition_output
+
+        # Release the views before closing the shared memory blocks
+        del lat, lon, output
+    finally:
+        for block in blocks:
+            block.close()
+
+    return stop - start
+
+
+def partitioned_join_positions(lat, lon, polygons, max_workers=None, partitions_per_worker=4):
+    """
+    This function finds the polygon containing every point on a pool of worker processes. The points are split into
+    spatially coherent partitions (see spatial_partitions) and every partition is joined to only the polygons that
+    overlap its bounding box. The coordinates and the result are kept in shared memory so they are not pickled, and
+    with the fork start method the polygons are inherited by the workers instead of being pickled too.
+
+    Input Parameters
+    ----------------
+    lat : numpy.ndarray
+    lon : numpy.ndarray
+    polygons : numpy.ndarray (shapely geometries, e.g. GeoDataFrame.geometry.values)
+    max_workers : int (optional, defaults to the number of CPUs)
+    partitions_per_worker : int (more partitions than workers balance the load between dense and sparse areas)
+
+    Output
+    ------
+    polygon_positions : numpy.ndarray (the position in polygons of the polygon containing every point, -1 if none)
+    """
+
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    polygons = np.asarray(polygons, dtype=object)
+    n_points = len(lat)
+    if n_points == 0:
+        return np.empty(0, dtype=np.int64)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    order, bounds = spatial_partitions(lat, lon, max_workers * partitions_per_worker)
+    polygon_tree = shapely.STRtree(polygons)
+
+    blocks = [shared_memory.SharedMemory(create=True, size=n_points * 8) for _ in range(3)]
+    try:
+        sorted_lat, sorted_lon = (np.ndarray(n_points, dtype=np.float64, buffer=block.buf) for block in blocks[:2])
+        sorted_lat[:] = lat[order]
+        sorted_lon[:] = lon[order]
+
+        tasks = []
+        for start, stop in bounds:
+            partition_lat, partition_lon = sorted_lat[start:stop], sorted_lon[start:stop]
+            if np.isnan(partition_lat).all() or np.isnan(partition_lon).all():
+                polygon_positions = np.empty(0, dtype=np.int64)
+            else:
+                polygon_positions = polygon_tree.query(shapely.box(
+                    np.nanmin(partition_lon), np.nanmin(partition_lat),
+                    np.nanmax(partition_lon), np.nanmax(partition_lat)))
+            tasks.append((start, stop, np.sort(polygon_positions)))
+        del sorted_lat, sorted_lon
+
+        start_methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context('fork' if 'fork' in start_methods else None)
+        shared_names = [block.name for block in blocks]
+        logging.info(
+            f'Joining {n_points} points to {len(polygons)} polygons in {len(tasks)} partitions on {max_workers} processes')
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context,
+                                 initializer=_init_worker, initargs=(polygons,)) as executor:
+            futures = [executor.submit(_join_partition, shared_names, n_points, start, stop, polygon_positions)
+                       for start, stop, polygon_positions in tasks]
+            for future in futures:
+                future.result()
+
+        # Scatter the results back to the original row order
+        sorted_output = np.ndarray(n_points, dtype=np.int64, buffer=blocks[2].buf)
+        polygon_positions = np.empty(n_points, dtype=np.int64)
+        polygon_positions[order] = sorted_output
+        del sorted_output
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return polygon_positions
@@ -0,0 +1,243 @@
+import contextvars
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from src.utils.lazy_imports import LazyFunction, source_tree_hash
+from src.utils.metrics import span
+from src.utils.scheduler import call_with_retries
+
+
+class Node:
+    """
+    This class is one step of a Pipeline: a function, the nodes whose outputs it takes as inputs and its parameters.
+
+    Input Parameters
+    ----------------
+    name : str
+    func : callable
+    inputs : dict (function argument name : name of the node whose output is passed in)
+    params : dict (function argument name : value, part of the fingerprint so changing one re-runs the node)
+    resources : dict (function argument name : value, e.g. an S3 client, passed in but not fingerprinted)
+    version : callable (optional, returns a string identifying the version of an external source, e.g. an S3 ETag)
+    code_version : str (optional, change it to force a re-run, e.g. when code outside of the src package has changed)
+    timeout : float (optional, seconds before an attempt of the node is abandoned)
+    retries : int (the number of extra attempts after a failed or timed out attempt, e.g. for network extracts)
+    exists : callable (optional, returns False when an output the node writes outside of the pipeline is missing, e.g.
+             a deleted dataset, so the node runs again even though its fingerprint has not changed)
+    """
+
+    def __init__(self, name, func, inputs=None, params=None, resources=None, version=None, code_version='',
+                 timeout=None, retries=0, exists=None):
+
+        self.name = name
+        self.func = func
+        self.inputs = inputs or {}
+        self.params = params or {}
+        self.resources = resources or {}
+        self.version = version
+        self.code_version = code_version
+        self.timeout = timeout
+        self.retries = retries
+        self.exists = exists
+
+    def code_hash(self):
+        """
+        This function hashes the source of the node function (or its name if the source is not available), together
+        with its module and every module of the src package the module imports, so editing a helper the function
+        calls also re-runs the node.
+        """
+
+        func = inspect.unwrap(self.func)
+        try:
+            # A lazy function reads its source without importing its module
+            if isinstance(func, LazyFunction):
+                source, source_file = func.source(), func.source_file()
+            else:
+                source, source_file = inspect.getsource(func), inspect.getsourcefile(func)
+            source += source_tree_hash(source_file)
+        except (OSError, TypeError):
+            source = getattr(func, '__qualname__', repr(func))
+
+        return hashlib.sha256(f'{source}{self.code_version}'.encode('utf-8')).hexdigest()
+
+
+class Pipeline:
+    """
+    This class runs a DAG of Nodes with incremental re-execution.
+
+    The fingerprint of a node is a hash of its code, parameters, source version and the fingerprints of its inputs.
+    Every node output is pickled to store_dir/<node>/<fingerprint>.pkl, so a node whose fingerprint has not changed
+    (and whose exists check passes, see Node) is skipped and its output is only loaded from disk if a node that does
+    need to run depends on it. Nodes whose inputs
+    are ready run concurrently on a thread pool, e.g. independent extracts.
+
+    Input Parameters
+    ----------------
+    store_dir : str or pathlib.Path (the directory of the materialized node outputs, e.g. data/pipeline)
+    max_workers : int (the maximum number of nodes running at the same time)
+    """
+
+    def __init__(self, store_dir, max_workers=4):
+
+        self.store_dir = Path(store_dir)
+        self.max_workers = max_workers
+        self.nodes = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, func, inputs=None, params=None, resources=None, version=None, code_version='',
+            timeout=None, retries=0, exists=None):
+        """
+        This function adds a node to the pipeline, see Node for the parameters. Nodes can be added in any order.
+        """
+
+        if name in self.nodes:
+            raise ValueError(f'The pipeline already has a node called {name}')
+        self.nodes[name] = Node(name, func, inputs, params, resources, version, code_version, timeout, retries,
+                                exists)
+
+        return self.nodes[name]
+
+    def _upstream(self, targets):
+        # Every node the targets depend on, in topological order
+        order, visiting, visited = [], set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f'The pipeline has a cycle through {name}')
+            if name not in self.nodes:
+                raise KeyError(f'Unknown pipeline node {name}')
+            visiting.add(name)
+            for input_name in self.nodes[name].inputs.values():
+                visit(input_name)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for target in targets:
+            visit(target)
+
+        return order
+
+    def fingerprints(self, targets=None):
+        """
+        This function computes the fingerprint of every node the targets depend on, without running anything.
+
+        Input Parameters
+        ----------------
+        targets : list[str] (optional, defaults to every node)
+
+        Output
+        ------
+        fingerprints : dict (node name : fingerprint)
+        """
+
+        fingerprints = {}
+        for name in self._upstream(targets or list(self.nodes)):
+            node = self.nodes[name]
+            digest = hashlib.sha256()
+            digest.update(name.encode('utf-8'))
+            digest.update(node.code_hash().encode('utf-8'))
+            digest.update(repr(sorted(node.params.items())).encode('utf-8'))
+            if node.version is not None:
+                digest.update(str(node.version()).encode('utf-8'))
+            for argument, input_name in sorted(node.inputs.items()):
+                digest.update(f'{argument}={fingerprints[input_name]}'.encode('utf-8'))
+            fingerprints[name] = digest.hexdigest()
+
+        return fingerprints
+
+    def _path(self, name, fingerprint):
+        return self.store_dir / name / f'{fingerprint}.pkl'
+
+    def _save(self, name, fingerprint, value):
+        path = self._path(name, fingerprint)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        # Only the latest output of a node is kept
+        for old_path in path.parent.glob('*.pkl'):
+            if old_path != path:
+                old_path.unlink(missing_ok=True)
+
+    def _load(self, name, fingerprint):
+        with span(f'load:{name}'), open(self._path(name, fingerprint), 'rb') as f:
+            return pickle.load(f)
+
+    def run(self, targets=None, force=()):
+        """
+        This function runs the nodes the targets depend on that are out of date and returns the target outputs.
+
+        Input Parameters
+        ----------------
+        targets : list[str] (optional, defaults to every node without dependents)
+        force : iterable of str (nodes to re-run even if they are up to date)
+
+        Output
+        ------
+        results : dict (target name : output)
+        """
+
+        if targets is None:
+            used_as_input = {name for node in self.nodes.values() for name in node.inputs.values()}
+            targets = [name for name in self.nodes if name not in used_as_input]
+
+        fingerprints = self.fingerprints(targets)
+        stale = {name for name in fingerprints
+                 if name in force or not self._path(name, fingerprints[name]).exists()
+                 or (self.nodes[name].exists is not None and not self.nodes[name].exists())}
+        logging.info(
+            f'Pipeline : {len(stale)} of {len(fingerprints)} nodes to run {sorted(stale)}')
+
+        values = {}
+
+        def get_value(name):
+            # Loads up to date outputs from disk on first use
+            with self._lock:
+                if name in values:
+                    return values[name]
+            value = self._load(name, fingerprints[name])
+            with self._lock:
+                values.setdefault(name, value)
+                return values[name]
+
+        def run_node(name):
+            node = self.nodes[name]
+            kwargs = {argument: get_value(input_name) for argument, input_name in node.inputs.items()}
+            kwargs.update(node.params)
+            kwargs.update(node.resources)
+            with span(f'node:{name}'):
+                value = call_with_retries(node.func, kwargs, timeout=node.timeout, retries=node.retries,
+                                          name=name)
+            self._save(name, fingerprints[name], value)
+            with self._lock:
+                values[name] = value
+
+        pending = set(stale)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                ready = [name for name in pending
+                         if not any(input_name in pending or input_name in running.values()
+                                    for input_name in self.nodes[name].inputs.values())]
+                for name in ready:
+                    pending.discard(name)
+                    # The node runs in a copy of the current context so its span is a child of the open span
+                    running[executor.submit(contextvars.copy_context().run, run_node, name)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    # Re-raise the error of a failed node
+                    future.result()
+                    logging.info(f'Pipeline : completed node {name}')
+
+        return {target: get_value(target) for target in targets}
@@ -0,0 +1,268 @@
+import configparser
+import hashlib
+import logging
+import os
+import secrets
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+
+# The secret key is read from this environment variable, or else from the PSEUDONYMIZATION section of dl.cfg
+PSEUDONYMIZATION_KEY_ENV = 'CPT_PSEUDONYMIZATION_KEY'
+CONFIG_PATH = Path(__file__).resolve().parents[1] / 'config' / 'dl.cfg'
+
+# SipHash initialization constants ("somepseudorandomlygeneratedbytes")
+_SIPHASH_INIT = tuple(np.uint64(value) for value in (
+    0x736f6d6570736575, 0x646f72616e646f6d, 0x6c7967656e657261, 0x7465646279746573))
+
+# Key generated for the process when no key is configured, the pseudonyms are then only stable within the process
+_EPHEMERAL_KEY = None
+
+
+def load_pseudonymization_key(config_path=CONFIG_PATH, required=False):
+    """
+    This function loads the secret key of the pseudonymization from the CPT_PSEUDONYMIZATION_KEY environment variable,
+    or else from the KEY option of the PSEUDONYMIZATION section of dl.cfg. Without a configured key a random key is
+    generated once per process, and the pseudonyms can not be joined across runs, unless the key is required.
+
+    Input Parameters
+    ----------------
+    config_path : str or pathlib.Path
+    required : bool (raise a ValueError instead of using a random key, for releases that must be joinable)
+
+    Output
+    ------
+    key : bytes
+    """
+
+    global _EPHEMERAL_KEY
+
+    key = os.environ.get(PSEUDONYMIZATION_KEY_ENV)
+    if not key and Path(config_path).exists():
+        config = configparser.ConfigParser()
+        with open(config_path) as f:
+            config.read_file(f)
+        key = config.get('PSEUDONYMIZATION', 'KEY', fallback=None)
+
+    if key:
+        return key.encode('utf-8')
+    if required:
+        raise ValueError(f'No pseudonymization key in {PSEUDONYMIZATION_KEY_ENV} or the KEY option of the '
+                         f'PSEUDONYMIZATION section of {config_path}, the releases would not be joinable across runs')
+
+    if _EPHEMERAL_KEY is None:
+        logging.warning(f'No pseudonymization key in {PSEUDONYMIZATION_KEY_ENV} or {config_path}, using a random key '
+                        f'for this run, the pseudonyms will differ between runs')
+        _EPHEMERAL_KEY = secrets.token_bytes(32)
+
+    return _EPHEMERAL_KEY
+
+
+# Number of values hashed at a time, the SipHash state of a block stays in the CPU cache
+SIPHASH_BLOCK_SIZE = 16384
+
+
+def _rotl(values, bits, tmp):
+    # In place rotation to the left of uint64 values
+    np.left_shift(values, np.uint64(bits), out=tmp)
+    values >>= np.uint64(64 - bits)
+    values |= tmp
+
+
+def _sipround(v0, v1, v2, v3, tmp):
+    v0 += v1
+    _rotl(v1, 13, tmp)
+    v1 ^= v0
+    _rotl(v0, 32, tmp)
+    v2 += v3
+    _rotl(v3, 16, tmp)
+    v3 ^= v2
+    v0 += v3
+    _rotl(v3, 21, tmp)
+    v3 ^= v0
+    v2 += v1
+    _rotl(v1, 17, tmp)
+    v1 ^= v2
+    _rotl(v2, 32, tmp)
+
+
+def siphash24_uint64(words, k0, k1):
+    """
+    This function computes the SipHash-2-4 of every 8 byte message of an array with numpy, in blocks of
+    SIPHASH_BLOCK_SIZE values. SipHash is a keyed hash function (a PRF) designed for short inputs, so the same key
+    always gives the same hash and the hashes can not be computed or reversed without the key.
+
+    Input Parameters
+    ----------------
+    words : numpy.ndarray (uint64, every value is the little endian message of 8 bytes)
+    k0 : numpy.uint64 (the first 8 bytes of the 128 bit key, little endian)
+    k1 : numpy.uint64 (the last 8 bytes of the key)
+
+    Output
+    ------
+    hashes : numpy.ndarray (uint64)
+    """
+
+    words = np.asarray(words, dtype=np.uint64)
+    hashes = np.empty_like(words)
+    final_block = np.uint64(8 << 56)
+    for start in range(0, len(words), SIPHASH_BLOCK_SIZE):
+        block = words[start:start + SIPHASH_BLOCK_SIZE]
+        v0 = np.full(block.shape, k0 ^ _SIPHASH_INIT[0], dtype=np.uint64)
+        v1 = np.full(block.shape, k1 ^ _SIPHASH_INIT[1], dtype=np.uint64)
+        v2 = np.full(block.shape, k0 ^ _SIPHASH_INIT[2], dtype=np.uint64)
+        v3 = np.full(block.shape, k1 ^ _SIPHASH_INIT[3], dtype=np.uint64)
+        tmp = np.empty_like(block)
+
+        # The message, then the final block holding the message length (8 bytes, nothing left over)
+        for message in (block, final_block):
+            v3 ^= message
+            for _ in range(2):
+                _sipround(v0, v1, v2, v3, tmp)
+            v0 ^= message
+
+        v2 ^= np.uint64(0xff)
+        for _ in range(4):
+            _sipround(v0, v1, v2, v3, tmp)
+
+        v0 ^= v1
+        v0 ^= v2
+        v0 ^= v3
+        hashes[start:start + SIPHASH_BLOCK_SIZE] = v0
+
+    return hashes
+
+
+def _hex_tokens(high, low):
+    # Two uint64 arrays to 32 character hex strings, formatted in one pass over a big endian buffer
+    buffer = np.empty((len(high), 2), dtype='>u8')
+    buffer[:, 0] = high
+    buffer[:, 1] = low
+    hex_digits = buffer.tobytes().hex().encode('ascii')
+
+    return np.frombuffer(hex_digits, dtype='S32').astype(str).astype(object)
+
+
+class Pseudonymizer:
+    """
+    This class replaces identifiers with keyed pseudonyms (32 hex characters): the same identifier and key always give
+    the same pseudonym, so the outputs of different runs (e.g. incremental runs) can be joined, but the pseudonyms can
+    not be linked to the identifiers without the key.
+
+    Integer identifiers (such as the float64 reference numbers) are hashed with two SipHash-2-4 keys derived from the
+    secret, vectorized with numpy. Other values are hashed once per unique value with keyed BLAKE2b. Missing values
+    stay missing.
+
+    With a mapping_path, the pseudonyms are instead random tokens issued the first time an identifier is seen and kept
+    in a Parquet mapping table (keyed hash : pseudonym), so the published pseudonyms can not be recomputed from the
+    identifiers even with the key. The table is looked up by keyed hash, so it only works with the key it was built
+    with. It must not be shared by concurrent runs.
+
+    Input Parameters
+    ----------------
+    key : bytes (optional, defaults to load_pseudonymization_key())
+    mapping_path : str or pathlib.Path (optional, e.g. data/pseudonyms.parquet)
+    """
+
+    def __init__(self, key=None, mapping_path=None):
+
+        key = load_pseudonymization_key() if key is None else key
+        # Separate subkeys for the numeric and the text hashes
+        self._blake2_key = hashlib.blake2b(key, digest_size=32, person=b'cpt-blake2').digest()
+        siphash_key = hashlib.blake2b(key, digest_size=32, person=b'cpt-siphash').digest()
+        self._siphash_keys = np.frombuffer(siphash_key, dtype='<u8').astype(np.uint64)
+
+        self.mapping_path = Path(mapping_path) if mapping_path is not None else None
+        self._mapping = pd.Series(index=pd.Index([], dtype=object), dtype=object)
+        self._new_pseudonyms = []
+        if self.mapping_path is not None and self.mapping_path.exists():
+            table = pd.read_parquet(self.mapping_path)
+            self._mapping = pd.Series(table['pseudonym'].to_numpy(dtype=object),
+                                      index=pd.Index(table['token'].to_numpy(dtype=object), dtype=object))
+            logging.info(f'Loaded {len(self._mapping)} pseudonyms from {self.mapping_path}')
+
+    def tokens(self, values):
+        """
+        This function computes the keyed hash of every value of a column.
+
+        Input Parameters
+        ----------------
+        values : Pandas.Series or array-like
+
+        Output
+        ------
+        tokens : numpy.ndarray (object, 32 hex characters or None for missing values)
+        """
+
+        values = pd.Series(values).reset_index(drop=True)
+        missing = values.isna().to_numpy()
+        tokens = np.full(len(values), None, dtype=object)
+        present = values[~missing]
+
+        numbers = present.to_numpy() if present.dtype.kind in 'iuf' else None
+        if numbers is not None and (np.mod(numbers, 1) == 0).all():
+            words = numbers.astype(np.int64).view(np.uint64)
+            k0, k1, k2, k3 = self._siphash_keys
+            tokens[~missing] = _hex_tokens(siphash24_uint64(words, k0, k1), siphash24_uint64(words, k2, k3))
+            return tokens
+
+        # Every unique value is hashed once
+        codes, uniques = pd.factorize(present.astype(str))
+        base = hashlib.blake2b(key=self._blake2_key, digest_size=16)
+        unique_tokens = np.empty(len(uniques), dtype=object)
+        for position, value in enumerate(uniques):
+            digest = base.copy()
+            digest.update(value.encode('utf-8'))
+            unique_tokens[position] = digest.hexdigest()
+        tokens[~missing] = unique_tokens[codes]
+
+        return tokens
+
+    def pseudonymize(self, values):
+        """
+        This function replaces the values of a column with their pseudonyms.
+
+        Input Parameters
+        ----------------
+        values : Pandas.Series
+
+        Output
+        ------
+        pseudonyms : Pandas.Series (object, with the index of values)
+        """
+
+        tokens = self.tokens(values)
+        index = values.index if isinstance(values, pd.Series) else None
+        if self.mapping_path is None:
+            return pd.Series(tokens, index=index, dtype=object)
+
+        # Tokens that are not in the mapping table yet get a new random pseudonym
+        unique_tokens = pd.unique(tokens[pd.notna(tokens)])
+        new_tokens = unique_tokens[self._mapping.index.get_indexer(unique_tokens) == -1]
+        if len(new_tokens):
+            new_pseudonyms = pd.Series([secrets.token_hex(16) for _ in new_tokens],
+                                       index=pd.Index(new_tokens, dtype=object), dtype=object)
+            self._mapping = pd.concat([self._mapping, new_pseudonyms])
+            self._new_pseudonyms.append(len(new_tokens))
+
+        pseudonyms = self._mapping.reindex(tokens).to_numpy(dtype=object)
+
+        return pd.Series(pseudonyms, index=index, dtype=object)
+
+    def save(self):
+        """
+        This function writes the mapping table, if pseudonyms were issued since it was loaded or last saved.
+        """
+
+        if self.mapping_path is None or not self._new_pseudonyms:
+            return
+
+        self.mapping_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.mapping_path.with_suffix('.tmp')
+        pd.DataFrame({'token': self._mapping.index.to_numpy(dtype=object),
+                      'pseudonym': self._mapping.to_numpy(dtype=object)}).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.mapping_path)
+
+        logging.info(f'Issued {sum(self._new_pseudonyms)} new pseudonyms, {len(self._mapping)} in {self.mapping_path}')
+        self._new_pseudonyms = []
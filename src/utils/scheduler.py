@@ -0,0 +1,56 @@
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+
+
+def call_with_retries(func, kwargs=None, timeout=None, retries=0, backoff=1.0, name=None):
+    """
+    This function calls a function with a per attempt timeout and retries it with exponential backoff.
+
+    A timed out attempt can not be killed, so it is given up to timeout more seconds to stop (its result is ignored)
+    before the next attempt starts, and the call fails without retrying if it is still running. Two attempts never run
+    at the same time, e.g. downloading the same object or writing the same cache entry. Network calls should have
+    their own timeouts (see extract_data.create_s3_client) so a timed out attempt stops soon.
+
+    Input Parameters
+    ----------------
+    func : callable
+    kwargs : dict (the keyword arguments of func)
+    timeout : float (optional, seconds before an attempt is abandoned)
+    retries : int (the number of extra attempts)
+    backoff : float (seconds to wait before the first retry, doubled for every further retry)
+    name : str (optional name used in the log messages)
+
+    Output
+    ------
+    the return value of func
+    """
+
+    kwargs = kwargs or {}
+    name = name or getattr(func, '__name__', repr(func))
+    for attempt in range(retries + 1):
+        future = None
+        try:
+            if timeout is None:
+                return func(**kwargs)
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{name}-attempt')
+            try:
+                # The attempt runs in a copy of the current context so its spans are children of the open span
+                future = executor.submit(contextvars.copy_context().run, func, **kwargs)
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                raise TimeoutError(f'{name} did not finish within {timeout} seconds') from None
+            finally:
+                executor.shutdown(wait=False)
+        except Exception as e:
+            if attempt == retries:
+                logging.error(f'{name} failed after {attempt + 1} attempts : {e}')
+                raise
+            if future is not None and not wait([future], timeout=timeout).done:
+                logging.error(f'{name} failed on attempt {attempt + 1} : {e}, not retrying while it is still running')
+                raise
+            delay = backoff * 2 ** attempt
+            logging.warning(
+                f'{name} failed on attempt {attempt + 1} of {retries + 1} : {e}, retrying in {delay:.1f} seconds')
+            time.sleep(delay)
@@ -0,0 +1,190 @@
+import logging
+import numpy as np
+from src.utils.geodesy import bounding_box, geodesic_distance
+
+
+class SRSpatialIndex:
+    """
+    This class is a sorted grid index over the latitude/longitude columns of the (joined) service request data.
+
+    Points are bucketed into square lat/lon cells and the row positions are sorted by cell id, so that the cells of one
+    grid row are contiguous. A query only reads the slices of the cells overlapping its bounding box and computes exact
+    distances for those candidates. Queries return row positions into the indexed frame (for use with DataFrame.iloc),
+    the frame itself is never copied.
+
+    Input Parameters
+    ----------------
+    sr_data : Pandas.DataFrame (any frame with latitude and longitude columns)
+    cell_size : float (the cell size in degrees, 0.01 degrees is roughly 1 km in Cape Town)
+    lat_col : str
+    lon_col : str
+    """
+
+    def __init__(self, sr_data, cell_size=0.01, lat_col='latitude', lon_col='longitude'):
+
+        self.cell_size = cell_size
+        self.lat = sr_data[lat_col].to_numpy(dtype=np.float64)
+        self.lon = sr_data[lon_col].to_numpy(dtype=np.float64)
+
+        # Rows without coordinates are left out of the index
+        valid = np.flatnonzero(np.isfinite(self.lat) & np.isfinite(self.lon))
+        if len(valid) == 0:
+            self.lat0 = self.lon0 = 0.0
+            self.n_rows = self.n_cols = 1
+        else:
+            self.lat0 = self.lat[valid].min()
+            self.lon0 = self.lon[valid].min()
+            # The grid size uses the same formula as the cell of a point, so the last point is always inside it
+            self.n_rows = int(self._cell_row(self.lat[valid]).max()) + 1
+            self.n_cols = int(self._cell_col(self.lon[valid]).max()) + 1
+
+        cell_ids = self._cell_row(self.lat[valid]) * self.n_cols + \
+            self._cell_col(self.lon[valid])
+        order = np.argsort(cell_ids, kind='stable')
+        self.positions = valid[order]
+        self.sorted_cells = cell_ids[order]
+
+        logging.info(
+            f'Built spatial index over {len(self.positions)} of {len(self.lat)} rows in a {self.n_rows} x {self.n_cols} grid')
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _cell_row(self, lat):
+        return np.floor((np.asarray(lat) - self.lat0) / self.cell_size).astype(np.int64)
+
+    def _cell_col(self, lon):
+        return np.floor((np.asarray(lon) - self.lon0) / self.cell_size).astype(np.int64)
+
+    def candidates(self, box):
+        """
+        This function returns the row positions of every indexed point in the grid cells overlapping a lat/lon box.
+
+        Input Parameters
+        ----------------
+        box : tuple (min_lat, max_lat, min_lon, max_lon)
+
+        Output
+        ------
+        positions : numpy.ndarray (int64)
+        """
+
+        min_lat, max_lat, min_lon, max_lon = box
+        row_start = max(int(self._cell_row(min_lat)), 0)
+        row_end = min(int(self._cell_row(max_lat)), self.n_rows - 1)
+        col_start = max(int(self._cell_col(min_lon)), 0)
+        col_end = min(int(self._cell_col(max_lon)), self.n_cols - 1)
+        if row_start > row_end or col_start > col_end:
+            return np.empty(0, dtype=np.int64)
+
+        # The cells of a grid row are contiguous in the sorted order, so each row is a single slice
+        rows = np.arange(row_start, row_end + 1) * self.n_cols
+        starts = np.searchsorted(self.sorted_cells, rows + col_start, side='left')
+        ends = np.searchsorted(self.sorted_cells, rows + col_end, side='right')
+
+        return np.concatenate([self.positions[s:e] for s, e in zip(starts, ends)])
+
+    def query_radius(self, lat, lon, radius, method='haversine', return_distance=False):
+        """
+        This function finds every indexed point within a radius of a location.
+
+        Input Parameters
+        ----------------
+        lat : float (degrees)
+        lon : float (degrees)
+        radius : float (meters)
+        method : str ('haversine' or 'vincenty')
+        return_distance : bool (also return the distances of the matched points)
+
+        Output
+        ------
+        positions : numpy.ndarray (sorted row positions)
+        distances : numpy.ndarray (meters, only when return_distance is True)
+        """
+
+        candidates = self.candidates(bounding_box(lat, lon, radius))
+        distances = geodesic_distance(lat, lon, self.lat[candidates], self.lon[candidates],
+                                      method=method)
+        within = distances <= radius
+        positions, distances = candidates[within], distances[within]
+
+        order = np.argsort(positions)
+        if return_distance:
+            return positions[order], distances[order]
+
+        return positions[order]
+
+    def query_knn(self, lat, lon, k, method='haversine', return_distance=False):
+        """
+        This function finds the k indexed points nearest to a location, ordered by distance.
+
+        The search radius starts at one cell and doubles until at least k points fall inside it, the points inside
+        the radius are then exactly the candidates that can be among the k nearest.
+
+        Input Parameters
+        ----------------
+        lat : float (degrees)
+        lon : float (degrees)
+        k : int
+        method : str ('haversine' or 'vincenty')
+        return_distance : bool (also return the distances of the matched points)
+
+        Output
+        ------
+        positions : numpy.ndarray (row positions, nearest first)
+        distances : numpy.ndarray (meters, only when return_distance is True)
+        """
+
+        k = min(k, len(self.positions))
+        radius = self.cell_size * 111_000
+        while True:
+            positions, distances = self.query_radius(lat, lon, radius, method=method,
+                                                     return_distance=True)
+            # Half the earth's circumference covers every point
+            if len(positions) >= k or radius > 2.1e7:
+                break
+            radius *= 2
+
+        nearest = np.argsort(distances, kind='stable')[:k]
+        if return_distance:
+            return positions[nearest], distances[nearest]
+
+        return positions[nearest]
+
+    def query_radius_batch(self, lats, lons, radius, method='haversine'):
+        """
+        This function runs query_radius for several locations (e.g. the centroids of many suburbs).
+
+        Input Parameters
+        ----------------
+        lats : sequence of float (degrees)
+        lons : sequence of float (degrees)
+        radius : float or sequence of float (meters, one radius for all locations or one per location)
+        method : str ('haversine' or 'vincenty')
+
+        Output
+        ------
+        list[numpy.ndarray] : the row positions for each location
+        """
+
+        radii = np.broadcast_to(np.asarray(radius, dtype=np.float64), np.shape(lats))
+
+        return [self.query_radius(lat, lon, r, method=method) for lat, lon, r in zip(lats, lons, radii)]
+
+    def query_knn_batch(self, lats, lons, k, method='haversine'):
+        """
+        This function runs query_knn for several locations.
+
+        Input Parameters
+        ----------------
+        lats : sequence of float (degrees)
+        lons : sequence of float (degrees)
+        k : int
+        method : str ('haversine' or 'vincenty')
+
+        Output
+        ------
+        list[numpy.ndarray] : the row positions for each location, nearest first
+        """
+
+        return [self.query_knn(lat, lon, k, method=method) for lat, lon in zip(lats, lons)]
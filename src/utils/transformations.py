@@ -1,24 +1,25 @@
 import logging
-import logging
+import re
 import geopandas as gpd
 import pandas as pd
 import numpy as np
-from shapely.geometry import Point
-from geopy.distance import distance
-from src.utils.helper_functions import calculate_distance, generate_uuid
-from src.utils.helper_functions import benchmark
+from src.utils.helper_functions import benchmark, log_memory_usage
+from src.utils.constants import WIND_STATIONS
+from src.utils.geodesy import bounding_box, bounding_box_mask, geodesic_distance, haversine_distance, offset_coordinates
+from src.utils.hexagons import h3_resolution, h3_string_to_int, latlon_to_h3
+from src.utils.parallel_join import partitioned_join_positions
+from src.utils.pseudonymization import Pseudonymizer
 
 
-@benchmark
-def join_sr_to_gpd_data_extract(sr_data, gpd_extract):
+def _check_join_errors(joined_sr_request_df, max_failed_joins_perc=25):
     """
-    This function joins service request data to H3 resolution  level 8 data extract dataframes based on geometry and points
-    It also assigns each service request to a single H3 resolution level 8 hexagon.
+    This function counts the service requests that could not be assigned to a hexagon, sets their index to '0' and
+    raises an error when the failed join percentage is above the threshold.
 
     Input Parameters
     ----------------
-    sr_data : Pandas.Daframe
-    gpd_extract : GeoPandas.DataFrame
+    joined_sr_request_df : GeoPandas.DataFrame
+    max_failed_joins_perc : float
 
 
     Output
@@ -27,37 +28,179 @@ def join_sr_to_gpd_data_extract(sr_data, gpd_extract):
 
     """
 
-    # Create geometry points for each SR and convert sr_data to a GeoDataFrame and adding the newly created goemetry point column
-    # and using the same CRS as the H3 data extract
-    geometry = [Point(xy)
-                for xy in zip(sr_data.longitude, sr_data.latitude)]
-    sr_gpdf = gpd.GeoDataFrame(sr_data, crs=gpd_extract.crs, geometry=geometry)
-
-    # Join the two dataframes and caulate join error percentage
-    joined_sr_request_df = gpd.sjoin(
-        sr_gpdf, gpd_extract, how='left', predicate='within')
     failed_joins_sum = joined_sr_request_df['index'].isna().sum()
     failed_joins_perc = (failed_joins_sum / len(joined_sr_request_df)) * 100
-    joined_sr_request_df['index'].fillna('0', inplace=True)
+    joined_sr_request_df['index'] = joined_sr_request_df['index'].fillna('0')
 
     logging.info(
         f'Failed to join {failed_joins_sum} of the sr data to H3 resolution level 8 hexagon data. This is a join error of {failed_joins_perc:.2f}%')
-    if failed_joins_perc > 25:
+    if failed_joins_perc > max_failed_joins_perc:
         raise Exception(
             f'Failed to join {failed_joins_perc:.2f} % of the records')  # Raise Error if join percentage is greater than 25 %
 
     return joined_sr_request_df
 
 
+def _h3_join(sr_gpdf, gpd_extract):
+    """
+    This function assigns each service request to its hexagon by computing the H3 cell of every point from its
+    latitude/longitude and looking the cell up in the polygon index column, instead of testing point in polygon.
+    The result has the same columns as a left sjoin.
+
+    Input Parameters
+    ----------------
+    sr_gpdf : GeoPandas.DataFrame
+    gpd_extract : GeoPandas.DataFrame or src.utils.hex_store.HexGeometryStore (H3 hexagons of a single resolution
+                  with an index column)
+
+
+    Output
+    ------
+    joined_sr_request_df : GeoPandas.DataFrame
+
+    """
+
+    hex_store = not isinstance(gpd_extract, gpd.GeoDataFrame)
+    polygon_cells = gpd_extract.cells if hex_store else h3_string_to_int(gpd_extract['index'])
+    resolutions = np.unique(h3_resolution(polygon_cells))
+    if len(resolutions) != 1:
+        raise ValueError(
+            f'The h3 join engine needs hexagons of a single resolution, found resolutions {resolutions.tolist()}')
+
+    sr_cells = latlon_to_h3(sr_gpdf['latitude'].to_numpy(),
+                            sr_gpdf['longitude'].to_numpy(), int(resolutions[0]))
+
+    # Lookup of each SR cell in the polygon cells, -1 marks cells without a polygon. The store looks the cells up
+    # with a binary search on its sorted cells
+    if hex_store:
+        polygon_positions = gpd_extract.rows(sr_cells)
+    else:
+        polygon_positions = pd.Index(polygon_cells).get_indexer(sr_cells)
+
+    return _attach_polygon_columns(sr_gpdf, gpd_extract, polygon_positions)
+
+
+def _attach_polygon_columns(sr_gpdf, gpd_extract, polygon_positions):
+    """
+    This function adds the columns of the polygon each service request was joined to, given the position of that
+    polygon in the extract (-1 for no polygon). The result has the same columns as a left sjoin.
+
+    Input Parameters
+    ----------------
+    sr_gpdf : GeoPandas.DataFrame
+    gpd_extract : GeoPandas.DataFrame or src.utils.hex_store.HexGeometryStore
+    polygon_positions : numpy.ndarray
+
+
+    Output
+    ------
+    joined_sr_request_df : GeoPandas.DataFrame
+
+    """
+
+    if isinstance(gpd_extract, gpd.GeoDataFrame):
+        right = gpd_extract.drop(columns=gpd_extract.geometry.name)
+    else:
+        # The properties of the store, its polygons are not built
+        right = gpd_extract.to_dataframe()
+    right = right.reset_index(names='index_right').reindex(polygon_positions)
+    right.index = sr_gpdf.index
+
+    return pd.concat([sr_gpdf, right], axis=1)
+
+
 @benchmark
-def filter_sr_data_by_distance(sr_data, location_cetroid):
+def join_sr_to_gpd_data_extract(sr_data, gpd_extract, engine='sjoin', cross_check_sample=1000, max_failed_joins_perc=25,
+                                max_workers=None):
+    """
+    This function joins service request data to H3 resolution  level 8 data extract dataframes based on geometry and points
+    It also assigns each service request to a single H3 resolution level 8 hexagon.
+
+    Two join engines are available:
+    - sjoin : a point within polygon spatial join against the hexagon geometries
+    - h3 : computes the H3 cell of every point arithmetically and maps it to the index column of the hexagons. This is
+      much faster, a random sample of the result is cross-checked against the sjoin engine. The hexagons can also be
+      a HexGeometryStore (see hex_store.get_city_hex_store), then only the polygons of the sampled rows are built.
+    - partitioned : the sjoin split into spatially coherent partitions of the points that are joined on a pool of
+      worker processes, each against only the hexagons overlapping its partition (see parallel_join.py)
+
+    Input Parameters
+    ----------------
+    sr_data : Pandas.Daframe
+    gpd_extract : GeoPandas.DataFrame or src.utils.hex_store.HexGeometryStore
+    engine : str ('sjoin', 'h3' or 'partitioned')
+    cross_check_sample : int (number of rows of the h3 join to cross-check against sjoin, 0 to skip the check)
+    max_failed_joins_perc : float (the join error percentage above which an error is raised)
+    max_workers : int (the number of processes of the partitioned engine, defaults to the number of CPUs)
+
+
+    Output
+    ------
+    joined_sr_request_df : GeoPandas.DataFrame
+
+    """
+
+    # Create geometry points for each SR and convert sr_data to a GeoDataFrame and adding the newly created goemetry point column
+    # and using the same CRS as the H3 data extract
+    geometry = gpd.points_from_xy(sr_data.longitude, sr_data.latitude)
+    sr_gpdf = gpd.GeoDataFrame(sr_data, crs=gpd_extract.crs, geometry=geometry)
+    hex_store = not isinstance(gpd_extract, gpd.GeoDataFrame)
+    if hex_store and engine != 'h3':
+        # The other engines test points against every polygon
+        gpd_extract = gpd_extract.to_geodataframe()
+        hex_store = False
+
+    # Join the two dataframes and caulate join error percentage
+    if engine == 'sjoin':
+        joined_sr_request_df = gpd.sjoin(
+            sr_gpdf, gpd_extract, how='left', predicate='within')
+    elif engine == 'h3':
+        joined_sr_request_df = _h3_join(sr_gpdf, gpd_extract)
+        if cross_check_sample:
+            sample = sr_gpdf.sample(
+                n=min(cross_check_sample, len(sr_gpdf)), random_state=0)
+            hexagons = gpd_extract
+            if hex_store:
+                # A point outside the polygon of its cell is not within any of the sampled polygons
+                rows = joined_sr_request_df.loc[sample.index, 'index_right'].dropna().to_numpy(dtype=np.int64)
+                hexagons = gpd_extract.to_geodataframe(np.unique(rows))
+            expected = gpd.sjoin(sample, hexagons, how='left', predicate='within')
+            expected = expected[~expected.index.duplicated()]['index']
+            actual = joined_sr_request_df.loc[sample.index, 'index']
+            mismatches = (expected.fillna('0') != actual.fillna('0')).sum()
+            logging.info(
+                f'Cross-checked {len(sample)} rows of the h3 join against sjoin : {mismatches} mismatches')
+            if mismatches:
+                logging.warning(
+                    f'The h3 join disagrees with sjoin on {mismatches / len(sample) * 100:.2f}% of the sampled rows (points on hexagon edges)')
+    elif engine == 'partitioned':
+        polygon_positions = partitioned_join_positions(
+            sr_data['latitude'].to_numpy(), sr_data['longitude'].to_numpy(), gpd_extract.geometry.values,
+            max_workers=max_workers)
+        joined_sr_request_df = _attach_polygon_columns(sr_gpdf, gpd_extract, polygon_positions)
+    else:
+        raise ValueError(
+            f"Unknown join engine '{engine}', expected 'sjoin', 'h3' or 'partitioned'")
+
+    return _check_join_errors(joined_sr_request_df, max_failed_joins_perc)
+
+
+@benchmark
+def filter_sr_data_by_distance(sr_data, location_cetroid, method='vincenty', buffer_dist=None, spatial_index=None):
     """
     This function fil creates a subsample of the data by selecting all of the requests in sr data which are within 1 minute of the centroid of a given suburb
 
+    Distances are computed on the latitude/longitude columns with numpy, after first discarding every row that falls
+    outside a lat/lon bounding box around the centroid. When a spatial index built over sr_data is passed in, only the
+    rows in the grid cells overlapping the box are read.
+
     Iput Parameters
     ---------------
     sr_data : Pandas.DataFrame
     location_cetroid : shapely.geometry.point.Point (tuple with latitude and longitude)
+    method : str ('vincenty' for ellipsoidal distances that match geopy, or 'haversine' for spherical distances)
+    buffer_dist : float (optional radius in meters, defaults to the distance of 1 minute at the centroid)
+    spatial_index : src.utils.spatial_index.SRSpatialIndex (optional index built once over sr_data)
 
 
     Output
@@ -66,75 +209,208 @@ def filter_sr_data_by_distance(sr_data, location_cetroid):
 
     """
 
-    # Drop rows without geometry data
-    mask = sr_data['geometry'].apply(lambda geom: str(geom) == 'POINT EMPTY')
-    sr_data = sr_data.loc[~mask]
+    centroid_lat, centroid_lon = location_cetroid.y, location_cetroid.x
 
-    def dist_to_centroid(geometry):
-        return distance((location_cetroid.y, location_cetroid.x), (geometry.y, geometry.x)).meters
+    # Calculate the distance of 1 minute of latitude/longitude at the centroid's latitude
+    if buffer_dist is None:
+        minute_dists = geodesic_distance(centroid_lat, centroid_lon,
+                                         [centroid_lat + 1, centroid_lat], [centroid_lon, centroid_lon + 1],
+                                         method=method) / 60
+        buffer_dist = minute_dists.min()
+
+    # Rows without coordinates compare False against the box (and are not indexed) so they are dropped here
+    box = bounding_box(centroid_lat, centroid_lon, buffer_dist)
+    if spatial_index is not None:
+        lat, lon = spatial_index.lat, spatial_index.lon
+        candidates = spatial_index.candidates(box)
+    else:
+        lat = sr_data['latitude'].to_numpy(dtype=np.float64)
+        lon = sr_data['longitude'].to_numpy(dtype=np.float64)
+        candidates = np.flatnonzero(bounding_box_mask(lat, lon, box))
+
+    # Create a distance column for the candidates only and keep the ones inside the buffer
+    dist_to_centroid = geodesic_distance(centroid_lat, centroid_lon,
+                                         lat[candidates], lon[candidates], method=method)
+    within = dist_to_centroid <= buffer_dist
+
+    # Keep the original row order
+    order = np.argsort(candidates[within], kind='stable')
+    df_within_1_min = sr_data.iloc[candidates[within][order]].copy()
+    df_within_1_min['dist_to_centroid'] = dist_to_centroid[within][order]
 
-    # Create a new column in the dataframe to store the distance from each point to the centroid
-    sr_data['dist_to_centroid'] = sr_data.geometry.apply(dist_to_centroid)
+    return df_within_1_min
 
-    # Calculate the distance of 1 minute of latitude/longitude at the centroid's latitude
-    lat_dist_per_min = distance(
-        (location_cetroid.y, location_cetroid.x), (location_cetroid.y + 1, location_cetroid.x)).meters / 60
-    lon_dist_per_min = distance(
-        (location_cetroid.y, location_cetroid.x), (location_cetroid.y, location_cetroid.x + 1)).meters / 60
 
-    buffer_dist = min(lat_dist_per_min, lon_dist_per_min)
+def _wind_column_name(column):
+    # ('Bellville South AQM Site', 'Wind Speed V', 'm/s') -> 'bellville_south_aqm_site_wind_speed_v_ms'
+    parts = column if isinstance(column, tuple) else (column,)
+    if 'Date' in str(parts[0]):
+        return 'timestamp_wind'
 
-    df_within_1_min = sr_data[sr_data.dist_to_centroid <= buffer_dist]
+    name = '  '.join(str(part) for part in parts).strip().replace('m/s', 'Ms')
+
+    return re.sub(r' +', '_', name).lower()
 
-    return df_within_1_min
+
+def _direction_columns(columns):
+    return [column for column in columns if re.search(r'_wind_dir_', column)]
 
 
 @benchmark
-def clean_wind_data(df):
+def clean_wind_data(df, long_format=False, interpolate_limit=None, resample=None, timezone='UTC'):
     """
     This function takes in an unprocessed pandas dataframe of wind data and return a cleaned version that is specific to a suburb
+    With long_format=True the result has one row per timestamp and site instead (see wind_data_to_long_format)
 
+    The readings are float32 columns ('NoData' becomes NaN) indexed by a sorted, unique UTC timestamp named
+    timestamp_wind. Wind directions are circular, so gaps are interpolated and periods averaged on the sine and
+    cosine of the direction instead of on the degrees (the mean of 350 and 10 degrees is 0, not 180).
 
     Input Parameters
     ----------------
     df : Pandas.DataFrame
+    long_format : bool
+    interpolate_limit : int (optional, fill gaps of up to this many consecutive missing readings by time interpolation)
+    resample : str (optional pandas frequency, e.g. '6h' to match the anonymized time grain, readings are averaged
+               per period and labelled with the middle of the period so a nearest merge_asof matches the period)
+    timezone : str (the timezone of the timestamps in the wind data)
 
 
     Output
     ------
     df : Pandas.DataFrame
     """
-    df.columns = [
-        "  ".join(c).strip() if "Date" not in c[0] else c[0] for c in df.columns
-    ]
-
-    df = df.rename(columns={'Date & Time': 'timestamp_wind'})
-    df.columns = df.columns.str.replace(' ', '_')
-    df.columns = df.columns.str.replace('__', '_')
-    df.columns = df.columns.str.replace('m/s', 'Ms')
-    df.columns = df.columns.str.lower()
-    df = df.iloc[:-8]
-    f = df.replace("NoData", None)
-    df['timestamp_wind'] = pd.to_datetime(
-        df['timestamp_wind'], format='%d/%m/%Y %H:%M', utc=True)
 
-    if df.duplicated().sum() > 0:
-        df = df.drop_duplicates()
+    # Column names in one pass
+    columns = [_wind_column_name(column) for column in df.columns]
+
+    # Only the footer rows at the end of the spreadsheet may have no valid timestamp, they are dropped
+    raw_timestamps = df.iloc[:, columns.index('timestamp_wind')]
+    timestamps = pd.to_datetime(raw_timestamps, format='%d/%m/%Y %H:%M', errors='coerce')
+    valid = timestamps.notna().to_numpy()
+    n_rows = np.flatnonzero(valid)[-1] + 1 if valid.any() else 0
+    if not valid[:n_rows].all():
+        invalid = np.flatnonzero(~valid[:n_rows])
+        raise ValueError(
+            f'{len(invalid)} wind data rows before the footer have an invalid timestamp, e.g. row {invalid[0]} : '
+            f'{raw_timestamps.iloc[invalid[0]]!r}')
+    index = pd.DatetimeIndex(timestamps[valid], name='timestamp_wind').tz_localize(timezone).tz_convert('UTC')
+
+    wind_columns = [position for position, column in enumerate(columns) if column != 'timestamp_wind']
+    readings = {columns[position]: pd.to_numeric(df.iloc[valid, position], errors='coerce').to_numpy(dtype=np.float32)
+                for position in wind_columns}
+    df = pd.DataFrame(readings, index=index)
+
+    df = df[~df.index.duplicated(keep='first')].sort_index()
+
+    direction_columns = _direction_columns(df.columns)
+    if interpolate_limit or resample:
+        # Directions are handled as unit vectors
+        radians = np.deg2rad(df[direction_columns].to_numpy(dtype=np.float64))
+        sin = pd.DataFrame(np.sin(radians), index=df.index, columns=direction_columns)
+        cos = pd.DataFrame(np.cos(radians), index=df.index, columns=direction_columns)
+        others = df.drop(columns=direction_columns)
+
+        if interpolate_limit:
+            sin, cos, others = (frame.interpolate(method='time', limit=interpolate_limit, limit_area='inside')
+                                for frame in (sin, cos, others))
+        if resample:
+            offset = pd.tseries.frequencies.to_offset(resample)
+            sin, cos, others = (frame.resample(offset).mean() for frame in (sin, cos, others))
+            for frame in (sin, cos, others):
+                frame.index = frame.index + pd.Timedelta(offset) / 2
+
+        # Rounded so directions a rounding error below 0 degrees do not become 360
+        directions = np.mod(np.round(np.rad2deg(np.arctan2(sin.to_numpy(), cos.to_numpy())), 6), 360)
+        df = pd.concat([others, pd.DataFrame(directions, index=sin.index, columns=direction_columns)], axis=1)
+        df = df[[column for column in readings if column in df.columns]].astype(np.float32)
+        df.index.name = 'timestamp_wind'
+
+    if long_format:
+        return wind_data_to_long_format(df)
 
     return df
 
 
+def wind_data_to_long_format(wind_df):
+    """
+    This function reshapes the cleaned (wide) wind data, which has a direction and a speed column per AQM site, into a
+    long table with one row per timestamp and site, sorted by timestamp so it can be used in a grouped merge_asof.
+
+    Input Parameters
+    ----------------
+    wind_df : Pandas.DataFrame (the output of clean_wind_data)
+
+
+    Output
+    ------
+    long_df : Pandas.DataFrame (columns timestamp_wind, wind_station, wind_dir_deg, wind_speed_ms)
+    """
+
+    if 'timestamp_wind' in wind_df.columns:
+        wind_df = wind_df.set_index('timestamp_wind')
+
+    measures = wind_df.columns.str.extract(r'^(?P<wind_station>.+)_wind_(?P<measure>dir|speed)_')
+    wind_columns = measures['measure'].notna().to_numpy()
+
+    values = wind_df.loc[:, wind_columns].astype(np.float32)
+    values.columns = pd.MultiIndex.from_frame(measures[wind_columns])
+
+    long_df = values.stack(level='wind_station').reset_index()
+    long_df = long_df.rename(columns={'dir': 'wind_dir_deg', 'speed': 'wind_speed_ms'})
+    long_df.columns.name = None
+
+    return long_df.sort_values('timestamp_wind', kind='stable').reset_index(drop=True)
+
+
+def assign_nearest_wind_station(sr_df, station_coordinates=WIND_STATIONS):
+    """
+    This function finds the nearest AQM site for every service request.
+
+    Input Parameters
+    ----------------
+    sr_df : Pandas.DataFrame (with latitude and longitude columns)
+    station_coordinates : dict (site name : (latitude, longitude))
+
+
+    Output
+    ------
+    tuple : (wind_station, dist_to_wind_station) numpy.ndarray, the station is None for rows without coordinates
+    """
+
+    names = np.array(list(station_coordinates), dtype=object)
+    station_lat, station_lon = np.array(list(station_coordinates.values())).T
+
+    # (n requests x n stations) distance matrix, there are only a handful of stations
+    distances = haversine_distance(sr_df['latitude'].to_numpy(dtype=np.float64)[:, None],
+                                   sr_df['longitude'].to_numpy(dtype=np.float64)[:, None],
+                                   station_lat[None, :], station_lon[None, :])
+    has_location = ~np.isnan(distances).any(axis=1)
+    nearest = np.argmin(np.where(np.isnan(distances), np.inf, distances), axis=1)
+
+    wind_station = np.where(has_location, names[nearest], None)
+    dist_to_wind_station = np.where(
+        has_location, distances[np.arange(len(nearest)), nearest], np.nan)
+
+    return wind_station, dist_to_wind_station
+
+
 @benchmark
-def merge_wind_data(sr_df, wind_df, suburb):
+def merge_wind_data(sr_df, wind_df, suburb=None, tolerance=None, station_coordinates=WIND_STATIONS):
     """
     This function auguments the filtered subsample of sr_data with the appropriate wind direction and speed data for 2020 for a specific suburb available in the wind data from 
     the Air Quality Measurement site.
 
+    Without a suburb every service request is matched to its nearest AQM site instead, and all the sites are merged in a
+    single merge_asof grouped by site. wind_df must then be the long format wind data (clean_wind_data(long_format=True)).
+
     Input Parameters
     ----------------
     sr_df : Pandas.DataFrame
     wind_df : Pandas.DataFrame
-    suburb : str
+    suburb : str (optional, a regex for the wind data columns of one site)
+    tolerance : pandas.Timedelta or str (optional, the maximum time between a request and its wind reading)
+    station_coordinates : dict (site name : (latitude, longitude), used when no suburb is given)
 
 
     Output
@@ -144,6 +420,38 @@ def merge_wind_data(sr_df, wind_df, suburb):
 
     """
 
+    if tolerance is not None:
+        tolerance = pd.Timedelta(tolerance)
+
+    # The cleaned wide wind data is indexed by its timestamp
+    if 'timestamp_wind' not in wind_df.columns:
+        wind_df = wind_df.reset_index()
+
+    if suburb is None:
+        # Only sites that are in the wind data and have a known location can be matched
+        wind_stations = set(wind_df['wind_station'].unique())
+        missing_stations = wind_stations.difference(station_coordinates)
+        if missing_stations:
+            logging.warning(
+                f'No location for the AQM sites {sorted(missing_stations)}, their wind data is not used')
+        station_coordinates = {name: location for name, location in station_coordinates.items()
+                               if name in wind_stations}
+
+        sr_df = sr_df.copy()
+        sr_df['creation_timestamp'] = pd.to_datetime(
+            sr_df['creation_timestamp'], format='%Y-%m-%d %H:%M:%S%z', utc=True)
+        sr_df['wind_station'], sr_df['dist_to_wind_station'] = assign_nearest_wind_station(
+            sr_df, station_coordinates)
+        sr_df = sr_df.sort_values('creation_timestamp', kind='stable')
+
+        # Requests without a location or timestamp can not be matched and are appended unmerged
+        mergeable = sr_df['wind_station'].notna() & sr_df['creation_timestamp'].notna()
+        merged_df = pd.merge_asof(
+            sr_df[mergeable], wind_df, left_on='creation_timestamp', right_on='timestamp_wind',
+            by='wind_station', direction='nearest', tolerance=tolerance)
+
+        return pd.concat([merged_df, sr_df[~mergeable]], ignore_index=True)
+
     filtred_wind_df = wind_df.filter(regex=f'^timestamp|^{suburb}')
 
     sr_df = sr_df.sort_values('creation_timestamp')
@@ -152,18 +460,26 @@ def merge_wind_data(sr_df, wind_df, suburb):
     wind_df = filtred_wind_df.sort_values('timestamp_wind')
 
     merged_df = pd.merge_asof(
-        sr_df, wind_df, left_on='creation_timestamp', right_on='timestamp_wind', direction='nearest')
+        sr_df, wind_df, left_on='creation_timestamp', right_on='timestamp_wind', direction='nearest',
+        tolerance=tolerance)
 
     return merged_df
 
 
 @benchmark
-def anonymize_sr_data(df, lat_col, lon_col, location_accuracy=500, temporal_accuracy=6):
+def anonymize_sr_data(df, lat_col, lon_col, location_accuracy=500, temporal_accuracy=6, rng=None, pseudonymizer=None):
     """
     This function anonymises the filtered subsample of sr_data preserves the following precisions :
     - location accuracy to within approximately 500m
     - temporal accuracy to within 6 hours
 
+    Every location is displaced by a random distance and bearing drawn uniformly over a disc of radius
+    location_accuracy. All displacements are drawn as arrays in one pass, pass a seeded numpy.random.Generator
+    (or a seed) as rng for a reproducible release.
+
+    The reference numbers are replaced with keyed pseudonyms (see src.utils.pseudonymization), so the same request
+    gets the same pseudonym in every release made with the same key.
+
     Input Parameters
     ----------------
     df : Pandas.DataFrame
@@ -171,6 +487,9 @@ def anonymize_sr_data(df, lat_col, lon_col, location_accuracy=500, temporal_accu
     lon_col : str
     location_accuracy : int
     temporal_accuracy : int
+    rng : numpy.random.Generator or int (optional, a fresh unseeded generator is used by default)
+    pseudonymizer : src.utils.pseudonymization.Pseudonymizer (optional, defaults to one with the configured key, the
+                    mapping table of one passed in is not saved)
 
     Output
     ------
@@ -179,32 +498,18 @@ def anonymize_sr_data(df, lat_col, lon_col, location_accuracy=500, temporal_accu
 
     """
 
-    # Annonymize location data
+    # The input can be shared with other pipeline nodes running at the same time (e.g. the writer of the merged data),
+    # so it is not modified
+    df = df.copy()
+
+    # Annonymize location data, the square root of a uniform variable makes the points uniform over the disc area
+    # instead of clustering at its centre
+    rng = np.random.default_rng(rng)
     n = len(df)
-    lat = df[lat_col].values
-    lon = df[lon_col].values
-    new_lat = np.zeros(n)
-    new_lon = np.zeros(n)
-    for i in range(n):
-        # Generate a random displacement within the specified accuracy
-        displacement = np.random.uniform(0, location_accuracy)
-        bearing = np.random.uniform(0, 360)
-        lat1, lon1 = lat[i], lon[i]
-        lat2 = lat1 + (displacement / 1000) * np.sin(np.deg2rad(bearing))
-        lon2 = lon1 + (displacement / 1000) * \
-            np.cos(np.deg2rad(bearing)) / np.cos(np.deg2rad(lat1))
-
-        # Check if the new location is within the specified accuracy
-        while calculate_distance(lat1, lon1, lat2, lon2) > location_accuracy:
-            displacement = np.random.uniform(0, location_accuracy)
-            bearing = np.random.uniform(0, 360)
-            lat2 = lat1 + (displacement / 1000) * np.sin(np.deg2rad(bearing))
-            lon2 = lon1 + (displacement / 1000) * \
-                np.cos(np.deg2rad(bearing)) / np.cos(np.deg2rad(lat1))
-        new_lat[i] = lat2
-        new_lon[i] = lon2
-    df[lat_col] = new_lat
-    df[lon_col] = new_lon
+    displacement = location_accuracy * np.sqrt(rng.random(n))
+    bearing = rng.uniform(0, 2 * np.pi, n)
+    df[lat_col], df[lon_col] = offset_coordinates(
+        df[lat_col].to_numpy(), df[lon_col].to_numpy(), displacement, bearing)
 
     # Anonymize timestamp data
     period = pd.Timedelta(hours=temporal_accuracy)
@@ -217,11 +522,84 @@ def anonymize_sr_data(df, lat_col, lon_col, location_accuracy=500, temporal_accu
     df['completion_timestamp'] = df['completion_timestamp'].dt.floor(period)
 
     df['timestamp_wind'] = df['timestamp_wind'].dt.floor(period)
-    df['reference_number'] = df['reference_number'].apply(generate_uuid)
+    owns_pseudonymizer = pseudonymizer is None
+    pseudonymizer = Pseudonymizer() if owns_pseudonymizer else pseudonymizer
+    df['reference_number'] = pseudonymizer.pseudonymize(df['reference_number'])
+    # A pseudonymizer that is passed in may be shared by several calls, its mapping table is saved once by the caller
+    if owns_pseudonymizer:
+        pseudonymizer.save()
 
     # Return only a subset of the data
-    columns_subset = ['reference_number', 'reference_number', 'creation_timestamp', 'completion_timestamp', 'directorate', 'department', 'branch', 'section', 'code_group', 'code',
-                      'cause_code_group', 'cause_code', 'official_suburb', 'latitude', 'longitude', 'index', 'timestamp_wind', 'bellville_south_aqm_site_wind_dir_v_deg', 'bellville_south_aqm_site_wind_speed_v_ms']
+    # The wind columns depend on whether a single site or the nearest site was merged
+    wind_columns = [column for column in df.columns if column == 'wind_station' or re.search(
+        r'wind_(dir|speed)_', column)]
+    columns_subset = ['reference_number', 'creation_timestamp', 'completion_timestamp', 'directorate', 'department', 'branch', 'section', 'code_group', 'code',
+                      'cause_code_group', 'cause_code', 'official_suburb', 'latitude', 'longitude', 'index', 'timestamp_wind'] + wind_columns
     df_subset = df[columns_subset]
 
     return df_subset
+
+
+@benchmark
+def process_sr_data_chunks(sr_chunks, gpd_extract, location_centroid, wind_df, suburb, join_engine='sjoin',
+                           max_failed_joins_perc=25, rng=None, pseudonymizer=None):
+    """
+    This function runs the join, distance filter, wind merge and anonymization stages over a stream of service request
+    chunks (see extract_data.get_sr_data_chunks), one chunk at a time. Only the small anonymized subsample of each chunk
+    is kept, so the peak memory depends on the chunk size and not on the size of the SR history.
+
+    The join error threshold is applied to the total over all chunks.
+
+    Input Parameters
+    ----------------
+    sr_chunks : iterable of Pandas.DataFrame
+    gpd_extract : GeoPandas.DataFrame
+    location_centroid : shapely.geometry.point.Point
+    wind_df : Pandas.DataFrame (the cleaned wind data)
+    suburb : str (the suburb of the wind data to merge)
+    join_engine : str ('sjoin', 'h3' or 'partitioned')
+    max_failed_joins_perc : float
+    rng : numpy.random.Generator or int (optional, makes the anonymization reproducible)
+    pseudonymizer : src.utils.pseudonymization.Pseudonymizer (optional, defaults to one with the configured key)
+
+
+    Output
+    ------
+    anonymized_sr_data : Pandas.DataFrame
+
+    """
+
+    # One generator for all the chunks, so a seeded run draws the same displacements every time
+    rng = np.random.default_rng(rng)
+    pseudonymizer = Pseudonymizer() if pseudonymizer is None else pseudonymizer
+    anonymized_chunks = []
+    total_rows = failed_joins_sum = 0
+    for chunk_number, sr_chunk in enumerate(sr_chunks):
+        joined_chunk = join_sr_to_gpd_data_extract(
+            sr_data=sr_chunk, gpd_extract=gpd_extract, engine=join_engine, cross_check_sample=0,
+            max_failed_joins_perc=100)
+        total_rows += len(joined_chunk)
+        failed_joins_sum += (joined_chunk['index'] == '0').sum()
+
+        filtred_chunk = filter_sr_data_by_distance(
+            joined_chunk, location_cetroid=location_centroid)
+        del joined_chunk
+        if len(filtred_chunk):
+            chunk_with_wind = merge_wind_data(
+                sr_df=filtred_chunk, wind_df=wind_df, suburb=suburb)
+            anonymized_chunks.append(anonymize_sr_data(
+                df=chunk_with_wind, lat_col='latitude', lon_col='longitude', rng=rng, pseudonymizer=pseudonymizer))
+        log_memory_usage(f'processed SR chunk {chunk_number}')
+    pseudonymizer.save()
+
+    failed_joins_perc = (failed_joins_sum / total_rows) * 100 if total_rows else 0
+    logging.info(
+        f'Failed to join {failed_joins_sum} of the sr data to H3 resolution level 8 hexagon data. This is a join error of {failed_joins_perc:.2f}%')
+    if failed_joins_perc > max_failed_joins_perc:
+        raise Exception(
+            f'Failed to join {failed_joins_perc:.2f} % of the records')
+
+    if not anonymized_chunks:
+        return pd.DataFrame()
+
+    return pd.concat(anonymized_chunks, ignore_index=True)
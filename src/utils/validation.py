@@ -1,16 +1,129 @@
 import logging
+import geopandas as gpd
+import numpy as np
+import pandas as pd
 from src.utils.helper_functions import benchmark
 
 
+def hash_extract_rows(extract, key_col='index', drop_columns=()):
+    """
+    This function hashes every row of an extract in one vectorized pass, from the WKB of its geometry and its
+    properties. The hashes do not depend on the row order or on the column order.
+
+    Input Parameters
+    ----------------
+    extract : geopandas.GeoDataFrame or Pandas.DataFrame
+    key_col : str (the column identifying a row, e.g. the H3 index)
+    drop_columns : iterable of str (columns left out of the hash, e.g. resolution)
+
+    Output
+    ------
+    row_hashes : Pandas.Series (uint64 hash per row, indexed by key_col)
+    """
+
+    extract = extract.drop(columns=[column for column in drop_columns if column in extract.columns])
+    columns = {}
+    for column in sorted(extract.columns):
+        if isinstance(extract[column], gpd.GeoSeries):
+            # WKB is much cheaper to hash than comparing shapely geometry objects
+            columns[column] = extract[column].to_wkb().to_numpy()
+        else:
+            columns[column] = extract[column].to_numpy()
+
+    row_hashes = pd.util.hash_pandas_object(pd.DataFrame(columns), index=False).to_numpy()
+
+    return pd.Series(row_hashes, index=pd.Index(extract[key_col].to_numpy(), name=key_col))
+
+
+def hash_extract_chunks(chunks, key_col='index', drop_columns=()):
+    """
+    This function hashes the rows of an extract that is read in chunks, e.g. a stream of GeoDataFrames, so only the
+    hashes are kept in memory.
+
+    Input Parameters
+    ----------------
+    chunks : iterable of geopandas.GeoDataFrame or a single geopandas.GeoDataFrame
+    key_col : str
+    drop_columns : iterable of str
+
+    Output
+    ------
+    row_hashes : Pandas.Series (uint64 hash per row, indexed by key_col)
+    """
+
+    if isinstance(chunks, pd.DataFrame):
+        return hash_extract_rows(chunks, key_col, drop_columns)
+
+    row_hashes = [hash_extract_rows(chunk, key_col, drop_columns) for chunk in chunks]
+    if not row_hashes:
+        return pd.Series([], index=pd.Index([], name=key_col), dtype='uint64')
+
+    return pd.concat(row_hashes)
+
+
+def compare_row_hashes(extract_hashes, validation_hashes):
+    """
+    This function compares the row hashes of an extract with those of the validation extract as multisets, and
+    reports which keys are missing, extra or changed if they differ.
+
+    Input Parameters
+    ----------------
+    extract_hashes : Pandas.Series (see hash_extract_rows)
+    validation_hashes : Pandas.Series
+
+    Output
+    ------
+    report : dict (validated, row counts and the missing, extra, changed and duplicated keys)
+    """
+
+    report = {'validated': False, 'extract_rows': len(extract_hashes), 'validation_rows': len(validation_hashes),
+              'missing': [], 'extra': [], 'changed': [], 'duplicated': []}
+
+    # Equal multisets of hashes means equal records, whatever the row order
+    if len(extract_hashes) == len(validation_hashes) and np.array_equal(
+            np.sort(extract_hashes.to_numpy()), np.sort(validation_hashes.to_numpy())):
+        report['validated'] = True
+        return report
+
+    extract_keys = extract_hashes.index
+    validation_keys = validation_hashes.index
+    report['missing'] = validation_keys.difference(extract_keys).tolist()
+    report['extra'] = extract_keys.difference(validation_keys).tolist()
+    report['duplicated'] = extract_keys[extract_keys.duplicated()].unique().tolist()
+
+    # Keys found in both extracts whose records differ
+    common = extract_hashes[~extract_keys.duplicated()].to_frame('extract').join(
+        validation_hashes[~validation_keys.duplicated()].to_frame('validation'), how='inner')
+    report['changed'] = common.index[common['extract'] != common['validation']].tolist()
+
+    return report
+
+
+def _log_report(report, max_keys=10):
+    for kind in ['missing', 'extra', 'changed', 'duplicated']:
+        keys = report[kind]
+        if keys:
+            logging.info(
+                f"Data validation : {len(keys)} {kind} rows, e.g. {keys[:max_keys]}")
+
+
 @benchmark
-def validate_data_extract(filtered_extract, validation_extract) -> bool:
+def validate_data_extract(filtered_extract, validation_extract, method='hash', key_col='index',
+                          drop_columns=('resolution',)) -> bool:
     """
     This functions validates whether or not 2 record sets are equal to eachother
 
+    With method='hash' the rows of both record sets are hashed (see hash_extract_rows) and compared as multisets, the
+    missing, extra and changed rows are logged when the validation fails. Either record set can also be an iterable
+    of chunks. method='equals' compares the full record sets with GeoDataFrame.equals.
+
     Input Parameters
     ----------------
-    filtered_extract : geopandas.DataFrame
-    validation_extract : geopandas.DataFrame
+    filtered_extract : geopandas.DataFrame (or an iterable of chunks with method='hash')
+    validation_extract : geopandas.DataFrame (or an iterable of chunks with method='hash')
+    method : str ('hash' or 'equals')
+    key_col : str (the column identifying a row)
+    drop_columns : iterable of str (columns of the filtered extract that are not in the validation extract)
 
     Output
     ------
@@ -18,14 +131,21 @@ def validate_data_extract(filtered_extract, validation_extract) -> bool:
 
     """
 
-    # Drop resolution column from the filtered extract & validate results
-    filtered_extract = filtered_extract.drop(
-        columns=['resolution'])
-
-    validated = False
-    if filtered_extract.equals(validation_extract):
+    if method == 'hash':
+        report = compare_row_hashes(hash_extract_chunks(filtered_extract, key_col, drop_columns),
+                                    hash_extract_chunks(validation_extract, key_col))
+        validated = report['validated']
+        if not validated:
+            _log_report(report)
+    elif method == 'equals':
+        # Drop resolution column from the filtered extract & validate results
+        filtered_extract = filtered_extract.drop(
+            columns=list(drop_columns))
+        validated = bool(filtered_extract.equals(validation_extract))
+    else:
+        raise ValueError(f"Unknown validation method {method}, expected 'hash' or 'equals'")
 
-        validated = True
+    if validated:
         logging.info(
             f"Data validation  for city polygons data PASSED. Extracted data == Validation data :  validation test : {validated}")
     else:
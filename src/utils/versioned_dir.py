@@ -0,0 +1,106 @@
+import logging
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+
+def versions_dir(directory):
+    """
+    This function gets the directory holding the versions of a published directory, e.g. data/output/.result.versions
+    for data/output/result.
+
+    Input Parameters
+    ----------------
+    directory : str or pathlib.Path
+
+    Output
+    ------
+    path : pathlib.Path
+    """
+
+    directory = Path(directory)
+
+    return directory.parent / f'.{directory.name}.versions'
+
+
+def staging_dir(directory):
+    """
+    This function creates an empty directory to write a new version of a published directory into, next to its
+    versions so it can be published with a rename.
+
+    Input Parameters
+    ----------------
+    directory : str or pathlib.Path
+
+    Output
+    ------
+    path : pathlib.Path
+    """
+
+    path = versions_dir(directory) / f'{time.time_ns()}-{uuid.uuid4().hex[:8]}.tmp'
+    path.mkdir(parents=True)
+
+    return path
+
+
+def publish_directory(new_dir, directory, keep=2):
+    """
+    This function publishes a new version of a directory atomically. new_dir (see staging_dir) becomes a version
+    under versions_dir(directory) and directory becomes a symbolic link to it, replaced with a single rename, so
+    readers always see either the previous or the new version and never a partial or missing directory. The previous
+    versions are kept (keep versions in total) so readers that opened them can finish.
+
+    Input Parameters
+    ----------------
+    new_dir : str or pathlib.Path (the complete new version)
+    directory : str or pathlib.Path (the path readers use)
+    keep : int (the number of versions to keep, at least 1)
+
+    Output
+    ------
+    version_dir : pathlib.Path (the published version)
+    """
+
+    directory = Path(directory)
+    all_versions_dir = versions_dir(directory)
+    all_versions_dir.mkdir(parents=True, exist_ok=True)
+    version_dir = all_versions_dir / f'{time.time_ns()}-{uuid.uuid4().hex[:8]}'
+    os.replace(new_dir, version_dir)
+
+    # A directory written before it was versioned is moved in with the other versions first. This is the only time
+    # readers can briefly see no directory
+    if directory.exists() and not directory.is_symlink():
+        os.replace(directory, all_versions_dir / f'0-{uuid.uuid4().hex[:8]}')
+
+    link_path = directory.with_name(f'.{directory.name}.{uuid.uuid4().hex[:8]}.link')
+    os.symlink(os.path.relpath(version_dir, directory.parent), link_path, target_is_directory=True)
+    os.replace(link_path, directory)
+
+    # The versions are named by creation time, the oldest ones are removed
+    old_versions = sorted((path for path in all_versions_dir.iterdir()
+                           if path != version_dir and not path.name.endswith('.tmp')),
+                          key=lambda path: int(path.name.partition('-')[0]))
+    for old_version in old_versions[:max(len(old_versions) - keep + 1, 0)]:
+        shutil.rmtree(old_version, ignore_errors=True)
+    logging.info(f'Published {directory} ({version_dir.name})')
+
+    return version_dir
+
+
+def remove_directory(directory):
+    """
+    This function removes a published directory with all its versions (or a plain directory).
+
+    Input Parameters
+    ----------------
+    directory : str or pathlib.Path
+    """
+
+    directory = Path(directory)
+    if directory.is_symlink():
+        directory.unlink()
+    else:
+        shutil.rmtree(directory, ignore_errors=True)
+    shutil.rmtree(versions_dir(directory), ignore_errors=True)
@@ -0,0 +1,11 @@
+import numpy as np
+from src.utils.batch import suburb_seed
+
+
+def test_suburb_stream_does_not_depend_on_the_batch():
+    assert suburb_seed(7, 'BELLVILLE SOUTH') == suburb_seed(7, ' Bellville-South ')
+    assert suburb_seed(7, 'BELLVILLE SOUTH') != suburb_seed(7, 'GOODWOOD')
+    assert suburb_seed(None, 'GOODWOOD') is None
+
+    first, second = (np.random.default_rng(suburb_seed(7, 'GOODWOOD')).random(3) for _ in range(2))
+    np.testing.assert_array_equal(first, second)
@@ -0,0 +1,59 @@
+import pandas as pd
+from src.utils.cache import ExtractCache
+
+
+def sample_frame():
+    return pd.DataFrame({'reference_number': [1.0, 2.0, 3.0], 'subcouncil': ['1', '2', '3']})
+
+
+def test_miss_then_hit(tmp_path):
+    cache = ExtractCache(tmp_path)
+    key = ExtractCache.make_key('bucket', 'sr.csv.gz', '"etag-1"')
+
+    assert cache.get(key) is None
+    cache.put(key, sample_frame(), description='sr', metadata={'sha256': 'abc'})
+
+    pd.testing.assert_frame_equal(cache.get(key), sample_frame())
+    assert cache.metadata(key) == {'sha256': 'abc'}
+
+
+def test_changed_etag_is_a_miss(tmp_path):
+    cache = ExtractCache(tmp_path)
+    cache.put(ExtractCache.make_key('bucket', 'sr.csv.gz', '"etag-1"'), sample_frame())
+
+    assert cache.get(ExtractCache.make_key('bucket', 'sr.csv.gz', '"etag-2"')) is None
+
+
+def test_invalidate(tmp_path):
+    cache = ExtractCache(tmp_path)
+    key = ExtractCache.make_key('bucket', 'sr.csv.gz', '"etag-1"')
+    cache.put(key, sample_frame())
+    cache.invalidate(key)
+
+    assert key not in cache
+    assert cache.get(key) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_concurrent_caches_keep_each_others_entries(tmp_path):
+    first, second = ExtractCache(tmp_path), ExtractCache(tmp_path)
+    first_key, second_key = ExtractCache.make_key('first'), ExtractCache.make_key('second')
+    first.put(first_key, sample_frame())
+    second.put(second_key, sample_frame())
+    first.get(first_key)
+
+    reopened = ExtractCache(tmp_path)
+    assert first_key in reopened and second_key in reopened
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = ExtractCache(tmp_path)
+    keys = [ExtractCache.make_key(name) for name in ['first', 'second', 'third']]
+    for key in keys:
+        cache.put(key, sample_frame())
+    cache.get(keys[0])
+
+    cache.max_bytes = cache.size() - 1
+    cache.put(keys[2], sample_frame())
+
+    assert keys[0] in cache and keys[1] not in cache and keys[2] in cache
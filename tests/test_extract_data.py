@@ -0,0 +1,135 @@
+import gzip
+import io
+import botocore.exceptions
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.local_s3 import LocalS3Client
+from src.utils.cache import ExtractCache
+from src.utils.extract_data import (S3RangeReader, download_s3_object, get_sr_data, get_sr_data_chunks, get_url_version,
+                                    get_wind_data)
+
+
+class CountingS3Client(LocalS3Client):
+
+    def __init__(self, root_dir):
+        super().__init__(root_dir)
+        self.head_count = 0
+
+    def head_object(self, Bucket, Key):
+        self.head_count += 1
+        return super().head_object(Bucket=Bucket, Key=Key)
+
+
+def sr_csv_gz(n_rows=25):
+    timestamps = pd.date_range('2020-01-01', periods=n_rows, freq='h', tz='UTC').strftime('%Y-%m-%d %H:%M:%S+00:00')
+    df = pd.DataFrame({
+        'reference_number': 9_100_000_000.0 + np.arange(n_rows),
+        'official_suburb': 'BELLVILLE SOUTH',
+        'latitude': -33.9,
+        'longitude': 18.6,
+        'creation_timestamp': timestamps,
+        'completion_timestamp': timestamps,
+    })
+
+    return gzip.compress(df.to_csv().encode('utf-8'))
+
+
+def test_download_through_local_s3(tmp_path):
+    s3_client = LocalS3Client(tmp_path)
+    data = np.random.default_rng(0).bytes(10_000)
+    s3_client.put_object(Bucket='bucket', Key='object.bin', Body=data)
+
+    buffer = download_s3_object('bucket', 'object.bin', s3_client, part_size=1024, max_workers=4)
+    assert buffer.read() == data
+
+    with S3RangeReader('bucket', 'object.bin', s3_client, part_size=1024, read_ahead=2) as reader:
+        assert b''.join(iter(lambda: reader.read(700), b'')) == data
+
+
+def test_range_requests_are_pinned_to_one_version(tmp_path):
+    s3_client = LocalS3Client(tmp_path)
+    s3_client.put_object(Bucket='bucket', Key='object.bin', Body=b'a' * 4096)
+    head = s3_client.head_object(Bucket='bucket', Key='object.bin')
+    reader = S3RangeReader('bucket', 'object.bin', s3_client, part_size=1024, read_ahead=1)
+    s3_client.put_object(Bucket='bucket', Key='object.bin', Body=b'b' * 4096)
+
+    with pytest.raises(botocore.exceptions.ClientError, match='PreconditionFailed'):
+        download_s3_object('bucket', 'object.bin', s3_client, part_size=1024, head=head)
+    with pytest.raises(botocore.exceptions.ClientError, match='PreconditionFailed'):
+        reader.read()
+    reader.close()
+
+
+def test_sr_data_chunks_match_the_full_extract(tmp_path):
+    s3_client = CountingS3Client(tmp_path)
+    s3_client.put_object(Bucket='bucket', Key='sr.csv.gz', Body=sr_csv_gz())
+
+    df = get_sr_data('bucket', 'sr.csv.gz', s3_client, cache=ExtractCache(tmp_path / 'cache'))
+    assert s3_client.head_count == 1
+
+    chunks = list(get_sr_data_chunks('bucket', 'sr.csv.gz', s3_client, chunksize=10, part_size=64))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    streamed = pd.concat(chunks)
+    assert streamed.index.equals(df.index)
+    np.testing.assert_array_equal(streamed['reference_number'], df['reference_number'])
+    assert str(streamed['creation_timestamp'].dt.tz) == 'UTC'
+
+
+def test_range_reader_is_a_binary_file(tmp_path):
+    s3_client = LocalS3Client(tmp_path)
+    s3_client.put_object(Bucket='bucket', Key='empty.bin', Body=b'')
+
+    reader = S3RangeReader('bucket', 'empty.bin', s3_client)
+    assert isinstance(reader, io.RawIOBase) and reader.read() == b''
+    reader.close()
+    assert reader.closed
+
+
+def test_wind_data_refresh_falls_back_to_the_cache(tmp_path):
+    url = 'http://127.0.0.1:9/wind.ods'
+    cache = ExtractCache(tmp_path / 'cache')
+    wind_df = pd.DataFrame({'date': ['01/01/2020 01:00'], 'speed': np.float32([3.5])})
+    cache.put(cache.make_key('wind_data', url), wind_df)
+
+    assert get_url_version(url, timeout=1) == ''
+    pd.testing.assert_frame_equal(get_wind_data(url, cache=cache, refresh=True), wind_df)
+
+
+def test_local_wind_data_is_versioned_by_its_content(tmp_path):
+    path = tmp_path / 'wind.ods'
+    path.write_bytes(b'first')
+    first = get_url_version(str(path))
+    path.write_bytes(b'second')
+
+    assert get_url_version(str(path)) != first
+
+
+def test_wind_data_is_only_parsed_when_its_content_changes(tmp_path, monkeypatch):
+    path = tmp_path / 'wind.ods'
+    path.write_bytes(b'first')
+    cache = ExtractCache(tmp_path / 'cache')
+    parsed = []
+
+    def read_excel(io, **kwargs):
+        parsed.append(io.read())
+        return pd.DataFrame({'date': ['01/01/2020 01:00'], 'speed': [float(len(parsed))]})
+
+    monkeypatch.setattr(pd, 'read_excel', read_excel)
+    first = get_wind_data(str(path), cache=cache)
+    pd.testing.assert_frame_equal(get_wind_data(str(path), cache=cache), first)
+    path.write_bytes(b'second')
+    assert get_wind_data(str(path), cache=cache)['speed'].tolist() == [2]
+    assert parsed == [b'first', b'second']
+
+
+def test_offline_wind_data_never_downloads(tmp_path, monkeypatch):
+    url = 'http://127.0.0.1:9/wind.ods'
+    cache = ExtractCache(tmp_path / 'cache')
+    monkeypatch.setattr('urllib.request.urlopen', lambda *args, **kwargs: pytest.fail('downloaded'))
+
+    with pytest.raises(RuntimeError, match='offline'):
+        get_wind_data(url, cache=cache, offline=True)
+    wind_df = pd.DataFrame({'date': ['01/01/2020 01:00'], 'speed': np.float32([3.5])})
+    cache.put(cache.make_key('wind_data', url), wind_df)
+    pd.testing.assert_frame_equal(get_wind_data(url, cache=cache, offline=True, refresh=True), wind_df)
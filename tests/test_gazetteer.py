@@ -0,0 +1,27 @@
+import sys
+import pandas as pd
+import pytest
+from src.utils.gazetteer import SuburbGazetteer
+from src.utils.helper_functions import get_location_centroid
+
+
+def test_suburb_centroids_are_the_median_request_locations(tmp_path):
+    sr_data = pd.DataFrame({'official_suburb': ['BELLVILLE SOUTH', 'Bellville-South', 'BELLVILLE SOUTH', None],
+                            'latitude': [-33.9, -33.8, -34.5, -33.0], 'longitude': [18.6, 18.7, 18.8, 18.0]})
+    gazetteer = SuburbGazetteer(tmp_path / 'gazetteer.json')
+    gazetteer.update_from_sr_data(sr_data)
+    gazetteer.save()
+
+    centroid = SuburbGazetteer(tmp_path / 'gazetteer.json').lookup(' bellville south ')
+    assert (centroid.x, centroid.y) == (18.7, -33.9)
+
+
+def test_gazetteer_hit_does_not_import_geopy(monkeypatch):
+    gazetteer = SuburbGazetteer()
+    gazetteer.add('BELLVILLE SOUTH', -33.9, 18.6)
+    # Importing a module that is None in sys.modules raises an ImportError
+    monkeypatch.setitem(sys.modules, 'geopy.geocoders', None)
+
+    assert get_location_centroid('Bellville South', gazetteer=gazetteer).coords[0] == (18.6, -33.9)
+    with pytest.raises(LookupError, match='network geocoding is disabled'):
+        get_location_centroid('Durbanville', gazetteer=gazetteer, allow_network=False)
@@ -0,0 +1,34 @@
+import numpy as np
+from benchmarks.synthetic_data import generate_sr_data
+from src.utils.hex_aggregation import HexAggregateTable, aggregate_sr_by_hex
+from src.utils.hexagons import h3_int_to_string, h3_parent, latlon_to_h3
+
+# A small part of Bellville South
+BOUNDS = (-33.93, -33.90, 18.62, 18.66)
+
+
+def test_rollups_match_the_requests_of_the_parent_hexagons(tmp_path):
+    sr_data = generate_sr_data(3000, bounds=BOUNDS)
+    aggregate_sr_by_hex(sr_data, resolutions=(8, 10)).save(tmp_path / 'aggregates.npz')
+    table = HexAggregateTable.load(tmp_path / 'aggregates.npz')
+
+    # Every request is assigned at resolution 10 and rolled up to the parent of its cell
+    cells = latlon_to_h3(sr_data['latitude'].to_numpy(), sr_data['longitude'].to_numpy(), 10)
+    requests = sr_data.assign(
+        cell=h3_int_to_string(h3_parent(cells, 8)),
+        duration=(sr_data['completion_timestamp'] - sr_data['creation_timestamp']).dt.total_seconds() / 3600,
+    )[sr_data['latitude'].notna()]
+    expected = requests.groupby('cell').size()
+
+    aggregates = table.query(8, start='2020-01-01', end='2021-01-01', by_group=False)
+    aggregates = aggregates.groupby('cell').agg(count=('count', 'sum'))
+    np.testing.assert_array_equal(aggregates.loc[expected.index, 'count'], expected)
+
+    cell = expected.idxmax()
+    march = requests[(requests['cell'] == cell) & (requests['creation_timestamp'].dt.month == 3)]
+    row = table.query(8, cells=[cell], start='2020-03-01', end='2020-04-01', by_group=False).iloc[0]
+    assert row['count'] == len(march)
+    np.testing.assert_allclose([row['duration_mean'], row['duration_std'], row['duration_min'], row['duration_max']],
+                               [march['duration'].mean(), march['duration'].std(ddof=0), march['duration'].min(),
+                                march['duration'].max()])
+    assert table.query(8, cells=[cell], department='No such department').empty
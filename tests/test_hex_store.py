@@ -0,0 +1,50 @@
+import json
+import os
+import pytest
+from src.utils.hex_store import HexGeometryStore
+
+
+def feature(cell, name, ring, geometry_type='Polygon'):
+    return json.dumps({'type': 'Feature', 'properties': {'index': cell, 'centroid_lat': ring[0][1], 'name': name},
+                       'geometry': {'type': geometry_type, 'coordinates': [ring]}})
+
+
+RECORDS = '\n'.join([
+    feature('88ad360001fffff', 'BELLVILLE', [[18.6, -33.9], [18.61, -33.91], [18.62, -33.9], [18.6, -33.9]]),
+    feature('88ad360003fffff', None, [[18.5, -33.8], [18.51, -33.81], [18.52, -33.8], [18.51, -33.79],
+                                      [18.5, -33.8]]),
+]) + '\n'
+
+
+def test_geojson_records_round_trip(tmp_path):
+    store = HexGeometryStore.from_geojson_records(RECORDS)
+    store.save(tmp_path / 'store')
+    gdf = HexGeometryStore.load(tmp_path / 'store').to_geodataframe()
+
+    assert list(gdf.columns) == ['index', 'centroid_lat', 'name', 'geometry']
+    assert list(gdf['index']) == ['88ad360001fffff', '88ad360003fffff']
+    assert gdf['name'][0] == 'BELLVILLE' and gdf['name'].isna()[1]
+    assert list(gdf.geometry.exterior.iloc[1].coords)[1] == (18.51, -33.81)
+    assert list(store.rows(['88ad360003fffff', '88ad360005fffff'])) == [1, -1]
+
+
+def test_save_replaces_the_store_with_one_rename(tmp_path):
+    HexGeometryStore.from_geojson_records(RECORDS).save(tmp_path / 'store')
+    HexGeometryStore.from_geojson_records(RECORDS.splitlines()[0]).save(tmp_path / 'store')
+
+    assert os.path.islink(tmp_path / 'store')
+    assert len(HexGeometryStore.load(tmp_path / 'store')) == 1
+
+
+def test_only_polygons_without_holes_are_stored():
+    ring = [[18.6, -33.9], [18.61, -33.91], [18.62, -33.9], [18.6, -33.9]]
+    hole = [[18.605, -33.902], [18.61, -33.905], [18.615, -33.902], [18.605, -33.902]]
+    multipolygon = json.dumps({'type': 'Feature', 'properties': {'index': '88ad360001fffff'},
+                               'geometry': {'type': 'MultiPolygon', 'coordinates': [[ring]]}})
+    polygon_with_hole = json.dumps({'type': 'Feature', 'properties': {'index': '88ad360001fffff'},
+                                    'geometry': {'type': 'Polygon', 'coordinates': [ring, hole]}})
+
+    with pytest.raises(ValueError, match=r"only holds polygons without holes, got \['MultiPolygon'\]"):
+        HexGeometryStore.from_geojson_records(RECORDS + multipolygon)
+    with pytest.raises(ValueError, match='only holds polygons without holes, got polygons with holes'):
+        HexGeometryStore.from_geojson_records(polygon_with_hole)
@@ -0,0 +1,25 @@
+import pandas as pd
+from benchmarks.synthetic_data import generate_sr_data
+from src.utils.incremental import IngestionState
+
+
+def test_only_new_and_updated_requests_are_ingested_again(tmp_path):
+    sr_data = generate_sr_data(100)
+    state = IngestionState(tmp_path / 'state')
+    assert len(state.delta(sr_data)) == 100
+    state.commit('etag-1')
+
+    # An updated request (before the watermark) and a new request (after it)
+    updated = sr_data.iloc[[3]].assign(completion_timestamp=lambda df: df['completion_timestamp'] + pd.Timedelta('1h'))
+    new = sr_data.iloc[[5]].assign(reference_number=1.0, creation_timestamp=pd.Timestamp('2021-06-01', tz='UTC'))
+    next_extract = pd.concat([sr_data.drop(index=3), updated, new])
+
+    state = IngestionState(tmp_path / 'state')
+    assert state.etag == 'etag-1' and state.watermark == sr_data['creation_timestamp'].max()
+    delta = state.delta(next_extract)
+    assert sorted(delta['reference_number']) == sorted([1.0, sr_data['reference_number'].iloc[3]])
+
+    # The delta is only added to the state by the commit
+    assert len(IngestionState(tmp_path / 'state').delta(next_extract)) == 2
+    state.commit('etag-2')
+    assert IngestionState(tmp_path / 'state').delta(next_extract).empty
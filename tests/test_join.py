@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+from benchmarks.synthetic_data import generate_hexagons, generate_sr_data
+from src.utils.hex_store import HexGeometryStore
+from src.utils.transformations import join_sr_to_gpd_data_extract
+
+# A small part of Bellville South
+BOUNDS = (-33.93, -33.90, 18.62, 18.66)
+
+
+def test_h3_join_against_the_hex_store_matches_the_geodataframe():
+    hexagons = generate_hexagons(bounds=BOUNDS)
+    sr_data = generate_sr_data(500, bounds=BOUNDS).dropna(subset=['latitude'])
+
+    expected = join_sr_to_gpd_data_extract(sr_data.copy(), hexagons, engine='h3', max_failed_joins_perc=100)
+    joined = join_sr_to_gpd_data_extract(sr_data.copy(), HexGeometryStore.from_geodataframe(hexagons), engine='h3',
+                                         max_failed_joins_perc=100)
+
+    pd.testing.assert_frame_equal(joined, expected)
+    assert (joined['index'] != '0').mean() > 0.9
+
+
+def test_h3_join_matches_the_spatial_join():
+    hexagons = generate_hexagons(bounds=BOUNDS)
+    sr_data = generate_sr_data(500, bounds=BOUNDS)
+
+    expected = join_sr_to_gpd_data_extract(sr_data.copy(), hexagons, engine='sjoin', max_failed_joins_perc=100)
+    joined = join_sr_to_gpd_data_extract(sr_data.copy(), hexagons, engine='h3', max_failed_joins_perc=100)
+
+    # H3 cell boundaries are geodesic and the polygons are straight in degrees, so a point on an edge can differ
+    assert (joined['index'] == expected['index']).mean() > 0.99
+    assert (joined.loc[sr_data['latitude'].isna(), 'index'] == '0').all()
+
+
+def test_h3_join_needs_a_single_resolution():
+    hexagons = pd.concat([generate_hexagons(bounds=BOUNDS), generate_hexagons(resolution=9, bounds=BOUNDS)])
+
+    with pytest.raises(ValueError, match='single resolution'):
+        join_sr_to_gpd_data_extract(generate_sr_data(10, bounds=BOUNDS), hexagons, engine='h3')
+
+
+def test_partitioned_join_matches_the_spatial_join():
+    hexagons = generate_hexagons(bounds=BOUNDS)
+    sr_data = generate_sr_data(2000, bounds=BOUNDS)
+
+    expected = join_sr_to_gpd_data_extract(sr_data.copy(), hexagons, engine='sjoin', max_failed_joins_perc=100)
+    joined = join_sr_to_gpd_data_extract(sr_data.copy(), hexagons, engine='partitioned', max_failed_joins_perc=100,
+                                         max_workers=2)
+
+    pd.testing.assert_series_equal(joined['index'], expected['index'])
+    pd.testing.assert_series_equal(joined['centroid_lat'], expected['centroid_lat'])
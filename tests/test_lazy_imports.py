@@ -0,0 +1,38 @@
+import subprocess
+import sys
+from pathlib import Path
+from src.utils.lazy_imports import LazyFunction, source_tree_hash
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def test_importing_main_defers_the_heavy_imports():
+    # A fresh interpreter, the test session has already imported them
+    code = ('import sys, main; args = main.parse_args(["--headless", "--targets", "validation_result"]); '
+            'print(args.headless, args.targets, *sorted({"IPython", "boto3", "geopandas", "geopy", "pandas", '
+            '"pyproj"} & set(sys.modules)))')
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+
+    assert result.stdout.split() == ['True', 'validation_result']
+
+
+def test_lazy_function_reads_its_source_without_importing_the_module(tmp_path, monkeypatch):
+    package = tmp_path / 'lazy_pkg'
+    package.mkdir()
+    (package / '__init__.py').write_text('')
+    (package / 'helpers.py').write_text('def scale(x):\n    return 2 * x\n')
+    (package / 'stage.py').write_text('from lazy_pkg.helpers import scale\n\n\ndef run(x):\n    return scale(x) + 1\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for module_name in ['lazy_pkg', 'lazy_pkg.helpers', 'lazy_pkg.stage']:
+        monkeypatch.delitem(sys.modules, module_name, raising=False)
+
+    run = LazyFunction('lazy_pkg.stage', 'run')
+    assert run.source().startswith('def run(x):')
+    code_hash = source_tree_hash(run.source_file(), package='lazy_pkg')
+    assert 'lazy_pkg.stage' not in sys.modules
+
+    assert run(3) == 7 and 'lazy_pkg.stage' in sys.modules
+
+    # The hash follows the helpers the function's module imports
+    (package / 'helpers.py').write_text('def scale(x):\n    return 3 * x  # tripled\n')
+    assert source_tree_hash(run.source_file(), package='lazy_pkg') != code_hash
@@ -0,0 +1,42 @@
+import contextvars
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from src.utils.metrics import PROFILE_ENV_FLAG, MetricsRecorder
+from src.utils.scheduler import call_with_retries
+
+
+def test_spans_in_worker_threads_are_children_of_the_open_span():
+    recorder = MetricsRecorder()
+
+    def read():
+        with recorder.span('read'):
+            recorder.add_bytes_read(10)
+
+    with recorder.span('main') as main:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for future in [executor.submit(contextvars.copy_context().run, read) for _ in range(2)]:
+                future.result()
+        call_with_retries(read, timeout=5)
+
+    reads = [record for record in recorder.spans if record['name'] == 'read']
+    assert len(reads) == 3
+    assert all(record['parent_id'] == main['span_id'] and record['depth'] == 1 for record in reads)
+    assert main['bytes_read'] == 30
+
+
+def test_tracemalloc_runs_until_the_last_top_level_span_ends(monkeypatch):
+    monkeypatch.setenv(PROFILE_ENV_FLAG, '1')
+    recorder = MetricsRecorder()
+
+    def second_root():
+        with recorder.span('second'):
+            pass
+
+    with recorder.span('first'):
+        # An empty context stands in for a thread started without a copy of the context
+        contextvars.Context().run(second_root)
+        assert tracemalloc.is_tracing()
+
+    assert not tracemalloc.is_tracing()
+    assert [record['parent_id'] for record in recorder.spans] == [None, None]
+    assert all(record['python_peak_mb'] is not None for record in recorder.spans)
@@ -0,0 +1,60 @@
+import json
+import os
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from src.utils.output_sink import PartitionedParquetWriter, read_partitioned_output, write_partitioned_output
+
+CELLS = ['88ad360001fffff', '88ad361801fffff', '88ad36d5e1fffff']
+
+
+def results(reference_numbers, months):
+    return pd.DataFrame({
+        'reference_number': reference_numbers,
+        'index': [CELLS[number % len(CELLS)] for number in reference_numbers],
+        'creation_timestamp': pd.to_datetime([f'2020-{month:02d}-15 10:00' for month in months], utc=True),
+    })
+
+
+def test_overwrite_publishes_a_new_version(tmp_path):
+    output_dir = tmp_path / 'output'
+    write_partitioned_output(results([1, 2, 3], [1, 1, 2]), output_dir)
+    first_version = os.readlink(output_dir)
+    write_partitioned_output(results([4, 5], [3, 3]), output_dir)
+
+    assert os.path.islink(output_dir) and os.readlink(output_dir) != first_version
+    df = read_partitioned_output(output_dir)
+    assert sorted(df['reference_number']) == [4, 5]
+    # The previous version stays readable for readers that opened it
+    assert (tmp_path / first_version).is_dir()
+
+
+def test_append_keeps_the_other_parts(tmp_path):
+    output_dir = tmp_path / 'output'
+    for part_name, reference_numbers in [('a', [1, 2]), ('b', [3]), ('a', [1, 2, 4])]:
+        with PartitionedParquetWriter(output_dir, part_name=part_name, mode='append') as writer:
+            writer.write(results(reference_numbers, [1] * len(reference_numbers)))
+
+    df = read_partitioned_output(output_dir, filters=[('month', '=', '2020-01')])
+    assert sorted(df['reference_number']) == [1, 2, 3, 4]
+    np.testing.assert_array_equal(
+        read_partitioned_output(output_dir, filters=[('index', '=', CELLS[0])])['reference_number'], [3])
+
+
+def test_geoparquet_metadata_is_computed_per_file(tmp_path):
+    df = results([0, 1, 3, 4], [1, 1, 1, 1])
+    gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy([18.6, 18.7, 18.5, 18.9], [-33.9, -33.8, -34.0, -33.7]),
+                           crs='EPSG:4326')
+    output_dir = tmp_path / 'output'
+    with PartitionedParquetWriter(output_dir, row_group_size=1) as writer:
+        writer.write(gdf.iloc[:2])
+        writer.write(gdf.iloc[2:])
+
+    bboxes = {}
+    for path in output_dir.rglob('*.parquet'):
+        geo_metadata = json.loads(pq.read_schema(path).metadata[b'geo'])
+        bboxes[path.parent.parent.name] = geo_metadata['columns']['geometry']['bbox']
+    # Reference numbers 0 and 3 share the first hexagon and are written as two row groups of the same file
+    assert sorted(bboxes.values()) == [[18.5, -34.0, 18.6, -33.9], [18.7, -33.8, 18.9, -33.7]]
+    assert len(read_partitioned_output(output_dir)) == 4
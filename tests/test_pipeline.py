@@ -0,0 +1,59 @@
+import functools
+import sys
+import src.utils.pipeline
+from src.utils.lazy_imports import LazyFunction, source_tree_hash
+from src.utils.pipeline import Pipeline
+
+
+def write_package(root):
+    package_dir = root / 'stagepkg'
+    package_dir.mkdir()
+    (package_dir / '__init__.py').write_text('')
+    (package_dir / 'stage.py').write_text(
+        'def run(x):\n'
+        '    from stagepkg.helpers import double\n'
+        '    return double(x)\n')
+    (package_dir / 'helpers.py').write_text('def double(x):\n    return 2 * x\n')
+
+    return package_dir
+
+
+def test_editing_a_helper_re_runs_the_node(tmp_path, monkeypatch):
+    package_dir = write_package(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    # The test package stands in for src
+    monkeypatch.setattr(src.utils.pipeline, 'source_tree_hash', functools.partial(source_tree_hash, package='stagepkg'))
+
+    pipeline = Pipeline(tmp_path / 'pipeline')
+    pipeline.add('doubled', LazyFunction('stagepkg.stage', 'run'), params={'x': 2})
+    assert pipeline.run(['doubled']) == {'doubled': 4}
+    fingerprint = pipeline.fingerprints(['doubled'])['doubled']
+
+    (package_dir / 'helpers.py').write_text('def double(x):\n    return 2 * x + 1\n')
+    for module_name in ['stagepkg', 'stagepkg.stage', 'stagepkg.helpers']:
+        sys.modules.pop(module_name, None)
+
+    assert pipeline.fingerprints(['doubled'])['doubled'] != fingerprint
+    assert pipeline.run(['doubled']) == {'doubled': 5}
+
+
+def test_version_is_part_of_the_fingerprint(tmp_path):
+    versions = iter(['v1', 'v1', 'v2'])
+    pipeline = Pipeline(tmp_path / 'pipeline')
+    pipeline.add('value', lambda: 1, version=lambda: next(versions))
+
+    first, second, third = (pipeline.fingerprints()['value'] for _ in range(3))
+    assert first == second != third
+
+
+def test_node_with_a_missing_output_runs_again(tmp_path):
+    output_path = tmp_path / 'output.txt'
+    pipeline = Pipeline(tmp_path / 'pipeline')
+    pipeline.add('written', lambda path: path.write_text('result'), params={'path': output_path},
+                 exists=output_path.exists)
+
+    pipeline.run(['written'])
+    output_path.unlink()
+    pipeline.run(['written'])
+
+    assert output_path.read_text() == 'result'
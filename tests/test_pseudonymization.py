@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.utils.pseudonymization import (PSEUDONYMIZATION_KEY_ENV, Pseudonymizer, load_pseudonymization_key,
+                                        siphash24_uint64)
+
+
+def test_siphash_reference_vector():
+    # Key 00 01 .. 0f and message 00 01 .. 07 of the SipHash paper
+    key = np.frombuffer(bytes(range(16)), dtype='<u8').astype(np.uint64)
+    message = np.frombuffer(bytes(range(8)), dtype='<u8').astype(np.uint64)
+
+    assert siphash24_uint64(message, key[0], key[1])[0] == np.uint64(0x93f5f5799a932462)
+
+
+def test_key_is_required_for_joinable_releases(tmp_path, monkeypatch):
+    monkeypatch.delenv(PSEUDONYMIZATION_KEY_ENV, raising=False)
+    config_path = tmp_path / 'dl.cfg'
+    config_path.write_text('[PSEUDONYMIZATION]\nKEY=\n')
+
+    with pytest.raises(ValueError):
+        load_pseudonymization_key(config_path, required=True)
+    config_path.write_text('[PSEUDONYMIZATION]\nKEY=secret\n')
+    assert load_pseudonymization_key(config_path, required=True) == b'secret'
+
+
+def test_pseudonyms_are_stable_for_a_key():
+    reference_numbers = pd.Series([9_100_000_001.0, np.nan, 9_100_000_001.0, 9_100_000_002.0])
+    first = Pseudonymizer(key=b'key').pseudonymize(reference_numbers)
+
+    assert first.equals(Pseudonymizer(key=b'key').pseudonymize(reference_numbers))
+    assert first[0] == first[2] != first[3] and first[1] is None
+    assert not first.equals(Pseudonymizer(key=b'other key').pseudonymize(reference_numbers))
+
+
+def test_mapping_table_is_kept_between_runs(tmp_path):
+    mapping_path = tmp_path / 'pseudonyms.parquet'
+    pseudonymizer = Pseudonymizer(key=b'key', mapping_path=mapping_path)
+    first = pseudonymizer.pseudonymize(pd.Series(['a', 'b']))
+    pseudonymizer.save()
+
+    second = Pseudonymizer(key=b'key', mapping_path=mapping_path).pseudonymize(pd.Series(['b', 'a']))
+    assert list(second) == list(first[::-1])
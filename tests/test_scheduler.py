@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+import pytest
+from benchmarks.local_s3 import LocalS3Client
+from src.utils.extract_data import get_city_geojson
+from src.utils.scheduler import call_with_retries
+
+
+class FlakySource:
+    """
+    A source whose first attempts fail or take too long, recording how many attempts ran at the same time.
+    """
+
+    def __init__(self, failures=0, delays=()):
+        self.failures = failures
+        self.delays = list(delays)
+        self.attempts = 0
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.attempts += 1
+            attempt = self.attempts
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            if attempt <= len(self.delays):
+                time.sleep(self.delays[attempt - 1])
+            if attempt <= self.failures:
+                raise ConnectionError(f'attempt {attempt} failed')
+            return attempt
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def test_failed_attempts_are_retried():
+    source = FlakySource(failures=2)
+
+    assert call_with_retries(source, retries=2, backoff=0) == 3
+
+
+def test_permanent_failure_is_raised():
+    source = FlakySource(failures=10)
+
+    with pytest.raises(ConnectionError):
+        call_with_retries(source, retries=2, backoff=0)
+    assert source.attempts == 3
+
+
+def test_timed_out_attempt_stops_before_the_retry():
+    source = FlakySource(delays=[0.3])
+
+    assert call_with_retries(source, timeout=0.2, retries=1, backoff=0) == 2
+    assert source.max_running == 1
+
+
+def test_timed_out_attempt_still_running_is_not_retried():
+    source = FlakySource(delays=[1.0])
+
+    with pytest.raises(TimeoutError):
+        call_with_retries(source, timeout=0.1, retries=3, backoff=0)
+    assert source.attempts == 1
+
+
+def test_failed_polygon_extract_is_retried(tmp_path):
+    s3_client = LocalS3Client(tmp_path)
+    feature = {'type': 'Feature', 'properties': {'index': '88ad360001fffff'},
+               'geometry': {'type': 'Point', 'coordinates': [18.6, -33.9]}}
+    s3_client.put_object(Bucket='bucket', Key='hexagons.geojson',
+                         Body=json.dumps({'type': 'FeatureCollection', 'features': [feature]}).encode('utf-8'))
+    select_object_content = s3_client.select_object_content
+    failures = [ConnectionError('connection reset')]
+
+    def flaky_select_object_content(**kwargs):
+        if failures:
+            raise failures.pop()
+        return select_object_content(**kwargs)
+
+    s3_client.select_object_content = flaky_select_object_content
+    kwargs = {'bucket_name': 'bucket', 'object_key': 'hexagons.geojson', 's3_client': s3_client,
+              'query_expression': "SELECT * FROM S3Object[*]['features'][*] as obj"}
+
+    records = call_with_retries(get_city_geojson, kwargs, retries=1, backoff=0)
+    assert json.loads(records)['properties'] == feature['properties']
+    with pytest.raises(FileNotFoundError):
+        get_city_geojson(**dict(kwargs, object_key='missing.geojson'))
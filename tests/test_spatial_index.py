@@ -0,0 +1,13 @@
+import numpy as np
+import pandas as pd
+from src.utils.spatial_index import SRSpatialIndex
+
+
+def test_point_on_the_grid_edge_is_indexed():
+    # (max - min) // cell_size and floor((max - min) / cell_size) disagree for these latitudes
+    lat = [-33.725203156163474, -33.475203156163474]
+    index = SRSpatialIndex(pd.DataFrame({'latitude': lat, 'longitude': [18.5, 18.5]}))
+
+    assert index.n_rows == int(index._cell_row(np.array(lat)).max()) + 1
+    assert list(index.query_radius(lat[1], 18.5, 50)) == [1]
+    assert list(index.query_radius(lat[0], 18.5, 50)) == [0]
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic_data import (MISSING_LOCATION_SHARE, generate_hexagons, generate_raw_wind_data,
+                                       generate_sr_data)
+from src.utils.constants import SR_DTYPES, WIND_STATIONS
+from src.utils.hexagons import h3_resolution, h3_string_to_int
+from src.utils.transformations import clean_wind_data
+
+# A small part of Bellville South
+BOUNDS = (-33.93, -33.90, 18.62, 18.66)
+
+
+def test_sr_data_is_reproducible_and_typed_like_the_extract():
+    sr_data = generate_sr_data(20_000, bounds=BOUNDS, seed=1)
+
+    pd.testing.assert_frame_equal(sr_data, generate_sr_data(20_000, bounds=BOUNDS, seed=1))
+    assert sr_data['reference_number'].is_unique
+    assert {column: str(sr_data[column].dtype) for column in ['latitude', 'longitude', 'department']} == {
+        column: SR_DTYPES[column] for column in ['latitude', 'longitude', 'department']}
+    assert abs(sr_data['latitude'].isna().mean() - MISSING_LOCATION_SHARE) < 0.01
+    assert sr_data['latitude'].between(BOUNDS[0], BOUNDS[1]).sum() == sr_data['latitude'].notna().sum()
+    assert (sr_data['completion_timestamp'] > sr_data['creation_timestamp']).all()
+
+
+def test_hexagons_and_wind_data_have_the_shape_of_the_sources():
+    hexagons = generate_hexagons(resolution=9, bounds=BOUNDS)
+    assert list(hexagons.columns) == ['index', 'centroid_lat', 'centroid_lon', 'geometry']
+    assert (h3_resolution(h3_string_to_int(hexagons['index'])) == 9).all()
+
+    raw_wind_df = generate_raw_wind_data(year=2020)
+    wind_df = clean_wind_data(raw_wind_df)
+    # 2020 is a leap year, the 8 footer rows are dropped
+    assert len(raw_wind_df) == 366 * 24 + 8 and len(wind_df) == 366 * 24
+    assert wind_df.shape[1] == 2 * len(WIND_STATIONS) and (wind_df.dtypes == np.float32).all()
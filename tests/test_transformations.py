@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+from geopy.distance import geodesic
+from shapely.geometry import Point
+from benchmarks.synthetic_data import generate_hexagons, generate_raw_wind_data, generate_sr_data
+from src.utils.pseudonymization import Pseudonymizer
+from src.utils.transformations import (anonymize_sr_data, clean_wind_data, filter_sr_data_by_distance,
+                                       merge_wind_data, process_sr_data_chunks)
+
+
+# A small part of Bellville South
+BOUNDS = (-33.93, -33.90, 18.62, 18.66)
+
+DATE = ('Date & Time', 'Unnamed: 0_level_1', 'Unnamed: 0_level_2')
+DIRECTION = ('Bellville South AQM Site', 'Wind Dir V', 'Deg')
+SPEED = ('Bellville South AQM Site', 'Wind Speed V', 'm/s')
+
+
+def raw_wind_df(dates, directions, speeds):
+    return pd.DataFrame({DATE: dates, DIRECTION: np.float32(directions), SPEED: np.float32(speeds)})
+
+
+def test_clean_wind_data_interpolates_and_averages_directions_on_the_circle():
+    df = raw_wind_df(['01/01/2020 00:00', '01/01/2020 01:00', '01/01/2020 02:00', '01/01/2020 03:00', None, 'Notes'],
+                     [350, np.nan, 10, 20, np.nan, np.nan], [2, np.nan, 4, 6, np.nan, np.nan])
+
+    interpolated = clean_wind_data(df, interpolate_limit=1)
+    assert list(interpolated.columns) == ['bellville_south_aqm_site_wind_dir_v_deg',
+                                          'bellville_south_aqm_site_wind_speed_v_ms']
+    assert str(interpolated.index.tz) == 'UTC' and len(interpolated) == 4
+    # Half way between 350 and 10 degrees is 0, not 180
+    assert interpolated.iloc[1].tolist() == [0, 3]
+
+    resampled = clean_wind_data(df, resample='2h')
+    assert list(resampled.index) == [pd.Timestamp('2020-01-01 01:00', tz='UTC'),
+                                     pd.Timestamp('2020-01-01 03:00', tz='UTC')]
+    np.testing.assert_allclose(resampled.to_numpy(), [[350, 2], [15, 5]], atol=1e-3)
+
+
+def test_clean_wind_data_rejects_invalid_timestamps_before_the_footer():
+    df = raw_wind_df(['01/01/2020 00:00', '2020-01-01 01:00', '01/01/2020 02:00', None],
+                     [10, 20, 30, np.nan], [1, 2, 3, np.nan])
+
+    with pytest.raises(ValueError, match="row 1 : '2020-01-01 01:00'"):
+        clean_wind_data(df)
+
+
+def test_distance_filter_matches_geopy():
+    sr_data = generate_sr_data(2000, bounds=BOUNDS)
+    centroid = Point(18.64, -33.915)
+
+    filtered = filter_sr_data_by_distance(sr_data, centroid, buffer_dist=1000)
+
+    distances = np.array([geodesic((centroid.y, centroid.x), (lat, lon)).meters if not np.isnan(lat) else np.inf
+                          for lat, lon in zip(sr_data['latitude'].astype(float), sr_data['longitude'].astype(float))])
+    np.testing.assert_array_equal(filtered.index, sr_data.index[distances <= 1000])
+    np.testing.assert_allclose(filtered['dist_to_centroid'], distances[distances <= 1000], atol=1e-3)
+
+
+def test_chunked_processing_matches_a_single_chunk():
+    hexagons = generate_hexagons(bounds=BOUNDS)
+    sr_data = generate_sr_data(600, bounds=BOUNDS)
+    wind_df = clean_wind_data(generate_raw_wind_data())
+    params = {'gpd_extract': hexagons, 'location_centroid': Point(18.64, -33.915), 'wind_df': wind_df,
+              'suburb': 'bellville', 'max_failed_joins_perc': 100}
+
+    expected = process_sr_data_chunks([sr_data], pseudonymizer=Pseudonymizer(b'key'), **params)
+    chunked = process_sr_data_chunks([sr_data.iloc[start:start + 150] for start in range(0, 600, 150)],
+                                     pseudonymizer=Pseudonymizer(b'key'), **params)
+
+    # Every chunk is sorted by time for the wind merge, so only the order of the rows differs
+    columns = ['reference_number', 'index', 'timestamp_wind', 'bellville_south_aqm_site_wind_speed_v_ms']
+    pd.testing.assert_frame_equal(chunked[columns].sort_values('reference_number', ignore_index=True),
+                                  expected[columns].sort_values('reference_number', ignore_index=True))
+    # The join error threshold applies to the rows of all the chunks (22% of the rows have no location)
+    with pytest.raises(Exception, match='Failed to join'):
+        process_sr_data_chunks([sr_data.iloc[:300], sr_data.iloc[300:]], pseudonymizer=Pseudonymizer(b'key'),
+                               **dict(params, max_failed_joins_perc=20))
+
+
+def test_anonymization_is_reproducible_and_bounded():
+    sr_data = generate_sr_data(200, bounds=BOUNDS).dropna(subset=['latitude'])
+    sr_data['index'] = '88ad361ac9fffff'
+    sr_data['timestamp_wind'] = sr_data['creation_timestamp']
+    original = sr_data.copy()
+
+    first, second = (anonymize_sr_data(sr_data, 'latitude', 'longitude', rng=7, pseudonymizer=Pseudonymizer(b'key'))
+                     for _ in range(2))
+
+    pd.testing.assert_frame_equal(first, second)
+    pd.testing.assert_frame_equal(sr_data, original)
+    displacements = [geodesic(before, after).meters for before, after in zip(
+        original[['latitude', 'longitude']].to_numpy(float), first[['latitude', 'longitude']].to_numpy(float))]
+    # The coordinates are float32, about 0.1 meter apart
+    assert max(displacements) <= 501 and np.mean(displacements) > 250
+    assert (first['creation_timestamp'].dt.hour % 6 == 0).all()
+    assert (first['creation_timestamp'].dt.minute == 0).all()
+
+
+def test_grouped_wind_merge_matches_the_merge_of_each_site():
+    sr_data = generate_sr_data(1000)
+    raw_wind_df = generate_raw_wind_data()
+
+    merged = merge_wind_data(sr_data, clean_wind_data(raw_wind_df, long_format=True), suburb=None)
+
+    wind_df = clean_wind_data(raw_wind_df)
+    assert len(merged) == len(sr_data) and merged['wind_station'].nunique() > 5
+    assert merged.loc[merged['latitude'].isna(), 'wind_speed_ms'].isna().all()
+    for station, site_rows in merged.dropna(subset=['wind_station']).groupby('wind_station'):
+        expected = merge_wind_data(sr_data[sr_data['reference_number'].isin(site_rows['reference_number'])], wind_df,
+                                   suburb=station)
+        expected = expected.set_index('reference_number').loc[site_rows['reference_number']]
+        np.testing.assert_array_equal(site_rows['wind_speed_ms'], expected[f'{station}_wind_speed_v_ms'])
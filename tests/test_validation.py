@@ -0,0 +1,29 @@
+import pandas as pd
+from benchmarks.synthetic_data import generate_hexagons
+from src.utils.validation import compare_row_hashes, hash_extract_chunks, hash_extract_rows, validate_data_extract
+
+# A small part of Bellville South
+BOUNDS = (-33.93, -33.90, 18.62, 18.66)
+
+
+def test_hash_validation_ignores_the_row_and_column_order():
+    validation_extract = generate_hexagons(bounds=BOUNDS)
+    filtered_extract = validation_extract.assign(resolution=8).iloc[::-1]
+    filtered_extract = filtered_extract[list(filtered_extract.columns[::-1])]
+
+    assert validate_data_extract(filtered_extract, validation_extract)
+    chunks = [filtered_extract.iloc[:10], filtered_extract.iloc[10:]]
+    assert validate_data_extract(iter(chunks), validation_extract)
+
+
+def test_hash_validation_reports_the_differing_keys():
+    validation_extract = generate_hexagons(bounds=BOUNDS)
+    filtered_extract = validation_extract.iloc[1:].copy()
+    filtered_extract.loc[filtered_extract.index[0], 'centroid_lat'] += 1e-9
+    filtered_extract = pd.concat([filtered_extract, filtered_extract.iloc[[-1]]])
+
+    report = compare_row_hashes(hash_extract_rows(filtered_extract), hash_extract_chunks(validation_extract))
+    assert not report['validated'] and not validate_data_extract(filtered_extract, validation_extract)
+    assert report['missing'] == [validation_extract['index'].iloc[0]]
+    assert report['changed'] == [validation_extract['index'].iloc[1]]
+    assert report['duplicated'] == [validation_extract['index'].iloc[-1]] and report['extra'] == []